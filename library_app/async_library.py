@@ -0,0 +1,203 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from .model import PAGE_SIZE, SEARCH_FIELDS, SORT_FIELDS, Library, check_field, isbns_after, listed_after
+
+# calls a batch fallback keeps in flight at once
+BATCH_CONCURRENCY = 64
+
+# threads an ExecutorLibrary runs blocking calls on
+EXECUTOR_WORKERS = 32
+
+
+async def each_concurrently(action, calls, limit=BATCH_CONCURRENCY):
+    '''
+        Await action with each argument tuple of calls, at most limit at a time, carrying on past failures.
+        Calls run concurrently, so of two conflicting calls either may be the one that fails.
+
+    :return: the error raised by each call, None where it succeeded
+    '''
+    semaphore = asyncio.Semaphore(limit)
+
+    async def call(args):
+        async with semaphore:
+            try:
+                await action(*args)
+            except Exception as e:
+                return e
+
+    return list(await asyncio.gather(*(call(args) for args in calls)))
+
+
+class AsyncLibrary(object):
+    '''
+        The asyncio counterpart of Library: every method is a coroutine taking the same arguments,
+        returning the same result and raising the same errors as the Library method of its name.
+        The batch methods fall back to running the single-item coroutines concurrently.
+
+    '''
+
+    async def drop_db(self):
+        raise NotImplementedError()
+
+    async def add_book(self, book):
+        Library.add_book(self, book)
+
+    async def add_books(self, books):
+        return await each_concurrently(self.add_book, [(book,) for book in books])
+
+    async def get_book(self, isbn):
+        raise NotImplementedError()
+
+    async def get_books(self, isbns):
+        return list(await asyncio.gather(*(self.get_book(isbn) for isbn in isbns)))
+
+    async def delete_book(self, isbn):
+        raise NotImplementedError()
+
+    async def edit_book(self, isbn, book, override=False):
+        raise NotImplementedError()
+
+    async def edit_books(self, edits, override=False):
+        return await each_concurrently(lambda isbn, book: self.edit_book(isbn, book, override=override), edits)
+
+    async def search_by_title(self, title):
+        raise NotImplementedError()
+
+    async def search_by_author(self, author):
+        raise NotImplementedError()
+
+    async def sort_by_title(self):
+        raise NotImplementedError()
+
+    async def sort_by_author(self):
+        raise NotImplementedError()
+
+    async def sort_by_isbn(self):
+        raise NotImplementedError()
+
+    async def sort_by_page_num(self):
+        raise NotImplementedError()
+
+    async def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            An async iterator over the books iter_sorted streams; this fallback awaits sort_by_<field>
+
+        '''
+        check_field(field, SORT_FIELDS)
+        for book in listed_after(await getattr(self, 'sort_by_' + field)(), after):
+            yield book
+
+    async def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            An async iterator over the books iter_search streams; this fallback awaits search_by_<field>
+
+        '''
+        check_field(field, SEARCH_FIELDS)
+        for book in isbns_after(await getattr(self, 'search_by_' + field)(value), after):
+            yield book
+
+    async def add_borrower(self, borrower):
+        Library.add_borrower(self, borrower)
+
+    async def get_borrower(self, username):
+        raise NotImplementedError()
+
+    async def delete_borrower(self, username):
+        raise NotImplementedError()
+
+    async def edit_borrower(self, username, borrower, override=False):
+        raise NotImplementedError()
+
+    async def search_by_name(self, name):
+        raise NotImplementedError()
+
+    async def checkout_book(self, username, isbn):
+        raise NotImplementedError()
+
+    async def checkout_many(self, checkouts):
+        return await each_concurrently(self.checkout_book, checkouts)
+
+    async def return_book(self, username, isbn):
+        raise NotImplementedError()
+
+    async def return_many(self, returns):
+        return await each_concurrently(self.return_book, returns)
+
+    async def get_book_borrowers(self, isbn):
+        raise NotImplementedError()
+
+    async def get_borrowed_books(self, username):
+        raise NotImplementedError()
+
+    async def rate_book(self, username, isbn, rating):
+        raise NotImplementedError()
+
+    async def get_rating(self, username, isbn):
+        raise NotImplementedError()
+
+    async def recommend(self, username, k=10):
+        raise NotImplementedError()
+
+
+class ExecutorLibrary(AsyncLibrary):
+    '''
+        Adapts a blocking Library to AsyncLibrary by running each call on a thread pool,
+        for backends whose driver has no asyncio client. Native async backends extend it
+        and keep it for the calls they do not implement themselves.
+
+    '''
+
+    def __init__(self, inner, executor=None):
+        self.inner = inner
+        self.executor = executor or ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+
+    def __getattr__(self, name):
+        # calls outside the Library contract, such as backend specific bulk loads, run on the executor too
+        if name == 'inner':
+            raise AttributeError(name)
+        attribute = getattr(self.inner, name)
+        if not inspect.ismethod(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+
+        return call
+
+    async def run(self, function, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    async def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        async for book in self._pages(await self.run(self.inner.iter_sorted, field, page_size, after), page_size):
+            yield book
+
+    async def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        async for book in self._pages(await self.run(self.inner.iter_search, field, value, page_size, after),
+                                      page_size):
+            yield book
+
+    async def _pages(self, books, page_size):
+        # each page is pulled from the blocking iterator on the executor
+        while True:
+            page = await self.run(lambda: list(islice(books, page_size)))
+            for book in page:
+                yield book
+            if len(page) < page_size:
+                return
+
+
+def delegate(name):
+    async def method(self, *args, **kwargs):
+        return await self.run(getattr(self.inner, name), *args, **kwargs)
+
+    method.__name__ = method.__qualname__ = name
+    return method
+
+
+for name, method in list(vars(AsyncLibrary).items()):
+    if inspect.iscoroutinefunction(method):
+        setattr(ExecutorLibrary, name, delegate(name))
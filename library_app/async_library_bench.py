@@ -0,0 +1,110 @@
+import asyncio
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from library_app.async_library import ExecutorLibrary
+from library_app.model import Book, Borrower
+
+
+def libraries(backend):
+    '''
+
+    :return: the blocking library of backend and its async counterpart, over the same data
+    '''
+    if backend == 'memory':
+        from library_app.memory.memory_library import InMemoryLibrary
+        library = InMemoryLibrary()
+        return library, ExecutorLibrary(library)
+    if backend == 'sqlite':
+        from library_app.sqlite.sqlite_library import SqliteLibrary
+        library = SqliteLibrary()
+        return library, ExecutorLibrary(library)
+    if backend == 'redis':
+        from library_app.redis.redis_async_library import AsyncRedisLibrary
+        library = AsyncRedisLibrary()
+        return library.inner, library
+    if backend == 'mongo':
+        from library_app.mongo.mongo_async_library import AsyncMongoLibrary
+        library = AsyncMongoLibrary()
+        return library.inner, library
+    if backend == 'neo4j':
+        from library_app.neo4j.neo4j_library import Neo4jLibrary
+        library = Neo4jLibrary()
+    else:
+        from library_app.memcached.memcached_library import MemcachedLibrary
+        library = MemcachedLibrary()
+    # their drivers have no asyncio client, so the async side is the executor adapter
+    return library, ExecutorLibrary(library)
+
+
+def load(library, book_num, borrower_num, seed):
+    rand = random.Random(seed)
+    library.drop_db()
+    library.add_books([Book(isbn=str(i), title='title' + str(i % 100), author=['author' + str(i % 50)],
+                            page_num=i % 1000 + 1, quantity=3) for i in range(book_num)])
+    for i in range(borrower_num):
+        library.add_borrower(Borrower(username='user' + str(i), name='name' + str(i), phone=str(i)))
+    library.checkout_many([('user' + str(rand.randrange(borrower_num)), str(rand.randrange(book_num)))
+                           for _ in range(borrower_num * 2)])
+
+
+def requests(request_num, book_num, seed):
+    '''
+
+    :return: the (method, args) of a read-mostly request mix, the same for both sides
+    '''
+    rand = random.Random(seed)
+    mix = []
+    for _ in range(request_num):
+        isbn = str(rand.randrange(book_num))
+        mix.append(rand.choice([('get_book', (isbn,)), ('get_book', (isbn,)), ('get_book_borrowers', (isbn,)),
+                                ('search_by_title', ('title' + str(rand.randrange(100)),))]))
+    return mix
+
+
+def run_sync(library, mix, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        for future in [executor.submit(getattr(library, method), *args) for method, args in mix]:
+            future.result()
+        return time.perf_counter() - start
+
+
+async def run_async(library, mix, concurrency):
+    pending = iter(mix)
+
+    async def caller():
+        for method, args in pending:
+            await getattr(library, method)(*args)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def compare(library, async_library, mix, concurrencies):
+    # one event loop throughout, as asyncio clients are bound to the loop they first run on
+    print('{:>12} {:>14} {:>14}'.format('concurrency', 'sync_req_s', 'async_req_s'))
+    for concurrency in concurrencies:
+        sync_seconds = run_sync(library, mix, concurrency)
+        async_seconds = await run_async(async_library, mix, concurrency)
+        print('{:>12} {:>14.0f} {:>14.0f}'.format(concurrency, len(mix) / sync_seconds, len(mix) / async_seconds))
+
+
+def main(backend='memory', concurrencies=(1, 10, 100, 1000), request_num=20000, book_num=10000, borrower_num=1000,
+         seed=42):
+    '''
+        Compare the requests per second of the blocking library on a thread per caller against
+        its AsyncLibrary counterpart with a coroutine per caller
+
+    '''
+    library, async_library = libraries(backend)
+    load(library, book_num, borrower_num, seed)
+    asyncio.run(compare(library, async_library, requests(request_num, book_num, seed), concurrencies))
+    library.drop_db()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,80 @@
+import asyncio
+import inspect
+import threading
+import unittest
+
+from library_app.async_library import ExecutorLibrary, each_concurrently
+from library_app.library_test import LibraryTest, RatingLibraryTest
+from library_app.memory.memory_library import InMemoryLibrary
+
+
+async def collect(books):
+    return [book async for book in books]
+
+
+class BlockingLibrary(object):
+    '''
+        Drives an AsyncLibrary from the blocking LibraryTest suites on a private event loop per thread,
+        as a loop already running in one thread cannot be run by another
+
+    '''
+
+    def __init__(self, library):
+        self.library = library
+        self.local = threading.local()
+        self.loops = []
+
+    @property
+    def loop(self):
+        if not hasattr(self.local, 'loop'):
+            self.local.loop = asyncio.new_event_loop()
+            self.loops.append(self.local.loop)
+        return self.local.loop
+
+    def __getattr__(self, name):
+        attribute = getattr(self.library, name)
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if inspect.isasyncgen(result):
+                return iter(self.loop.run_until_complete(collect(result)))
+            return self.loop.run_until_complete(result)
+
+        return call
+
+    def close(self):
+        for loop in self.loops:
+            loop.close()
+
+
+class ExecutorLibraryTest(LibraryTest, RatingLibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        self.client = BlockingLibrary(ExecutorLibrary(InMemoryLibrary()))
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_each_concurrently(self):
+        running = []
+        peak = []
+
+        async def action(value):
+            running.append(value)
+            peak.append(len(running))
+            await asyncio.sleep(0)
+            running.remove(value)
+            if value % 2:
+                raise Exception('odd')
+
+        errors = self.client.loop.run_until_complete(each_concurrently(action, [(i,) for i in range(10)], limit=3))
+        self.assertEqual([None, 'odd'] * 5, [str(e) if e else None for e in errors])
+        self.assertEqual(3, max(peak))
+
+    def test_backend_specific_calls_run_on_executor(self):
+        self.assertEqual(self.client.library.lock, self.client.library.inner.lock)
+        self.assertEqual(self.client._books(['1']), self.client.library.inner._books(['1']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,335 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+from .model import PAGE_SIZE, Book, Borrower, Library
+
+CACHE_SIZE = 10000
+CACHE_TTL = 60.0
+# misses are cached for less time, so an added record shows up quickly even if a write bypassed the cache
+NEGATIVE_CACHE_TTL = 5.0
+
+
+def clone(value):
+    '''
+        Copy a cached value so callers cannot mutate the cache through what they were given
+
+    '''
+    if type(value) is list:
+        return [clone(item) for item in value]
+    if type(value) is Book:
+        return Book(title=value.title, author=list(value.author) if value.author is not None else None,
+                    isbn=value.isbn, page_num=value.page_num, quantity=value.quantity)
+    if type(value) is Borrower:
+        return Borrower(username=value.username, name=value.name, phone=value.phone)
+    return value
+
+
+def book_tag(isbn):
+    return 'book:' + str(isbn)
+
+
+def borrower_tag(username):
+    return 'borrower:' + str(username)
+
+
+def title_tag(title):
+    return 'title:' + str(title)
+
+
+def book_checkout_tag(isbn):
+    return 'checkout-book:' + str(isbn)
+
+
+def borrower_checkout_tag(username):
+    return 'checkout-borrower:' + str(username)
+
+
+def checkout_tags(pairs):
+    return [tag for username, isbn in pairs for tag in (book_checkout_tag(isbn), borrower_checkout_tag(username))]
+
+
+class CachedLibrary(Library):
+    '''
+        Wraps another Library with an in-process LRU cache of get_book, get_borrower, search_by_title,
+        get_book_borrowers and get_borrowed_books. Each entry is tagged with the records it was built from,
+        and a write drops exactly the entries carrying the tags it touches.
+
+    '''
+
+    def __init__(self, inner, max_size=CACHE_SIZE, ttl=CACHE_TTL, negative_ttl=NEGATIVE_CACHE_TTL,
+                 clock=time.monotonic):
+        self.inner = inner
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # key -> (expires, value, tags), least recently used first
+        self.entries = OrderedDict()
+        self.tagged = {}
+        # bumped by every invalidation; a read that overlapped one is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        # calls outside the Library contract, such as backend specific bulk writes, go to the inner
+        # library; the cache cannot tell what they change, so it is dropped after each of them
+        if name == 'inner':
+            raise AttributeError(name)
+        attribute = getattr(self.inner, name)
+        if not inspect.ismethod(attribute):
+            return attribute
+
+        def forward(*args, **kwargs):
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self.clear()
+
+        return forward
+
+    def stats(self):
+        '''
+
+        :return: the hit, miss and eviction counters and the number of cached entries
+        '''
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tagged.clear()
+            self.generation += 1
+
+    def _remove(self, key):
+        expires, value, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tagged[tag]
+
+    def invalidate(self, *tags):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tagged.get(tag, ())):
+                    self._remove(key)
+            self.generation += 1
+
+    def _cached(self, key, load, tags):
+        '''
+            Return the cached value of key, or load it and cache it with the tags tags(value) when missing
+
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return clone(entry[1])
+                self._remove(key)
+            self.misses += 1
+            generation = self.generation
+        value = load()
+        with self.lock:
+            if generation == self.generation:
+                self._store(key, value, tags(value))
+        return value
+
+    def _store(self, key, value, tags):
+        if key in self.entries:
+            self._remove(key)
+        ttl = self.negative_ttl if value is None or value == [] else self.ttl
+        self.entries[key] = (self.clock() + ttl, clone(value), tags)
+        for tag in tags:
+            self.tagged.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def drop_db(self):
+        '''
+            Drop the whole database so we can start from scratch
+
+        '''
+        try:
+            self.inner.drop_db()
+        finally:
+            self.clear()
+
+    def add_book(self, book):
+        try:
+            self.inner.add_book(book)
+        finally:
+            if book is not None:
+                self.invalidate(book_tag(book.isbn), title_tag(book.title))
+
+    def add_books(self, books):
+        books = list(books)
+        try:
+            return self.inner.add_books(books)
+        finally:
+            self.invalidate(*[tag for book in books if book is not None
+                              for tag in (book_tag(book.isbn), title_tag(book.title))])
+
+    def get_book(self, isbn):
+        return self._cached(('get_book', isbn), lambda: self.inner.get_book(isbn), lambda book: {book_tag(isbn)})
+
+    def get_books(self, isbns):
+        '''
+            Serve the cached books and load the rest with one call to the inner library
+
+        '''
+        books = {}
+        missing = []
+        with self.lock:
+            now = self.clock()
+            for isbn in isbns:
+                entry = self.entries.get(('get_book', isbn))
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end(('get_book', isbn))
+                    self.hits += 1
+                    books[isbn] = clone(entry[1])
+                elif isbn not in books:
+                    self.misses += 1
+                    books[isbn] = None
+                    missing.append(isbn)
+            generation = self.generation
+        loaded = self.inner.get_books(missing) if missing else []
+        with self.lock:
+            for isbn, book in zip(missing, loaded):
+                books[isbn] = book
+                if generation == self.generation:
+                    self._store(('get_book', isbn), book, {book_tag(isbn)})
+        return [clone(books[isbn]) for isbn in isbns]
+
+    def delete_book(self, isbn):
+        try:
+            self.inner.delete_book(isbn)
+        finally:
+            self.invalidate(book_tag(isbn))
+
+    def edit_book(self, isbn, book, override=False):
+        try:
+            self.inner.edit_book(isbn, book, override=override)
+        finally:
+            # the book's tag drops the searches it appeared in under its old title
+            tags = [book_tag(isbn)]
+            if override or book.title:
+                tags.append(title_tag(book.title))
+            self.invalidate(*tags)
+
+    def edit_books(self, edits, override=False):
+        edits = list(edits)
+        try:
+            return self.inner.edit_books(edits, override=override)
+        finally:
+            tags = []
+            for isbn, book in edits:
+                tags.append(book_tag(isbn))
+                if override or book.title:
+                    tags.append(title_tag(book.title))
+            self.invalidate(*tags)
+
+    def search_by_title(self, title):
+        return self._cached(('search_by_title', title), lambda: self.inner.search_by_title(title),
+                            lambda books: {title_tag(title)} | {book_tag(book.isbn) for book in books})
+
+    def search_by_author(self, author):
+        return self.inner.search_by_author(author)
+
+    def sort_by_title(self):
+        return self.inner.sort_by_title()
+
+    def sort_by_author(self):
+        return self.inner.sort_by_author()
+
+    def sort_by_isbn(self):
+        return self.inner.sort_by_isbn()
+
+    def sort_by_page_num(self):
+        return self.inner.sort_by_page_num()
+
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        return self.inner.iter_sorted(field, page_size, after)
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        return self.inner.iter_search(field, value, page_size, after)
+
+    def add_borrower(self, borrower):
+        try:
+            self.inner.add_borrower(borrower)
+        finally:
+            if borrower is not None:
+                self.invalidate(borrower_tag(borrower.username))
+
+    def get_borrower(self, username):
+        return self._cached(('get_borrower', username), lambda: self.inner.get_borrower(username),
+                            lambda borrower: {borrower_tag(username)})
+
+    def delete_borrower(self, username):
+        try:
+            self.inner.delete_borrower(username)
+        finally:
+            self.invalidate(borrower_tag(username))
+
+    def edit_borrower(self, username, borrower, override=False):
+        try:
+            self.inner.edit_borrower(username, borrower, override=override)
+        finally:
+            self.invalidate(borrower_tag(username))
+
+    def search_by_name(self, name):
+        return self.inner.search_by_name(name)
+
+    def checkout_book(self, username, isbn):
+        try:
+            self.inner.checkout_book(username, isbn)
+        finally:
+            self.invalidate(book_checkout_tag(isbn), borrower_checkout_tag(username))
+
+    def checkout_many(self, checkouts):
+        checkouts = list(checkouts)
+        try:
+            return self.inner.checkout_many(checkouts)
+        finally:
+            self.invalidate(*checkout_tags(checkouts))
+
+    def return_book(self, username, isbn):
+        try:
+            self.inner.return_book(username, isbn)
+        finally:
+            self.invalidate(book_checkout_tag(isbn), borrower_checkout_tag(username))
+
+    def return_many(self, returns):
+        returns = list(returns)
+        try:
+            return self.inner.return_many(returns)
+        finally:
+            self.invalidate(*checkout_tags(returns))
+
+    def get_book_borrowers(self, isbn):
+        return self._cached(('get_book_borrowers', isbn), lambda: self.inner.get_book_borrowers(isbn),
+                            lambda borrowers: {book_tag(isbn), book_checkout_tag(isbn)} |
+                                              {borrower_tag(borrower.username) for borrower in borrowers})
+
+    def get_borrowed_books(self, username):
+        return self._cached(('get_borrowed_books', username), lambda: self.inner.get_borrowed_books(username),
+                            lambda books: {borrower_tag(username), borrower_checkout_tag(username)} |
+                                          {book_tag(book.isbn) for book in books})
+
+    def rate_book(self, username, isbn, rating):
+        return self.inner.rate_book(username, isbn, rating)
+
+    def get_rating(self, username, isbn):
+        return self.inner.get_rating(username, isbn)
+
+    def recommend(self, username, k=10):
+        return self.inner.recommend(username, k)
@@ -0,0 +1,132 @@
+import unittest
+from copy import copy
+
+from library_app.cached_library import CachedLibrary
+from library_app.library_test import LibraryTest, RatingLibraryTest, book_toadd, book_toadd2, borrower_toadd1
+from library_app.memory.memory_library import InMemoryLibrary
+from library_app.model import Book, Borrower
+from library_app.sqlite.sqlite_library import SqliteLibrary
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CachedLibraryTest(LibraryTest, RatingLibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        self.inner = InMemoryLibrary()
+        self.clock = FakeClock()
+        self.client = CachedLibrary(self.inner, max_size=4, ttl=10, negative_ttl=1, clock=self.clock)
+
+    def test_get_book_hit(self):
+        self.client.get_book('1')
+        book = self.client.get_book('1')
+        book.title = 'changed'
+
+        self.assertEqual(self.client.get_book('1'), book_toadd)
+        self.assertEqual(self.client.stats(), {'hits': 2, 'misses': 1, 'evictions': 0, 'size': 1})
+
+    def test_ttl_expires(self):
+        self.client.get_book('1')
+        self.inner.edit_book('1', Book(title='behind_the_cache'))
+        self.assertEqual(self.client.get_book('1'), book_toadd)
+
+        self.clock.now = 10
+        self.assertEqual(self.client.get_book('1').title, 'behind_the_cache')
+
+    def test_negative_cache(self):
+        self.assertIsNone(self.client.get_book('2'))
+        self.inner.add_book(book_toadd2)
+        self.assertIsNone(self.client.get_book('2'))
+
+        self.clock.now = 1
+        self.assertEqual(self.client.get_book('2'), book_toadd2)
+
+    def test_add_book_invalidates_miss(self):
+        self.assertIsNone(self.client.get_book('2'))
+        self.assertListEqual(self.client.search_by_title(book_toadd2.title), [])
+        self.client.add_book(book_toadd2)
+
+        self.assertEqual(self.client.get_book('2'), book_toadd2)
+        self.assertListEqual(self.client.search_by_title(book_toadd2.title), [book_toadd2])
+
+    def test_edit_title_invalidates_old_and_new_search(self):
+        self.client.add_book(book_toadd2)
+        self.assertListEqual(self.client.search_by_title(book_toadd.title), [book_toadd])
+        self.assertListEqual(self.client.search_by_title(book_toadd2.title), [book_toadd2])
+        self.client.edit_book('1', Book(title=book_toadd2.title))
+        edited = copy(book_toadd)
+        edited.title = book_toadd2.title
+
+        self.assertListEqual(self.client.search_by_title(book_toadd.title), [])
+        self.assertCountEqual(self.client.search_by_title(book_toadd2.title), [edited, book_toadd2])
+
+    def test_get_books_loads_only_misses(self):
+        self.client.add_book(book_toadd2)
+        self.client.get_book('1')
+        self.assertEqual(self.client.get_books(['1', '2', '4']), [book_toadd, book_toadd2, None])
+        self.assertEqual(self.client.stats(), {'hits': 1, 'misses': 3, 'evictions': 0, 'size': 3})
+
+        self.client.edit_books([('2', Book(page_num=10))])
+        self.assertEqual([book.page_num for book in self.client.get_books(['1', '2'])], [200, 10])
+        self.assertEqual(self.client.stats()['hits'], 2)
+
+    def test_precise_invalidation(self):
+        self.client.add_book(book_toadd2)
+        self.client.get_book('1')
+        self.client.get_book('2')
+        self.client.get_borrower('zhangq1')
+        self.client.edit_book('2', Book(page_num=10))
+
+        self.assertEqual(self.client.stats()['size'], 2)
+        self.client.get_book('1')
+        self.client.get_borrower('zhangq1')
+        self.assertEqual(self.client.stats()['hits'], 2)
+
+    def test_checkout_invalidates_borrowers(self):
+        self.assertListEqual(self.client.get_book_borrowers('1'), [])
+        self.assertListEqual(self.client.get_borrowed_books('zhangq1'), [])
+        self.client.checkout_book('zhangq1', '1')
+
+        self.assertListEqual(self.client.get_book_borrowers('1'), [borrower_toadd1])
+        self.assertListEqual(self.client.get_borrowed_books('zhangq1'), [book_toadd])
+        self.client.edit_borrower('zhangq1', Borrower(phone='300'))
+        self.assertEqual(self.client.get_book_borrowers('1')[0].phone, '300')
+        self.client.return_book('zhangq1', '1')
+        self.assertListEqual(self.client.get_borrowed_books('zhangq1'), [])
+
+    def test_batches_from_generators_invalidate(self):
+        self.assertIsNone(self.client.get_book('2'))
+        self.assertListEqual(self.client.get_borrowed_books('zhangq1'), [])
+        self.client.add_books(book for book in [book_toadd2])
+        self.client.checkout_many(pair for pair in [('zhangq1', '2')])
+
+        self.assertEqual(self.client.get_book('2'), book_toadd2)
+        self.assertListEqual(self.client.get_borrowed_books('zhangq1'), [book_toadd2])
+        self.client.edit_books(edit for edit in [('2', Book(title='a_book'))])
+        self.assertEqual(self.client.get_book('2').title, 'a_book')
+        self.client.return_many(pair for pair in [('zhangq1', '2')])
+        self.assertListEqual(self.client.get_borrowed_books('zhangq1'), [])
+
+    def test_lru_eviction(self):
+        for isbn in ['1', 'a', 'b', 'c']:
+            self.client.get_book(isbn)
+        self.client.get_book('1')
+        self.client.get_book('d')
+
+        self.assertEqual(self.client.stats()['evictions'], 1)
+        self.client.get_book('1')
+        self.assertEqual(self.client.stats()['hits'], 2)
+
+    def test_unknown_calls_clear_cache(self):
+        client = CachedLibrary(SqliteLibrary(':memory:'))
+        self.assertIsNone(client.get_book('2'))
+        client.add_books([book_toadd2])
+
+        self.assertEqual(client.get_book('2'), book_toadd2)
+        self.assertEqual(client.conn, client.inner.conn)
@@ -1,8 +1,25 @@
+import os
+
+
 class Config(object):
     """
     Class container used to pass into Click decorators.
     This class should be used to pass configurations flags.
+    Connection settings default to the LIBRARY_* environment variables.
     """
 
     def __init__(self):
         self.verbose = False
+        self.redis_host = os.environ.get('LIBRARY_REDIS_HOST', 'localhost')
+        self.redis_port = int(os.environ.get('LIBRARY_REDIS_PORT', 6379))
+        self.mongo_uri = os.environ.get('LIBRARY_MONGO_URI', 'mongodb://localhost:27017')
+        self.mongo_db = os.environ.get('LIBRARY_MONGO_DB', 'library_db')
+        self.memcached_servers = os.environ.get('LIBRARY_MEMCACHED_SERVERS', '127.0.0.1:11211').split(',')
+        self.neo4j_uri = os.environ.get('LIBRARY_NEO4J_URI', 'bolt://localhost:7687')
+        self.neo4j_user = os.environ.get('LIBRARY_NEO4J_USER', 'neo4j')
+        self.neo4j_password = os.environ.get('LIBRARY_NEO4J_PASSWORD', '12345678')
+        self.sqlite_path = os.environ.get('LIBRARY_SQLITE_PATH', 'library.db')
+        self.pool_size = int(os.environ.get('LIBRARY_POOL_SIZE', 50))
+        self.connect_timeout = float(os.environ.get('LIBRARY_CONNECT_TIMEOUT', 5))
+        self.socket_timeout = float(os.environ.get('LIBRARY_SOCKET_TIMEOUT', 30))
+        self.socket_keepalive = os.environ.get('LIBRARY_SOCKET_KEEPALIVE', '1') != '0'
@@ -0,0 +1,163 @@
+import threading
+
+from .config import Config
+
+settings = Config()
+connections = {}
+lock = threading.Lock()
+# whether connections created from now on count commands and round trips, see instrumented_library
+counting = False
+
+
+def configure(config):
+    '''
+        Use the connection settings of config for connections created from now on
+
+    '''
+    global settings
+    with lock:
+        settings = config
+        connections.clear()
+
+
+def instrument(enabled=True):
+    '''
+        Count the backend commands and round trips of connections created from now on to the
+        InstrumentedLibrary call running on the same thread. Uninstrumented connections pay nothing.
+
+    '''
+    global counting
+    with lock:
+        counting = enabled
+        connections.clear()
+
+
+def get_connection(backend):
+    '''
+        Get the shared, thread-safe connection handle of a backend, creating it on first use
+
+    '''
+    conn = connections.get(backend)
+    if conn is None:
+        with lock:
+            conn = connections.get(backend)
+            if conn is None:
+                conn = connections[backend] = factories[backend](settings)
+    return conn
+
+
+def connect_redis(config):
+    import redis
+    options = {}
+    if counting:
+        from .instrumented_library import redis_connection_class
+        options['connection_class'] = redis_connection_class()
+    pool = redis.BlockingConnectionPool(host=config.redis_host, port=config.redis_port,
+                                        max_connections=config.pool_size,
+                                        timeout=config.connect_timeout,
+                                        socket_connect_timeout=config.connect_timeout,
+                                        socket_timeout=config.socket_timeout,
+                                        socket_keepalive=config.socket_keepalive,
+                                        **options)
+    return redis.Redis(connection_pool=pool)
+
+
+def connect_mongo(config):
+    import pymongo
+    options = {}
+    if counting:
+        from .instrumented_library import mongo_listener
+        options['event_listeners'] = [mongo_listener()]
+    client = pymongo.MongoClient(config.mongo_uri, connect=False,
+                                 maxPoolSize=config.pool_size,
+                                 connectTimeoutMS=int(config.connect_timeout * 1000),
+                                 socketTimeoutMS=int(config.socket_timeout * 1000),
+                                 **options)
+    return client[config.mongo_db]
+
+
+def connect_redis_async(config):
+    import redis.asyncio
+    pool = redis.asyncio.BlockingConnectionPool(host=config.redis_host, port=config.redis_port,
+                                                max_connections=config.pool_size,
+                                                timeout=config.connect_timeout,
+                                                socket_connect_timeout=config.connect_timeout,
+                                                socket_timeout=config.socket_timeout,
+                                                socket_keepalive=config.socket_keepalive)
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+def connect_mongo_async(config):
+    import motor.motor_asyncio
+    client = motor.motor_asyncio.AsyncIOMotorClient(config.mongo_uri,
+                                                    maxPoolSize=config.pool_size,
+                                                    connectTimeoutMS=int(config.connect_timeout * 1000),
+                                                    socketTimeoutMS=int(config.socket_timeout * 1000))
+    return client[config.mongo_db]
+
+
+def connect_memcached(config):
+    from .memcached.memcached_ring import ShardedClient
+    # memcache.Client keeps its sockets and cas ids thread-local, so one instance is safe to share
+    client = ShardedClient(config.memcached_servers, socket_timeout=config.socket_timeout, cache_cas=True, debug=0)
+    if counting:
+        from .instrumented_library import count_memcached
+        count_memcached(client)
+    return client
+
+
+def connect_neo4j(config):
+    from neo4j.v1 import GraphDatabase
+    driver = GraphDatabase.driver(config.neo4j_uri, auth=(config.neo4j_user, config.neo4j_password),
+                                  max_connection_pool_size=config.pool_size,
+                                  connection_timeout=config.connect_timeout,
+                                  keep_alive=config.socket_keepalive)
+    if counting:
+        from .instrumented_library import CountingDriver
+        driver = CountingDriver(driver)
+    return driver
+
+
+def connect_sqlite(config):
+    from .sqlite.sqlite_library import connect
+    return connect(config.sqlite_path)
+
+
+factories = {
+    'redis': connect_redis,
+    'mongo': connect_mongo,
+    'memcached': connect_memcached,
+    'neo4j': connect_neo4j,
+    'sqlite': connect_sqlite,
+    # asyncio clients are bound to the event loop they are first used on
+    'redis-async': connect_redis_async,
+    'mongo-async': connect_mongo_async,
+}
+
+
+def get_redis():
+    return get_connection('redis')
+
+
+def get_mongo_db():
+    return get_connection('mongo')
+
+
+def get_redis_async():
+    return get_connection('redis-async')
+
+
+def get_mongo_async_db():
+    return get_connection('mongo-async')
+
+
+def get_memcached():
+    return get_connection('memcached')
+
+
+def get_neo4j_driver():
+    return get_connection('neo4j')
+
+
+def get_sqlite():
+    return get_connection('sqlite')
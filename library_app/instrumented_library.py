@@ -0,0 +1,507 @@
+import inspect
+import json
+import os
+import threading
+import time
+
+from .model import Library
+
+# latencies are bucketed HDR style: exact below 2 ** SUB_BUCKET_BITS nanoseconds, and above it
+# 2 ** (SUB_BUCKET_BITS - 1) linear buckets per power of two, so every bucket is within 1% of its values
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+# the quantiles reported by stats and the Prometheus summaries
+QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+# batch methods report per-item errors in their result instead of raising them
+BATCH_METHODS = ('add_books', 'edit_books', 'checkout_many', 'return_many')
+
+# the OperationStats of the instrumented call running on each thread, which backend commands are counted to
+current = threading.local()
+
+
+def bucket_index(value):
+    magnitude = max(value.bit_length() - SUB_BUCKET_BITS, 0)
+    return magnitude * SUB_BUCKET_HALF + (value >> magnitude)
+
+
+def bucket_value(index):
+    '''
+
+    :return: the highest value recorded into the bucket at index
+    '''
+    magnitude = max(index // SUB_BUCKET_HALF - 1, 0)
+    return ((index - magnitude * SUB_BUCKET_HALF + 1) << magnitude) - 1
+
+
+def count(commands=1, round_trips=1):
+    '''
+        Count backend commands and round trips to the instrumented call running on this thread, if any
+
+    '''
+    stats = getattr(current, 'stats', None)
+    if stats is not None:
+        stats.count(commands, round_trips)
+
+
+class Histogram(object):
+    '''
+        A log-linear latency histogram in nanoseconds, cheap to record into and to merge
+
+    '''
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, n in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + n
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, quantile):
+        '''
+
+        :return: the value at quantile, to within its bucket
+        '''
+        rank = quantile * self.total
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'counts': [[index, n] for index, n in sorted(self.counts.items())], 'sum': self.sum, 'max': self.max}
+
+    @staticmethod
+    def from_dict(dict):
+        histogram = Histogram()
+        histogram.counts = {index: n for index, n in dict['counts']}
+        histogram.total = sum(histogram.counts.values())
+        histogram.sum = dict['sum']
+        histogram.max = dict['max']
+        return histogram
+
+
+class OperationStats(object):
+    '''
+        The latencies, errors, backend commands and round trips of one Library method
+
+    '''
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.latency = Histogram()
+        # error string -> count
+        self.errors = {}
+        self.commands = 0
+        self.round_trips = 0
+
+    def record(self, nanoseconds, error=None):
+        with self.lock:
+            self.latency.record(nanoseconds)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def count(self, commands, round_trips):
+        with self.lock:
+            self.commands += commands
+            self.round_trips += round_trips
+
+    def count_errors(self, errors):
+        with self.lock:
+            for error in errors:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for error, n in other.errors.items():
+            self.errors[error] = self.errors.get(error, 0) + n
+        self.commands += other.commands
+        self.round_trips += other.round_trips
+
+    def to_dict(self):
+        return {'latency': self.latency.to_dict(), 'errors': self.errors, 'commands': self.commands,
+                'round_trips': self.round_trips}
+
+    @staticmethod
+    def from_dict(dict, lock):
+        stats = OperationStats(lock)
+        stats.latency = Histogram.from_dict(dict['latency'])
+        stats.errors = dict['errors']
+        stats.commands = dict['commands']
+        stats.round_trips = dict['round_trips']
+        return stats
+
+
+class Recorder(object):
+    '''
+        The OperationStats of one backend, by method name
+
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def operation(self, name):
+        stats = self.operations.get(name)
+        if stats is None:
+            with self.lock:
+                stats = self.operations.setdefault(name, OperationStats(self.lock))
+        return stats
+
+    def merge(self, other):
+        with self.lock:
+            for name, stats in other.operations.items():
+                self.operations.setdefault(name, OperationStats(self.lock)).merge(stats)
+
+    def summary(self):
+        '''
+
+        :return: per method, the call, error, command and round trip counts and the latency quantiles in seconds
+        '''
+        with self.lock:
+            return {name: {'calls': stats.latency.total, 'errors': dict(stats.errors),
+                           'commands': stats.commands, 'round_trips': stats.round_trips,
+                           'max': stats.latency.max / 1e9,
+                           'quantiles': {quantile: stats.latency.percentile(quantile) / 1e9
+                                         for quantile in QUANTILES}}
+                    for name, stats in sorted(self.operations.items())}
+
+    def to_dict(self):
+        with self.lock:
+            return {name: stats.to_dict() for name, stats in self.operations.items()}
+
+    @staticmethod
+    def from_dict(backend, dict):
+        recorder = Recorder(backend)
+        recorder.operations = {name: OperationStats.from_dict(stats, recorder.lock) for name, stats in dict.items()}
+        return recorder
+
+
+def load_recorders(path):
+    '''
+        Read the recorders saved by save_recorders, none if path does not exist yet
+
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return {backend: Recorder.from_dict(backend, dict) for backend, dict in json.load(file).items()}
+
+
+def write_atomically(path, text):
+    # a reader never sees a half written file
+    temp = path + '.tmp'
+    with open(temp, 'w') as file:
+        file.write(text)
+    os.replace(temp, path)
+
+
+def save_recorders(path, recorders):
+    '''
+        Merge recorders into those already saved at path, so stats accumulate across processes
+
+    '''
+    recorders = {backend: recorder for backend, recorder in recorders.items() if recorder.operations}
+    if not recorders:
+        return
+    merged = load_recorders(path)
+    for backend, recorder in recorders.items():
+        merged.setdefault(backend, Recorder(backend)).merge(recorder)
+    write_atomically(path, json.dumps({backend: recorder.to_dict() for backend, recorder in merged.items()}))
+
+
+def label(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def prometheus_text(recorders):
+    '''
+        Render recorders in the Prometheus text exposition format
+
+    '''
+    latencies, errors, commands, round_trips = [], [], [], []
+    for backend, recorder in sorted(recorders.items()):
+        with recorder.lock:
+            for name, stats in sorted(recorder.operations.items()):
+                labels = 'backend={},operation={}'.format(label(backend), label(name))
+                for quantile in QUANTILES:
+                    latencies.append('library_operation_latency_seconds{{{},quantile="{}"}} {:.9f}'.format(
+                        labels, quantile, stats.latency.percentile(quantile) / 1e9))
+                latencies.append('library_operation_latency_seconds_sum{{{}}} {:.9f}'.format(
+                    labels, stats.latency.sum / 1e9))
+                latencies.append('library_operation_latency_seconds_count{{{}}} {}'.format(
+                    labels, stats.latency.total))
+                for error, n in sorted(stats.errors.items()):
+                    errors.append('library_operation_errors_total{{{},error={}}} {}'.format(labels, label(error), n))
+                commands.append('library_backend_commands_total{{{}}} {}'.format(labels, stats.commands))
+                round_trips.append('library_backend_round_trips_total{{{}}} {}'.format(labels, stats.round_trips))
+    return '\n'.join(
+        ['# HELP library_operation_latency_seconds The latency of Library calls',
+         '# TYPE library_operation_latency_seconds summary'] + latencies +
+        ['# HELP library_operation_errors_total The errors raised or returned by Library calls, by error',
+         '# TYPE library_operation_errors_total counter'] + errors +
+        ['# HELP library_backend_commands_total The commands Library calls sent to the backend',
+         '# TYPE library_backend_commands_total counter'] + commands +
+        ['# HELP library_backend_round_trips_total The round trips Library calls made to the backend',
+         '# TYPE library_backend_round_trips_total counter'] + round_trips) + '\n'
+
+
+def dump_prometheus(path, recorders):
+    write_atomically(path, prometheus_text(recorders))
+
+
+class InstrumentedLibrary(Library):
+    '''
+        Wraps another Library to record the latency and errors of every call, and the backend commands
+        and round trips counted during it once the backend connections are instrumented, see connections.instrument.
+        While enabled is False calls pass straight through.
+
+    '''
+
+    def __init__(self, inner, recorder=None, enabled=True):
+        self.inner = inner
+        self.recorder = recorder or Recorder(type(inner).__name__)
+        self.enabled = enabled
+
+    def __getattr__(self, name):
+        # calls outside the Library contract, such as backend specific bulk loads, are recorded under their name
+        if name == 'inner':
+            raise AttributeError(name)
+        attribute = getattr(self.inner, name)
+        if not inspect.ismethod(attribute):
+            return attribute
+        return lambda *args, **kwargs: self._call(name, attribute, args, kwargs)
+
+    def _timed(self, stats, function):
+        '''
+            Run function with stats as the call running on this thread; an error is recorded as a failed call
+
+        :return: its result and the nanoseconds it took
+        '''
+        outer = getattr(current, 'stats', None)
+        current.stats = stats
+        start = time.perf_counter_ns()
+        try:
+            return function(), time.perf_counter_ns() - start
+        except StopIteration:
+            raise
+        except Exception as e:
+            stats.record(time.perf_counter_ns() - start, str(e))
+            raise
+        finally:
+            current.stats = outer
+
+    def _call(self, name, method, args, kwargs):
+        if not self.enabled:
+            return method(*args, **kwargs)
+        # _timed inlined, as this runs on every call
+        stats = self.recorder.operation(name)
+        outer = getattr(current, 'stats', None)
+        current.stats = stats
+        start = time.perf_counter_ns()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            stats.record(time.perf_counter_ns() - start, str(e))
+            raise
+        finally:
+            current.stats = outer
+        stats.record(time.perf_counter_ns() - start)
+        if name in BATCH_METHODS:
+            stats.count_errors([str(e) for e in result if e is not None])
+        return result
+
+    def _iter(self, name, method, args, kwargs):
+        if not self.enabled:
+            return method(*args, **kwargs)
+        stats = self.recorder.operation(name)
+        # invalid arguments raise here, as they do from the inner library
+        books, elapsed = self._timed(stats, lambda: iter(method(*args, **kwargs)))
+        return self._stream(stats, books, elapsed)
+
+    def _stream(self, stats, books, elapsed):
+        '''
+            Time a streamed call as the total time spent pulling its pages, not counting the caller's work between them
+
+        '''
+        try:
+            while True:
+                try:
+                    book, pulled = self._timed(stats, lambda: next(books))
+                except StopIteration:
+                    break
+                elapsed += pulled
+                yield book
+        except GeneratorExit:
+            # the caller stopped early, as the cli does at --limit
+            stats.record(elapsed)
+            raise
+        stats.record(elapsed)
+
+    def iter_sorted(self, *args, **kwargs):
+        return self._iter('iter_sorted', self.inner.iter_sorted, args, kwargs)
+
+    def iter_search(self, *args, **kwargs):
+        return self._iter('iter_search', self.inner.iter_search, args, kwargs)
+
+
+def instrumented(name):
+    def method(self, *args, **kwargs):
+        return self._call(name, getattr(self.inner, name), args, kwargs)
+
+    method.__name__ = method.__qualname__ = name
+    return method
+
+
+for name, method in list(vars(Library).items()):
+    if inspect.isfunction(method) and not name.startswith('_') and name not in vars(InstrumentedLibrary):
+        setattr(InstrumentedLibrary, name, instrumented(name))
+
+
+def redis_connection_class():
+    '''
+        A redis Connection counting each response read as a command, and each send as a round trip,
+        so a pipeline of n commands counts n commands and one round trip
+
+    '''
+    import redis
+
+    class CountingConnection(redis.Connection):
+        def send_packed_command(self, *args, **kwargs):
+            count(0, 1)
+            return super().send_packed_command(*args, **kwargs)
+
+        def read_response(self, *args, **kwargs):
+            count(1, 0)
+            return super().read_response(*args, **kwargs)
+
+    return CountingConnection
+
+
+def mongo_listener():
+    '''
+        A pymongo command listener counting each command, a round trip of its own on the wire protocol.
+        pymongo publishes command events on the thread running the command.
+
+    '''
+    from pymongo import monitoring
+
+    class CommandCounter(monitoring.CommandListener):
+        def started(self, event):
+            count(1, 1)
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    return CommandCounter()
+
+
+class CountingMemcache(object):
+    '''
+        Wraps a single server memcache.Client, counting each call as a round trip; a set_multi pipelines
+        a set command per key, and a get_multi is one command for all its keys
+
+    '''
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not inspect.ismethod(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            count(len(args[0]) if name == 'set_multi' else 1, 1)
+            return attribute(*args, **kwargs)
+
+        return call
+
+
+def count_memcached(sharded):
+    sharded.clients = {server: CountingMemcache(client) for server, client in sharded.clients.items()}
+    return sharded
+
+
+class CountingTransaction(object):
+    def __init__(self, tx):
+        self.tx = tx
+
+    def run(self, *args, **kwargs):
+        count()
+        return self.tx.run(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.tx, name)
+
+
+class CountingSession(object):
+    '''
+        Wraps a neo4j session, counting each statement as a command and a round trip, and the commit
+        of a transaction function as one more round trip; the driver pipelines BEGIN with the first statement
+
+    '''
+
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        self.session.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self.session.__exit__(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def run(self, *args, **kwargs):
+        count()
+        return self.session.run(*args, **kwargs)
+
+    def _counted(self, work):
+        def counted(tx, *args, **kwargs):
+            result = work(CountingTransaction(tx), *args, **kwargs)
+            count(0, 1)
+            return result
+
+        return counted
+
+    def read_transaction(self, work, *args, **kwargs):
+        return self.session.read_transaction(self._counted(work), *args, **kwargs)
+
+    def write_transaction(self, work, *args, **kwargs):
+        return self.session.write_transaction(self._counted(work), *args, **kwargs)
+
+
+class CountingDriver(object):
+    def __init__(self, driver):
+        self.driver = driver
+
+    def session(self, *args, **kwargs):
+        return CountingSession(self.driver.session(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
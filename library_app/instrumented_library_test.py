@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+
+from library_app import instrumented_library
+from library_app.instrumented_library import Histogram, InstrumentedLibrary, Recorder, bucket_index, bucket_value, \
+    load_recorders, prometheus_text, save_recorders
+from library_app.library_test import LibraryTest, RatingLibraryTest, book_toadd, borrower_toadd1
+from library_app.memory.memory_library import InMemoryLibrary
+
+
+class CountingLibrary(InMemoryLibrary):
+    '''
+        Counts two commands in one round trip per get_book, as a pipelined backend would
+
+    '''
+
+    def get_book(self, isbn):
+        instrumented_library.count(2, 1)
+        return super().get_book(isbn)
+
+
+class InstrumentedLibraryTest(LibraryTest, RatingLibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        self.inner = CountingLibrary()
+        self.client = InstrumentedLibrary(self.inner, Recorder('memory'))
+
+    def summary(self):
+        return self.client.recorder.summary()
+
+    def test_records_calls_and_round_trips(self):
+        self.client.get_book('1')
+        self.client.get_book('2')
+        summary = self.summary()['get_book']
+
+        self.assertEqual(summary['calls'], 2)
+        self.assertEqual(summary['commands'], 4)
+        self.assertEqual(summary['round_trips'], 2)
+        self.assertGreater(summary['quantiles'][0.5], 0)
+
+    def test_commands_outside_calls_are_not_counted(self):
+        self.inner.get_book('1')
+        self.assertNotIn('get_book', self.summary())
+
+    def test_errors_by_string(self):
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.client.checkout_book('nobody', '1')
+        self.client.checkout_many([(borrower_toadd1.username, '404'), (borrower_toadd1.username, '1')])
+
+        self.assertEqual(self.summary()['checkout_book']['errors'], {'borrower_not_exists': 2})
+        self.assertEqual(self.summary()['checkout_many']['errors'], {'book_not_exists': 1})
+
+    def test_iterators_are_timed_while_consumed(self):
+        self.assertEqual(list(self.client.iter_sorted('isbn')), [book_toadd])
+        self.assertEqual(self.summary()['iter_sorted']['calls'], 1)
+        books = self.client.iter_search('title', book_toadd.title)
+        next(books)
+        books.close()
+        self.assertEqual(self.summary()['iter_search']['calls'], 1)
+        with self.assertRaises(Exception):
+            list(self.client.iter_sorted('quantity'))
+        self.assertEqual(self.summary()['iter_sorted']['errors'], {'invalid_field_quantity': 1})
+
+    def test_backend_specific_calls_are_recorded(self):
+        self.client._books(['1'])
+        self.assertEqual(self.summary()['_books']['calls'], 1)
+
+    def test_disabled(self):
+        self.client.enabled = False
+        self.assertEqual(self.client.get_book('1'), book_toadd)
+        self.assertEqual(list(self.client.iter_sorted('isbn')), [book_toadd])
+        self.assertNotIn('get_book', self.summary())
+        self.assertNotIn('iter_sorted', self.summary())
+
+    def test_prometheus_text(self):
+        self.client.get_book('1')
+        with self.assertRaises(Exception):
+            self.client.delete_book('"quoted"')
+        text = prometheus_text({'memory': self.client.recorder})
+
+        self.assertIn('# TYPE library_operation_latency_seconds summary', text)
+        self.assertIn('library_operation_latency_seconds_count{backend="memory",operation="get_book"} 1', text)
+        self.assertIn('library_backend_commands_total{backend="memory",operation="get_book"} 2', text)
+        self.assertIn('library_backend_round_trips_total{backend="memory",operation="get_book"} 1', text)
+        self.assertIn('library_operation_errors_total{backend="memory",operation="delete_book",'
+                      'error="book_not_exists"} 1', text)
+
+    def test_save_accumulates(self):
+        self.client.get_book('1')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stats.json')
+            save_recorders(path, {'memory': self.client.recorder})
+            save_recorders(path, {'memory': self.client.recorder})
+            summary = load_recorders(path)['memory'].summary()['get_book']
+
+        self.assertEqual(summary['calls'], 2)
+        self.assertEqual(summary['round_trips'], 2)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_buckets_cover_values(self):
+        for value in list(range(1000)) + [10 ** 6, 10 ** 9 + 7, 2 ** 40 - 1]:
+            index = bucket_index(value)
+            self.assertGreaterEqual(bucket_value(index), value)
+            self.assertLessEqual(bucket_value(index) - value, value / 100)
+            self.assertLess(bucket_value(index - 1), value)
+
+    def test_percentile(self):
+        histogram = Histogram()
+        for value in range(1, 10001):
+            histogram.record(value * 1000)
+
+        self.assertAlmostEqual(histogram.percentile(0.5), 5000 * 1000, delta=50 * 1000)
+        self.assertAlmostEqual(histogram.percentile(0.99), 9900 * 1000, delta=99 * 1000)
+        self.assertEqual(histogram.percentile(1.0), 10000 * 1000)
+
+    def test_merge(self):
+        histogram, other = Histogram(), Histogram()
+        histogram.record(10)
+        other.record(1000)
+        other.record(1000)
+        histogram.merge(Histogram.from_dict(other.to_dict()))
+
+        self.assertEqual(histogram.total, 3)
+        self.assertEqual(histogram.max, 1000)
+        self.assertEqual(histogram.percentile(0.5), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,11 @@
+import os
+from itertools import islice
+
 import click
 
+from . import connections
 from .config import Config
-from .model import Book, Borrower
-from .mongo.mongo_library import MongoLibrary
-from .neo4j.neo4j_library import Neo4jLibrary
-from .redis.redis_library import RedisLibrary
+from .model import PAGE_SIZE, Book, Borrower
 
 config = click.make_pass_decorator(Config, ensure=True)
 
@@ -13,17 +14,65 @@ def _list_str(books):
     return '\n\t' + '\n\t'.join(map(lambda b: str(b), books))
 
 
+def _paginated(command):
+    command = click.option('--after', default=None, help='Start after the book with this isbn')(command)
+    return click.option('--limit', '-l', default=None, type=click.INT, help='The most books to print')(command)
+
+
+def _page_size(limit):
+    return min(limit, PAGE_SIZE) if limit else PAGE_SIZE
+
+
+def _echo_books(header, books, limit):
+    '''
+        Print books as they are streamed in, stopping after limit of them
+
+    '''
+    click.echo(header, nl=False)
+    for book in islice(books, limit):
+        click.echo('\n\t' + str(book), nl=False)
+    click.echo()
+
+
 @click.group()
 @click.option('--backend', '-b', default='neo4j', help='Specify the backend of this library')
+@click.option('--cache/--no-cache', default=False, help='Whether to cache reads of the backend in process')
+@click.option('--cache-size', default=10000, type=click.INT, help='The number of reads to cache')
+@click.option('--cache-ttl', default=60.0, type=click.FLOAT, help='The seconds a cached read stays valid')
+@click.option('--stats-file', envvar='LIBRARY_STATS_FILE', default=None,
+              help='Record the latency, errors and backend round trips of each call into this file')
 @click.pass_context
 @config
-def cli(config, backend):
+def cli(config, backend, cache, cache_size, cache_ttl, stats_file):
+    # backends are imported on demand so a command only loads the driver it uses
+    connections.configure(config)
+    config.stats_file = stats_file
+    if stats_file:
+        connections.instrument()
     if backend == 'redis':
+        from .redis.redis_library import RedisLibrary
         config.client = RedisLibrary()
     if backend == 'mongo':
+        from .mongo.mongo_library import MongoLibrary
         config.client = MongoLibrary()
     if backend == 'neo4j':
+        from .neo4j.neo4j_library import Neo4jLibrary
         config.client = Neo4jLibrary()
+    if backend == 'sqlite':
+        from .sqlite.sqlite_library import SqliteLibrary
+        config.client = SqliteLibrary()
+    if backend == 'memcached':
+        from .memcached.memcached_library import MemcachedLibrary
+        config.client = MemcachedLibrary()
+    if stats_file:
+        from .instrumented_library import InstrumentedLibrary, Recorder, save_recorders
+        recorder = Recorder(backend)
+        config.client = InstrumentedLibrary(config.client, recorder)
+        # saved however the command ends, so its errors are recorded too
+        click.get_current_context().call_on_close(lambda: save_recorders(stats_file, {backend: recorder}))
+    if cache:
+        from .cached_library import CachedLibrary
+        config.client = CachedLibrary(config.client, max_size=cache_size, ttl=cache_ttl)
 
 
 def safe_cli():
@@ -112,70 +161,76 @@ def edit_book(config, isbn, title, author, page_num, quantity, override):
 
 @cli.command()
 @click.argument('title')
+@_paginated
 @config
-def search_by_title(config, title):
+def search_by_title(config, title, limit, after):
     '''
         Find a book by title
 
     '''
-    books = config.client.search_by_title(title)
-    click.echo('Found books with title={} : {}'.format(title, _list_str(books)))
+    books = config.client.iter_search('title', title, page_size=_page_size(limit), after=after)
+    _echo_books('Found books with title={} : '.format(title), books, limit)
 
 
 @cli.command()
 @click.argument('author')
+@_paginated
 @config
-def search_by_author(config, author):
+def search_by_author(config, author, limit, after):
     '''
         Find a book by Author
 
     '''
-    books = config.client.search_by_author(author)
-    click.echo('Found books with author={} : {}'.format(author, _list_str(books)))
+    books = config.client.iter_search('author', author, page_size=_page_size(limit), after=after)
+    _echo_books('Found books with author={} : '.format(author), books, limit)
 
 
 @cli.command()
+@_paginated
 @config
-def sort_by_title(config):
+def sort_by_title(config, limit, after):
     '''
         Sort all books by title
 
     '''
-    books = config.client.sort_by_title()
-    click.echo('Books sorted by title: {}'.format(_list_str(books)))
+    books = config.client.iter_sorted('title', page_size=_page_size(limit), after=after)
+    _echo_books('Books sorted by title: ', books, limit)
 
 
 @cli.command()
+@_paginated
 @config
-def sort_by_author(config):
+def sort_by_author(config, limit, after):
     '''
         Sort all books by author
 
     '''
-    books = config.client.sort_by_author()
-    click.echo('Books sorted by author: {}'.format(_list_str(books)))
+    books = config.client.iter_sorted('author', page_size=_page_size(limit), after=after)
+    _echo_books('Books sorted by author: ', books, limit)
 
 
 @cli.command()
+@_paginated
 @config
-def sort_by_isbn(config):
+def sort_by_isbn(config, limit, after):
     '''
         Sort all books by isbn
 
     '''
-    books = config.client.sort_by_isbn()
-    click.echo('Books sorted by isbn: {}'.format(_list_str(books)))
+    books = config.client.iter_sorted('isbn', page_size=_page_size(limit), after=after)
+    _echo_books('Books sorted by isbn: ', books, limit)
 
 
 @cli.command()
+@_paginated
 @config
-def sort_by_page_num(config):
+def sort_by_page_num(config, limit, after):
     '''
         Sort all books by page number
 
     '''
-    books = config.client.sort_by_page_num()
-    click.echo('Books sorted by page_num: {}'.format(_list_str(books)))
+    books = config.client.iter_sorted('page_num', page_size=_page_size(limit), after=after)
+    _echo_books('Books sorted by page_num: ', books, limit)
 
 
 @cli.command()
@@ -345,7 +400,66 @@ def get_rating(config, username, isbn):
 
 @cli.command()
 @click.argument('username', required=True)
+@click.option('--k', '-k', default=10, type=click.INT, help='The number of books to recommend')
 @config
-def recommend(config, username):
-    books = config.client.recommend(username)
+def recommend(config, username, k):
+    books = config.client.recommend(username, k)
     click.echo('The user with username={} can checkout those books{}'.format(username, _list_str(books)))
+
+
+@cli.command()
+@config
+def index_stats(config):
+    '''
+        Report how often each index has been used
+
+    '''
+    if not hasattr(config.client, 'index_stats'):
+        raise Exception('index_stats_not_supported')
+    for collection, indexes in config.client.index_stats().items():
+        click.echo('Index usage of {}: {}'.format(collection, _list_str(
+            ['{} used {} times since {}'.format(name, ops, since) for name, ops, since in indexes])))
+
+
+@cli.command()
+@config
+def rebuild_indexes(config):
+    '''
+        Rebuild the sort indexes from the stored books
+
+    '''
+    if not hasattr(config.client, 'rebuild_indexes'):
+        raise Exception('rebuild_indexes_not_supported')
+    config.client.rebuild_indexes()
+    click.echo('Rebuilt the sort indexes')
+
+
+@cli.command()
+@click.option('--prometheus', '-p', default=None, help='Also write the stats in the Prometheus text format to this file')
+@click.option('--reset', is_flag=True, default=False, help='Clear the recorded stats afterwards')
+@config
+def stats(config, prometheus, reset):
+    '''
+        Report the latency, errors and backend round trips recorded into --stats-file
+
+    '''
+    from .instrumented_library import QUANTILES, dump_prometheus, load_recorders
+    if not config.stats_file:
+        raise Exception('stats_file_not_set')
+    recorders = load_recorders(config.stats_file)
+    for backend, recorder in sorted(recorders.items()):
+        lines = []
+        for name, summary in recorder.summary().items():
+            calls = summary['calls']
+            lines.append('{} called {} times, {:.2f} commands and {:.2f} round trips per call, latency ms {} max={:.3f}'
+                         .format(name, calls, summary['commands'] / max(calls, 1), summary['round_trips'] / max(calls, 1),
+                                 ' '.join('p{:g}={:.3f}'.format(quantile * 100, summary['quantiles'][quantile] * 1000)
+                                          for quantile in QUANTILES), summary['max'] * 1000))
+            lines.extend('\t{} failed {} times with {}'.format(name, n, error)
+                         for error, n in sorted(summary['errors'].items()))
+        click.echo('Stats of {}: {}'.format(backend, _list_str(lines)))
+    if prometheus:
+        dump_prometheus(prometheus, recorders)
+        click.echo('The stats are written to {}'.format(prometheus))
+    if reset and recorders:
+        os.remove(config.stats_file)
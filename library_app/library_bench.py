@@ -0,0 +1,385 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, islice
+
+from library_app.instrumented_library import BATCH_METHODS, Histogram
+from library_app.model import SORT_FIELDS, Book, Borrower
+
+BACKENDS = ('memory', 'sqlite', 'redis', 'mongo', 'memcached', 'neo4j')
+SCALES = (1000, 10000, 100000)
+SEED = 42
+# calls timed per single-item operation; batch operations get a tenth as many calls of BATCH_SIZE items
+CALLS = 1000
+BATCH_SIZE = 100
+# calls timed per whole-catalog sort_by_*, which reads every book
+SCAN_CALLS = 3
+LOAD_BATCH_SIZE = 1000
+# the s of the Zipf distribution of authors, titles and names over their ranks, and of book popularity
+ZIPF_EXPONENT = 1.1
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library_bench_baseline.json')
+# compare reports a p50 or p95 latency more than TOLERANCE slower than the baseline; run to run noise
+# on a shared machine reaches half of it, while the regressions worth catching, an extra round trip or
+# a lost index, cost multiples
+TOLERANCE = 1.0
+# the p95 of fewer calls than this is too noisy to compare
+MIN_TAIL_CALLS = 500
+# latency differences below this are noise, however large relative to the baseline
+MIN_DELTA_MS = 0.05
+
+
+def zipf_cum_weights(n, exponent=ZIPF_EXPONENT):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def isbn(i):
+    # zero padded, so the isbn order is the generation order
+    return '{:09d}'.format(i)
+
+
+def username(i):
+    return 'user{:07d}'.format(i)
+
+
+class Catalog(object):
+    '''
+        A deterministic synthetic catalog: size books whose authors and titles, and borrowers whose names,
+        are drawn from Zipf distributed pools, and reads that favour Zipf popular books.
+        Every draw comes from a generator seeded by seed, size and its purpose, so it does not depend on
+        which other draws were made.
+
+    '''
+
+    def __init__(self, size, seed=SEED):
+        self.size = size
+        self.seed = seed
+        self.borrower_num = max(size // 10, 10)
+        self.author_num = max(size // 20, 1)
+        self.title_num = max(size // 5, 1)
+        self.name_num = max(self.borrower_num // 5, 1)
+        self.popularity = zipf_cum_weights(size)
+
+    def rand(self, purpose):
+        return random.Random('{}-{}-{}'.format(self.seed, self.size, purpose))
+
+    def zipf(self, rand, n, k):
+        return rand.choices(range(n), cum_weights=zipf_cum_weights(n), k=k)
+
+    def book(self, i, rand, title, authors):
+        return Book(isbn=isbn(i), title='title' + str(title), author=['author' + str(author) for author in authors],
+                    page_num=rand.randint(50, 1500), quantity=rand.randint(1, 5))
+
+    def books(self):
+        rand = self.rand('books')
+        titles = self.zipf(rand, self.title_num, self.size)
+        authors = self.zipf(rand, self.author_num, self.size)
+        for i in range(self.size):
+            # one book in ten has a second author
+            extra = [rand.randrange(self.author_num)] if rand.random() < 0.1 else []
+            yield self.book(i, rand, titles[i], [authors[i]] + extra)
+
+    def new_books(self, count):
+        '''
+
+        :return: count books outside the catalog, to add and delete again
+        '''
+        rand = self.rand('new_books')
+        return [self.book(self.size + i, rand, rand.randrange(self.title_num), [rand.randrange(self.author_num)])
+                for i in range(count)]
+
+    def borrower(self, i, rand, name):
+        return Borrower(username=username(i), name='name' + str(name), phone=str(rand.randrange(10 ** 9, 10 ** 10)))
+
+    def borrowers(self):
+        rand = self.rand('borrowers')
+        names = self.zipf(rand, self.name_num, self.borrower_num)
+        return [self.borrower(i, rand, names[i]) for i in range(self.borrower_num)]
+
+    def new_borrowers(self, count):
+        rand = self.rand('new_borrowers')
+        return [self.borrower(self.borrower_num + i, rand, rand.randrange(self.name_num)) for i in range(count)]
+
+    def popular_isbns(self, purpose, count):
+        return [isbn(i) for i in self.rand(purpose).choices(range(self.size), cum_weights=self.popularity, k=count)]
+
+    def usernames(self, purpose, count):
+        rand = self.rand(purpose)
+        return [username(rand.randrange(self.borrower_num)) for _ in range(count)]
+
+    def checkouts(self, purpose, count):
+        '''
+
+        :return: up to count distinct (username, isbn) pairs; books are picked uniformly, as popular ones
+        would run out of copies and leave mostly book_not_available errors to time
+        '''
+        rand = self.rand(purpose)
+        return list(dict.fromkeys((username(rand.randrange(self.borrower_num)), isbn(rand.randrange(self.size)))
+                                  for _ in range(count)))
+
+    def ratings(self, checkouts):
+        rand = self.rand('ratings')
+        return [(username, isbn, rand.randint(1, 5)) for username, isbn in checkouts]
+
+    def titles(self, count):
+        rand = self.rand('titles')
+        return ['title' + str(rand.randrange(self.title_num)) for _ in range(count)]
+
+    def authors(self, count):
+        rand = self.rand('authors')
+        return ['author' + str(rand.randrange(self.author_num)) for _ in range(count)]
+
+    def names(self, count):
+        rand = self.rand('names')
+        return ['name' + str(rand.randrange(self.name_num)) for _ in range(count)]
+
+
+def batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Timings(object):
+    '''
+        The latency histogram, call count, wall time and error count of each operation timed
+
+    '''
+
+    def __init__(self):
+        self.operations = {}
+
+    def time(self, name, function, calls):
+        '''
+            Call function with each argument tuple of calls, counting raised errors and those a batch returns
+
+        :return: the result of each call, the error where it raised
+        '''
+        histogram, elapsed, errors = self.operations.setdefault(name, (Histogram(), [0], [0]))
+        results = []
+        for args in calls:
+            start = time.perf_counter_ns()
+            try:
+                result = function(*args)
+            except NotImplementedError:
+                raise
+            except Exception as e:
+                result = e
+                errors[0] += 1
+            took = time.perf_counter_ns() - start
+            histogram.record(took)
+            elapsed[0] += took
+            if type(result) is list and name in BATCH_METHODS:
+                errors[0] += sum(1 for error in result if error is not None)
+            results.append(result)
+        return results
+
+    def report(self):
+        report = {}
+        for name, (histogram, elapsed, errors) in sorted(self.operations.items()):
+            report[name] = {'calls': histogram.total, 'errors': errors[0],
+                            'throughput': round(histogram.total / (elapsed[0] / 1e9), 1) if elapsed[0] else None}
+            for quantile in (0.5, 0.95, 0.99):
+                report[name]['p{:g}_ms'.format(quantile * 100)] = round(histogram.percentile(quantile) / 1e6, 4)
+        return report
+
+
+def open_library(backend, directory):
+    if backend == 'memory':
+        from library_app.memory.memory_library import InMemoryLibrary
+        return InMemoryLibrary()
+    if backend == 'sqlite':
+        from library_app.sqlite.sqlite_library import SqliteLibrary
+        return SqliteLibrary(os.path.join(directory, 'library.db'))
+    if backend == 'redis':
+        from library_app.redis.redis_library import RedisLibrary
+        return RedisLibrary()
+    if backend == 'mongo':
+        from library_app.mongo.mongo_library import MongoLibrary
+        return MongoLibrary()
+    if backend == 'memcached':
+        from library_app.memcached.memcached_library import MemcachedLibrary
+        return MemcachedLibrary()
+    if backend == 'neo4j':
+        from library_app.neo4j.neo4j_library import Neo4jLibrary
+        return Neo4jLibrary()
+    raise Exception('invalid_backend_' + backend)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+
+
+def run(backend, scale, calls=CALLS, seed=SEED):
+    '''
+        Load a catalog of scale books into backend, dropping what it held, then time every Library operation
+
+    :return: the report of each operation while loading and once loaded, the load time and the peak RSS of this process
+    '''
+    catalog = Catalog(scale, seed)
+    batch_calls = max(calls // 10, 1)
+    load = Timings()
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as directory:
+        library = open_library(backend, directory)
+        library.drop_db()
+
+        start = time.perf_counter()
+        load.time('add_books', library.add_books, ((batch,) for batch in batches(catalog.books(), LOAD_BATCH_SIZE)))
+        load.time('add_borrower', library.add_borrower, ((borrower,) for borrower in catalog.borrowers()))
+        loaded = catalog.checkouts('load', catalog.borrower_num * 2)
+        errors = [error for batch in batches(loaded, BATCH_SIZE)
+                  for error in load.time('checkout_many', library.checkout_many, [(batch,)])[0]]
+        loaded = [pair for pair, error in zip(loaded, errors) if error is None]
+        load.time('rate_book', library.rate_book, catalog.ratings(loaded))
+        load_seconds = time.perf_counter() - start
+
+        timings.time('get_book', library.get_book, ((isbn,) for isbn in catalog.popular_isbns('get_book', calls)))
+        timings.time('get_books', library.get_books,
+                     ((batch,) for batch in batches(catalog.popular_isbns('get_books', batch_calls * BATCH_SIZE),
+                                                    BATCH_SIZE)))
+        timings.time('search_by_title', library.search_by_title, ((title,) for title in catalog.titles(calls)))
+        timings.time('search_by_author', library.search_by_author, ((author,) for author in catalog.authors(calls)))
+        timings.time('iter_search', lambda title: list(library.iter_search('title', title, page_size=BATCH_SIZE)),
+                     ((title,) for title in catalog.titles(calls)))
+        for field in SORT_FIELDS:
+            timings.time('sort_by_' + field, getattr(library, 'sort_by_' + field), [()] * SCAN_CALLS)
+        # the first page, as the cli pages through a sort
+        timings.time('iter_sorted', lambda field: list(islice(library.iter_sorted(field, page_size=BATCH_SIZE),
+                                                              BATCH_SIZE)),
+                     [(SORT_FIELDS[i % len(SORT_FIELDS)],) for i in range(batch_calls)])
+        timings.time('get_borrower', library.get_borrower, ((name,) for name in catalog.usernames('get_borrower', calls)))
+        timings.time('search_by_name', library.search_by_name, ((name,) for name in catalog.names(calls)))
+        timings.time('get_book_borrowers', library.get_book_borrowers,
+                     ((isbn,) for isbn in catalog.popular_isbns('get_book_borrowers', calls)))
+        timings.time('get_borrowed_books', library.get_borrowed_books,
+                     ((name,) for name in catalog.usernames('get_borrowed_books', calls)))
+        timings.time('get_rating', library.get_rating, ((name, isbn) for name, isbn, rating in catalog.ratings(loaded)
+                                                        [:calls]))
+        timings.time('recommend', library.recommend, ((name,) for name in catalog.usernames('recommend', calls)))
+
+        # books and borrowers added are deleted again and checkouts returned, while edits only raise quantities
+        edited = catalog.popular_isbns('edit_book', calls)
+        timings.time('edit_book', library.edit_book, ((isbn, Book(quantity=10)) for isbn in edited))
+        timings.time('edit_books', library.edit_books,
+                     ((batch,) for batch in batches(((isbn, Book(quantity=10)) for isbn in
+                                                     catalog.popular_isbns('edit_books', batch_calls * BATCH_SIZE)),
+                                                    BATCH_SIZE)))
+        timings.time('edit_borrower', library.edit_borrower,
+                     ((name, Borrower(phone='5550000000')) for name in catalog.usernames('edit_borrower', calls)))
+        new_books = catalog.new_books(calls)
+        timings.time('add_book', library.add_book, ((book,) for book in new_books))
+        timings.time('delete_book', library.delete_book, ((book.isbn,) for book in new_books))
+        new_borrowers = catalog.new_borrowers(calls)
+        timings.time('add_borrower', library.add_borrower, ((borrower,) for borrower in new_borrowers))
+        timings.time('delete_borrower', library.delete_borrower, ((borrower.username,) for borrower in new_borrowers))
+
+        checked_out = set(loaded)
+        # at most a checkout per four books, so most find a copy left
+        single = [pair for pair in catalog.checkouts('checkout_book', min(calls, scale // 4)) if pair not in checked_out]
+        results = timings.time('checkout_book', library.checkout_book, single)
+        timings.time('return_book', library.return_book,
+                     [pair for pair, result in zip(single, results) if result is None])
+        many = [pair for pair in catalog.checkouts('checkout_many', min(batch_calls * BATCH_SIZE, scale // 4))
+                if pair not in checked_out]
+        results = [error for batch in batches(many, BATCH_SIZE)
+                   for error in timings.time('checkout_many', library.checkout_many, [(batch,)])[0]]
+        timings.time('return_many', library.return_many,
+                     ((batch,) for batch in batches((pair for pair, error in zip(many, results) if error is None),
+                                                    BATCH_SIZE)))
+
+        timings.time('drop_db', library.drop_db, [()])
+    return {'load_seconds': round(load_seconds, 3), 'peak_rss_mb': peak_rss_mb(), 'load': load.report(),
+            'operations': timings.report()}
+
+
+def run_isolated(backend, scale, calls, seed):
+    # a fresh process per run, so its peak RSS is its own
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run, backend, scale, calls, seed).result()
+
+
+def bench(backends=('memory', 'sqlite'), scales=SCALES, calls=CALLS, seed=SEED):
+    results = {}
+    for backend in backends:
+        for scale in scales:
+            print('Running {} with {} books'.format(backend, scale), file=sys.stderr)
+            results.setdefault(backend, {})[str(scale)] = run_isolated(backend, scale, calls, seed)
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'calls': calls, 'seed': seed,
+            'results': results}
+
+
+def regressions(report, baseline, tolerance=TOLERANCE, min_delta_ms=MIN_DELTA_MS):
+    '''
+        Compare the operations run in both report and baseline. Throughput is not compared, as it follows
+        the mean latency, which a single stall skews.
+
+    :return: a line describing each p50 or p95 latency more than tolerance slower than the baseline
+    '''
+    found = []
+    for backend, scales in sorted(report['results'].items()):
+        for scale, result in sorted(scales.items(), key=lambda item: int(item[0])):
+            base = baseline['results'].get(backend, {}).get(scale)
+            if base is None:
+                continue
+            for phase in ('load', 'operations'):
+                for name, operation in sorted(result[phase].items()):
+                    old = base[phase].get(name)
+                    if old is None:
+                        continue
+                    keys = ('p50_ms', 'p95_ms') if min(operation['calls'], old['calls']) >= MIN_TAIL_CALLS \
+                        else ('p50_ms',)
+                    for key in keys:
+                        if operation[key] > old[key] * (1 + tolerance) and operation[key] - old[key] > min_delta_ms:
+                            found.append('{} {} books {} {} {} -> {}'.format(backend, scale, name, key, old[key],
+                                                                             operation[key]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time every Library operation on a synthetic catalog. '
+                                                 'It drops the database of each backend it runs.')
+    parser.add_argument('--backends', '-b', default='memory,sqlite',
+                        help='Comma separated backends out of ' + ','.join(BACKENDS))
+    parser.add_argument('--scales', '-s', default=','.join(map(str, SCALES)),
+                        help='Comma separated catalog sizes, from 1000 to 1000000 books')
+    parser.add_argument('--calls', '-n', type=int, default=CALLS, help='Calls timed per operation')
+    parser.add_argument('--seed', type=int, default=SEED, help='The seed of the synthetic catalog')
+    parser.add_argument('--output', '-o', default=None, help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--compare', '-c', nargs='?', const=BASELINE, default=None,
+                        help='Report regressions against this baseline report, by default the stored one')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='The relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    report = bench(args.backends.split(','), [int(scale) for scale in args.scales.split(',')], args.calls, args.seed)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as file:
+            found = regressions(report, json.load(file), args.tolerance)
+        for line in found:
+            print('Regression: ' + line, file=sys.stderr)
+        print('{} regressions against {}'.format(len(found), args.compare), file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
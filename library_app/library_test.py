@@ -1,3 +1,4 @@
+import threading
 from copy import copy
 
 from .model import Book, Borrower
@@ -445,3 +446,343 @@ class LibraryTest(object):
         with self.assertRaises(Exception) as context:
             self.client.get_book_borrowers('non_exist_book')
         self.assertEqual('book_not_exists', str(context.exception))
+
+    def isbns(self, books):
+        return [book.isbn for book in books]
+
+    def test_iter_sorted(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        for page_size in (1, 2, 1000):
+            self.assertEqual(['3', '2', '1'], self.isbns(self.client.iter_sorted('title', page_size)))
+            self.assertEqual(['2', '3', '1'], self.isbns(self.client.iter_sorted('author', page_size)))
+            self.assertEqual(['1', '2', '3'], self.isbns(self.client.iter_sorted('isbn', page_size)))
+            self.assertEqual([200, 300, 300], [book.page_num for book in self.client.iter_sorted('page_num', page_size)])
+
+    def test_iter_sorted_after(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        self.assertEqual(['1'], self.isbns(self.client.iter_sorted('title', 2, after='2')))
+        self.assertEqual(['2', '3'], self.isbns(self.client.iter_sorted('isbn', 1, after='1')))
+        self.assertEqual([], self.isbns(self.client.iter_sorted('author', 1, after='1')))
+
+    def test_iter_sorted_missing_values_first(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        self.client.edit_book('3', Book(), override=True)
+        for page_size in (1, 2, 1000):
+            self.assertEqual(['3', '1', '2'], self.isbns(self.client.iter_sorted('page_num', page_size)))
+            self.assertEqual(['3', '2', '1'], self.isbns(self.client.iter_sorted('title', page_size)))
+            self.assertEqual(['3', '2', '1'], self.isbns(self.client.iter_sorted('author', page_size)))
+        self.assertEqual(['1', '2'], self.isbns(self.client.iter_sorted('page_num', 1, after='3')))
+        self.assertEqual(['2', '1'], self.isbns(self.client.iter_sorted('author', 1, after='3')))
+
+    def test_iter_sorted_invalid(self):
+        with self.assertRaises(Exception) as context:
+            self.client.iter_sorted('title', after='404')
+        self.assertEqual('book_not_exists', str(context.exception))
+        with self.assertRaises(Exception) as context:
+            self.client.iter_sorted('quantity')
+        self.assertEqual('invalid_field_quantity', str(context.exception))
+
+    def test_iter_search(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        for page_size in (1, 2, 1000):
+            self.assertEqual(['2', '3'], self.isbns(self.client.iter_search('author', 'Chandan', page_size)))
+            self.assertEqual(['3'], self.isbns(self.client.iter_search('author', 'Chandan', page_size, after='2')))
+            self.assertEqual(['3'], self.isbns(self.client.iter_search('title', 'book_big', page_size)))
+            self.assertEqual([], self.isbns(self.client.iter_search('title', 'book_big', page_size, after='3')))
+            self.assertEqual([], self.isbns(self.client.iter_search('title', 'no_book', page_size)))
+        with self.assertRaises(Exception) as context:
+            self.client.iter_search('isbn', '1')
+        self.assertEqual('invalid_field_isbn', str(context.exception))
+
+    def errors(self, errors):
+        return [str(e) if e is not None else None for e in errors]
+
+    def test_add_books(self):
+        errors = self.client.add_books([book_toadd2, book_toadd, Book(), book_toadd3, copy(book_toadd2)])
+        self.assertEqual([None, 'book_exist_already', 'required_field_book.isbn', None, 'book_exist_already'],
+                         self.errors(errors))
+        self.assertEqual([book_toadd, book_toadd2, book_toadd3], self.client.sort_by_isbn())
+
+    def test_get_books(self):
+        self.client.add_book(book_toadd3)
+        self.assertEqual([book_toadd3, None, book_toadd, book_toadd3], self.client.get_books(['3', '4', '1', '3']))
+        self.assertEqual([], self.client.get_books([]))
+
+    def test_edit_books(self):
+        self.client.add_book(book_toadd2)
+        errors = self.client.edit_books([('1', Book(title='new_title')), ('4', Book(title='x')),
+                                         ('2', Book(page_num=10))])
+        self.assertEqual([None, 'book_not_exists', None], self.errors(errors))
+        self.assertEqual(['1'], [book.isbn for book in self.client.search_by_title('new_title')])
+        self.assertEqual(10, self.client.get_book('2').page_num)
+        self.assertEqual('book_medium', self.client.get_book('2').title)
+
+    def test_checkout_many(self):
+        self.client.add_book(book_toadd3)
+        self.client.add_borrower(borrower_toadd2)
+        errors = self.client.checkout_many([('zhangq1', '3'), ('zhangq2', '3'), ('zhangq1', '1'), ('zhangq1', '1'),
+                                            ('no_one', '1'), ('zhangq1', '4')])
+        self.assertEqual([None, 'book_not_available', None, 'book_already_borrowed', 'borrower_not_exists',
+                          'book_not_exists'], self.errors(errors))
+        self.assertEqual(['1', '3'], sorted(book.isbn for book in self.client.get_borrowed_books('zhangq1')))
+        self.assertEqual([], self.client.get_borrowed_books('zhangq2'))
+
+    def test_return_many(self):
+        self.client.add_book(book_toadd3)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.checkout_book('zhangq1', '3')
+        errors = self.client.return_many([('zhangq1', '1'), ('zhangq1', '1'), ('no_one', '3'), ('zhangq1', '4')])
+        self.assertEqual([None, 'book_not_borrowed', 'borrower_not_exists', 'book_not_exists'], self.errors(errors))
+        self.assertEqual(['3'], [book.isbn for book in self.client.get_borrowed_books('zhangq1')])
+
+    def test_batches_take_generators(self):
+        self.assertEqual([None], self.client.add_books(book for book in [book_toadd3]))
+        self.assertEqual([None, None], self.client.checkout_many(pair for pair in [('zhangq1', '1'), ('zhangq1', '3')]))
+        self.assertEqual([None], self.client.return_many(pair for pair in [('zhangq1', '3')]))
+        self.assertEqual(['1'], [book.isbn for book in self.client.get_borrowed_books('zhangq1')])
+
+    def test_concurrent_checkout_not_oversubscribed(self):
+        usernames = ['storm' + str(i) for i in range(20)]
+        for username in usernames:
+            self.client.add_borrower(Borrower(username=username, name='storm', phone='000'))
+        errors = []
+        threads = [threading.Thread(target=self._try_checkout, args=(username, '1', errors)) for username in usernames]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual(errors, [])
+        self.assertEqual(len(self.client.get_book_borrowers('1')), book_toadd.quantity)
+
+    def _try_checkout(self, username, isbn, errors):
+        try:
+            self.client.checkout_book(username, isbn)
+        except Exception as e:
+            # losing the race is expected, anything else fails the test from the main thread
+            if str(e) not in ('book_not_available', 'book_already_borrowed'):
+                errors.append(e)
+
+
+class RatingLibraryTest(object):
+    '''
+        Tests of rate_book, get_rating and recommend, mixed in by the libraries that support ratings
+
+    '''
+
+    def test_get_rating_not_checked_out(self):
+        with self.assertRaises(Exception) as context:
+            self.client.get_rating('zhangq1', '1')
+        self.assertEqual('book_not_checked_out', str(context.exception))
+
+    def test_rate1(self):
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 1)
+
+        self.assertEqual(1, self.client.get_rating('zhangq1', '1'))
+
+    def test_rate2(self):
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 5)
+
+        self.assertEqual(5, self.client.get_rating('zhangq1', '1'))
+
+    def test_rate_out_of_range1(self):
+        self.client.checkout_book('zhangq1', '1')
+        with self.assertRaises(Exception) as context:
+            self.client.rate_book('zhangq1', '1', 0)
+        self.assertEqual('rating_between_1_and_5', str(context.exception))
+
+    def test_rate_out_of_range2(self):
+        self.client.checkout_book('zhangq1', '1')
+        with self.assertRaises(Exception) as context:
+            self.client.rate_book('zhangq1', '1', 6)
+        self.assertEqual('rating_between_1_and_5', str(context.exception))
+
+    def test_rate_out_of_range3(self):
+        self.client.checkout_book('zhangq1', '1')
+        with self.assertRaises(Exception) as context:
+            self.client.rate_book('zhangq1', '1', -1)
+        self.assertEqual('rating_between_1_and_5', str(context.exception))
+
+    def test_rate_not_checked_out(self):
+        with self.assertRaises(Exception) as context:
+            self.client.rate_book('zhangq1', '1', 1)
+        self.assertEqual('book_not_checked_out', str(context.exception))
+
+    def test_rate_twice(self):
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 1)
+        self.client.rate_book('zhangq1', '1', 2)
+        self.assertEqual(2, self.client.get_rating('zhangq1', '1'))
+
+    def test_rate_borrower_not_exists(self):
+        with self.assertRaises(Exception) as context:
+            self.client.rate_book('xx', '1', 1)
+        self.assertEqual('borrower_not_exists', str(context.exception))
+
+    def test_rate_book_not_exists(self):
+        with self.assertRaises(Exception) as context:
+            self.client.rate_book('zhangq2', 'xxx', 1)
+        self.assertEqual('book_not_exists', str(context.exception))
+
+    def test_recommend1(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 3)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([book_toadd2], recommends)
+
+    def test_recommend_k(self):
+        self.assertListEqual(self.client.recommend('zhangq1', 0), [])
+        with self.assertRaises(Exception) as context:
+            self.client.recommend('zhangq1', -1)
+        self.assertEqual('non_negative_field_k', str(context.exception))
+        with self.assertRaises(Exception) as context:
+            self.client.recommend('nobody', 0)
+        self.assertEqual('borrower_not_exists', str(context.exception))
+
+    def test_recommend_different_rating(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 4)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([], recommends)
+
+    def test_recommend_below_4(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 3)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 3)
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([], recommends)
+
+    def test_recommend_already_checkout(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 3)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+        self.client.checkout_book('zhangq1', '2')
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([], recommends)
+
+    def test_recommend_multiple_book(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 3)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+        self.client.checkout_book('zhangq2', '3')
+        self.client.rate_book('zhangq2', '3', 4)
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([book_toadd2, book_toadd3], recommends)
+
+    def test_recommend_multiple_recomender(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.add_borrower(borrower_toadd3)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 3)
+        self.client.checkout_book('zhangq3', '1')
+        self.client.rate_book('zhangq3', '1', 3)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+        self.client.checkout_book('zhangq3', '2')
+        self.client.rate_book('zhangq3', '2', 4)
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([book_toadd2], recommends)
+
+    def test_recommend_multiple_recomenders_recommend_multiple_book(self):
+        self.client.edit_book("1", Book(quantity=10))
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.add_borrower(borrower_toadd3)
+        self.client.add_borrower(borrowor_toadd4)
+        self.client.checkout_book('zhangq1', '1')
+        self.client.rate_book('zhangq1', '1', 3)
+        self.client.checkout_book('zhangq2', '1')
+        self.client.rate_book('zhangq2', '1', 3)
+        self.client.checkout_book('zhangq3', '1')
+        self.client.rate_book('zhangq3', '1', 3)
+
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+        self.client.checkout_book('zhangq4', '1')
+        self.client.rate_book('zhangq4', '1', 3)
+
+        self.client.checkout_book('zhangq3', '2')
+        self.client.rate_book('zhangq3', '2', 4)
+        self.client.checkout_book('zhangq3', '3')
+        self.client.rate_book('zhangq3', '3', 5)
+
+        recommends = self.client.recommend('zhangq1')
+        self.assertCountEqual([book_toadd2, book_toadd3], recommends)
+
+    def _rate_shared_book(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        self.client.add_borrower(borrower_toadd2)
+        self.client.add_borrower(borrower_toadd3)
+        for username in ('zhangq1', 'zhangq2', 'zhangq3'):
+            self.client.checkout_book(username, '1')
+            self.client.rate_book(username, '1', 3)
+        self.client.checkout_book('zhangq2', '2')
+        self.client.rate_book('zhangq2', '2', 5)
+        self.client.checkout_book('zhangq3', '2')
+        self.client.rate_book('zhangq3', '2', 4)
+        self.client.checkout_book('zhangq3', '3')
+        self.client.rate_book('zhangq3', '3', 5)
+
+    def test_recommend_ranked(self):
+        self._rate_shared_book()
+
+        self.assertListEqual(self.client.recommend('zhangq1'), [book_toadd2, book_toadd3])
+        self.assertListEqual(self.client.recommend('zhangq1', k=1), [book_toadd2])
+
+    def test_recommend_after_rerate_and_return(self):
+        self._rate_shared_book()
+        self.client.rate_book('zhangq3', '1', 2)
+        self.assertListEqual(self.client.recommend('zhangq1'), [book_toadd2])
+
+        self.client.return_book('zhangq2', '1')
+        self.assertListEqual(self.client.recommend('zhangq1'), [])
+
+    def test_recommend_borrower_not_exists(self):
+        with self.assertRaises(Exception) as context:
+            self.client.recommend('xxx')
+        self.assertEqual('borrower_not_exists', str(context.exception))
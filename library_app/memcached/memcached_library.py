@@ -1,14 +1,60 @@
 import json
+import random
+import threading
+import time
+import zlib
+from copy import copy
 
-import memcache
+from library_app import connections
+from library_app.model import PAGE_SIZE, SEARCH_FIELDS, Book, Borrower, Library, after_book, check_field, sort_key
 
-from library_app.model import Book, Borrower, Library
 
-conn = memcache.Client(['127.0.0.1:11211'], debug=0)
+# keys per get_multi request, keeping each request well under the server's limits
+MULTI_GET_CHUNK_SIZE = 500
+
+# attempts of a gets/cas update, and the base delay in seconds of its jittered exponential backoff
+CAS_RETRIES = 10
+CAS_BACKOFF = 0.001
+
+cas_stats = {'updates': 0, 'retries': 0, 'conflicts': 0}
+cas_stats_lock = threading.Lock()
+
+# buckets a reference set is hash-partitioned into; book:keys spans the whole catalog,
+# and a book's checkout set stays in one bucket so it can be rewritten with a single cas
+SET_BUCKETS = 16
+CATALOG_SET_BUCKETS = 1024
+# a bucket log is compacted once it holds more than COMPACT_RATIO * members + COMPACT_SLACK entries
+COMPACT_RATIO = 2
+COMPACT_SLACK = 32
 
 
 def get_memcached():
-    return conn
+    return connections.get_memcached()
+
+
+def book_key(isbn):
+    # the {isbn} hash tag keeps a book and its checkout set on the same server
+    return 'book:{' + str(isbn) + '}'
+
+
+def key_isbn(key):
+    return key[len('book:{'):-1]
+
+
+def borrower_key(username):
+    return 'borrower:{' + username + '}'
+
+
+def get_multi(keys, chunk_size=None):
+    '''
+        Fetch many keys with one get_multi round trip per chunk_size keys
+
+    '''
+    chunk_size = chunk_size or MULTI_GET_CHUNK_SIZE
+    values = {}
+    for start in range(0, len(keys), chunk_size):
+        values.update(get_memcached().get_multi(keys[start:start + chunk_size]))
+    return values
 
 
 def book_to_str(book):
@@ -45,8 +91,11 @@ def str_to_book(dict):
     return Book(title=dict.get('title'), author=dict.get('author', []), isbn=dict.get('isbn'),
                 page_num=dict.get('page_num'), quantity=dict.get('quantity'))
 
-def get_books(book_keys):
-    return [str_to_book(get_memcached().get(key)) for key in book_keys]
+def get_books(book_keys, chunk_size=None):
+    book_keys = list(book_keys)
+    values = get_multi(book_keys, chunk_size)
+    return [str_to_book(values.get(key)) for key in book_keys]
+
 
 def borrower_to_str(borrower):
     if not borrower:
@@ -67,8 +116,11 @@ def str_to_borrower(dict):
     dict = json.loads(dict)
     return Borrower(username=dict.get('username'), name=dict.get('name'), phone=dict.get('phone'))
 
-def get_borrowers(borrower_keys):
-    return [str_to_borrower(get_memcached().get(key)) for key in borrower_keys]
+def get_borrowers(borrower_keys, chunk_size=None):
+    borrower_keys = list(borrower_keys)
+    values = get_multi(borrower_keys, chunk_size)
+    return [str_to_borrower(values.get(key)) for key in borrower_keys]
+
 
 def set_hash(hash_key, entity, value):
     oldValue = get_memcached().hget(hash_key, entity)
@@ -81,36 +133,163 @@ def set_hash(hash_key, entity, value):
     return oldValue
 
 
+def record_cas(retries, conflict=False):
+    with cas_stats_lock:
+        cas_stats['updates'] += 1
+        cas_stats['retries'] += retries
+        if conflict:
+            cas_stats['conflicts'] += 1
+
+
+def cas_update(key, update):
+    '''
+        Replace the value of key by update(value) with a gets/cas loop, retrying with
+        jittered exponential backoff when another client wrote the key in between.
+        update receives None for a missing key and may raise to abort.
+
+    '''
+    client = get_memcached()
+    try:
+        for attempt in range(CAS_RETRIES):
+            value = client.gets(key)
+            new_value = update(value)
+            if client.add(key, new_value) if value is None else client.cas(key, new_value):
+                record_cas(attempt)
+                return new_value
+            time.sleep(random.uniform(0, CAS_BACKOFF * 2 ** attempt))
+    finally:
+        client.reset_cas()
+    record_cas(CAS_RETRIES, conflict=True)
+    raise Exception('concurrent_update_conflict')
+
+
+def set_buckets(set_key):
+    if set_key == 'book:keys':
+        return CATALOG_SET_BUCKETS
+    if set_key.startswith('book:checkoutby-'):
+        return 1
+    return SET_BUCKETS
+
+
+def bucket_key(set_key, member):
+    return set_key + '#' + str(zlib.crc32(member.encode('utf-8')) % set_buckets(set_key))
+
+
+def bucket_keys(set_key):
+    return [set_key + '#' + str(bucket) for bucket in range(set_buckets(set_key))]
+
+
+def replay(log):
+    '''
+        Decode a bucket log of ",+member" / ",-member" entries, where the latest entry of a member wins
+
+    :return: the members and the number of entries in the log
+    '''
+    members = set()
+    entries = log.split(',')[1:] if log else []
+    for entry in entries:
+        if entry[0] == '+':
+            members.add(entry[1:])
+        else:
+            members.discard(entry[1:])
+    return members, len(entries)
+
+
+def encode(members):
+    return ''.join(',+' + member for member in members)
+
+
+def compact(key, log):
+    '''
+        Rewrite a bucket log as its live members. The write is a cas against the log
+        read, so an entry appended in between is never lost; the compaction is skipped instead.
+
+    '''
+    client = get_memcached()
+    try:
+        log = client.gets(key)
+        if log is not None:
+            client.cas(key, encode(replay(log)[0]))
+    finally:
+        client.reset_cas()
+
+
+def read_bucket(key, log):
+    members, entries = replay(log)
+    if entries > COMPACT_RATIO * len(members) + COMPACT_SLACK:
+        compact(key, log)
+    return members
+
+
 def get_set(set_key):
-    added = get_memcached().get(set_key)
-    if not added:
-        return []
-    added = set(added.split(','))
-    removed = get_memcached().get('-' + set_key)
-    if removed:
-        removed = set(removed.split(','))
-        added = added - removed
-        get_memcached().set(set_key, ','.join(list(added)))
-        get_memcached().delete('-' + set_key)
-    return added - set([''])
+    members = set()
+    for key, log in get_multi(bucket_keys(set_key)).items():
+        members |= read_bucket(key, log)
+    return members
+
+
+def is_member(set_key, member):
+    key = bucket_key(set_key, member)
+    return member in read_bucket(key, get_memcached().get(key))
+
+
+def append_entry(set_key, entry, member):
+    key = bucket_key(set_key, member)
+    if not get_memcached().append(key, ',' + entry + member):
+        get_memcached().add(key, '')
+        get_memcached().append(key, ',' + entry + member)
+
+
+def set_add(set_key, member):
+    append_entry(set_key, '+', member)
+
+
+def set_remove(set_key, member):
+    append_entry(set_key, '-', member)
+
+
+def set_add_many(pairs):
+    '''
+        Add each (set_key, member) pair with a single append per bucket
+
+    '''
+    logs = {}
+    for set_key, member in pairs:
+        key = bucket_key(set_key, member)
+        logs[key] = logs.get(key, '') + ',+' + member
+    for key, log in logs.items():
+        if not get_memcached().append(key, log):
+            get_memcached().add(key, '')
+            get_memcached().append(key, log)
+
+
+def cas_update_set(set_key, update):
+    '''
+        Replace the members of a single-bucket set by update(members) under cas
+
+    '''
+    cas_update(set_key + '#0', lambda log: encode(update(replay(log)[0])))
+
 
 def update_set_reference(refer_key, set_prefix, oldValue, newValue):
     if oldValue:
-        get_memcached().add('-' + set_prefix + oldValue, '')
-        get_memcached().append('-' + set_prefix + oldValue, ',' + refer_key)
+        set_remove(set_prefix + oldValue, refer_key)
     if newValue:
-        get_memcached().add(set_prefix + newValue, '')
-        get_memcached().append(set_prefix + newValue, ',' + refer_key)
+        set_add(set_prefix + newValue, refer_key)
 
 
 class BookProxy:
     def __init__(self, isbn):
-        self.book_key = 'book:' + str(isbn)
+        self.book_key = book_key(isbn)
         self.book = str_to_book(get_memcached().get(self.book_key))
 
-    def add(self):
-        get_memcached().add('book:keys', '')
-        get_memcached().append('book:keys', ',' + self.book_key)
+    def add(self, book):
+        # add only stores a missing key, so concurrent creations of one isbn cannot both succeed
+        if not get_memcached().add(self.book_key, book_to_str(book)):
+            raise Exception('book_exist_already')
+        self.book = book
+        set_add('book:keys', self.book_key)
+        self.update_references(Book(), book)
 
     def save(self):
         get_memcached().set(self.book_key, book_to_str(self.book))
@@ -119,75 +298,83 @@ class BookProxy:
         return self.book is not None
 
     def edit(self, book, override):
-        if not self.exists():
-            self.book = Book(isbn=book.isbn)
-        if override or book.title:
-            self.set_title(book.title)
-        if override or book.author:
-            self.set_author(book.author)
-        if override or book.page_num:
-            self.set_page_num(book.page_num)
-        if book.quantity:
-            self.set_quantity(book.quantity)
-        get_memcached().set(self.book_key, book_to_str(self.book))
+        if book.quantity and not type(book.quantity) == int:
+            raise Exception('quantity must be integer :' + str(book.quantity))
+        edited = []
+
+        # merge into the latest stored document, so parallel edits of other fields are kept
+        def merge(value):
+            old = str_to_book(value)
+            if old is None:
+                raise Exception('book_not_exists')
+            new = copy(old)
+            if override or book.title:
+                new.title = book.title
+            if override or book.author:
+                new.author = book.author
+            if override or book.page_num:
+                new.page_num = book.page_num
+            if book.quantity:
+                new.quantity = book.quantity
+            edited[:] = [old, new]
+            return book_to_str(new)
+
+        cas_update(self.book_key, merge)
+        old, self.book = edited
+        self.update_references(old, self.book)
 
     def delete(self):
         get_memcached().delete(self.book_key)
-        get_memcached().add('-book:keys', '')
-        get_memcached().append('-book:keys', self.book_key)
-        self.set_title(None)
-        self.set_author(None)
-        self.set_page_num(None)
-        get_memcached().delete(self.book_key)
+        set_remove('book:keys', self.book_key)
+        self.update_references(self.book, Book())
         return False
 
-    def set_title(self, title):
-        oldValue = self.book.title if self.book else None
-        self.book.title = title
-        update_set_reference(self.book_key, 'book:title-', oldValue, title)
-
-    def set_author(self, author):
-        oldValue = None
-        if self.book.author:
-            oldValue = self.book.author
-        self.book.author = author
-        if oldValue:
-            for oAuthor in oldValue:
+    def update_references(self, old, new):
+        if old.title != new.title:
+            update_set_reference(self.book_key, 'book:title-', old.title, new.title)
+        if old.author != new.author:
+            for oAuthor in old.author or []:
                 update_set_reference(self.book_key, 'book:author-', oAuthor, None)
-        if author:
-            for nAuthor in author:
+            for nAuthor in new.author or []:
                 update_set_reference(self.book_key, 'book:author-', None, nAuthor)
 
-    def set_quantity(self, quantity):
-        if not type(quantity) == int:
-            raise Exception('quantity must be integer :' + str(quantity))
-        self.book.quantity = quantity
-
     def get_quantity(self):
         return self.book.quantity
 
-    def set_page_num(self, page_num):
-        self.book.page_num = page_num
-
     def get_borrower_num(self):
         return len(get_set('book:checkoutby-' + self.book_key))
 
     def is_borrower(self, borrowerProxy):
-        return borrowerProxy.borrower_key in get_set('book:checkoutby-' + self.book_key)
+        return is_member('book:checkoutby-' + self.book_key, borrowerProxy.borrower_key)
 
     def add_borrower(self, borrowerProxy):
-        update_set_reference(borrowerProxy.borrower_key, 'book:checkoutby-', None, self.book_key)
+        # the availability check and the insert are one cas write, so the book cannot be oversubscribed
+        def reserve(borrowers):
+            if borrowerProxy.borrower_key in borrowers:
+                raise Exception('book_already_borrowed')
+            if len(borrowers) >= self.get_quantity():
+                raise Exception('book_not_available')
+            borrowers.add(borrowerProxy.borrower_key)
+            return borrowers
+
+        cas_update_set('book:checkoutby-' + self.book_key, reserve)
         update_set_reference(self.book_key, 'borrower:checkoutby-', None, borrowerProxy.borrower_key)
 
     def remove_borrower(self, borrowerProxy):
-        update_set_reference(borrowerProxy.borrower_key, 'book:checkoutby-', self.book_key, None)
+        def release(borrowers):
+            if borrowerProxy.borrower_key not in borrowers:
+                raise Exception('book_not_borrowed')
+            borrowers.remove(borrowerProxy.borrower_key)
+            return borrowers
+
+        cas_update_set('book:checkoutby-' + self.book_key, release)
         update_set_reference(self.book_key, 'borrower:checkoutby-', borrowerProxy.borrower_key, None)
 
 
 class BorrowerProxy:
     def __init__(self, username):
         self.username = username
-        self.borrower_key = 'borrower:' + username
+        self.borrower_key = borrower_key(username)
         self.borrower = str_to_borrower(get_memcached().get(self.borrower_key))
 
     def exists(self):
@@ -196,27 +383,35 @@ class BorrowerProxy:
     def save(self):
         get_memcached().set(self.borrower_key, borrower_to_str(self.borrower))
 
+    def add(self, borrower):
+        if not get_memcached().add(self.borrower_key, borrower_to_str(borrower)):
+            raise Exception('borrower_already_exists')
+        self.borrower = borrower
+        update_set_reference(self.borrower_key, 'borrower:name-', None, borrower.name)
+
     def edit(self, borrower):
-        if not self.exists():
-            self.borrower = Borrower(username=borrower.username)
-        if borrower.name:
-            self.set_name(borrower.name)
-        if borrower.phone:
-            self.set_phone(borrower.phone)
-        self.save()
+        edited = []
+
+        def merge(value):
+            old = str_to_borrower(value)
+            if old is None:
+                raise Exception('borrower_not_exists')
+            new = copy(old)
+            if borrower.name:
+                new.name = borrower.name
+            if borrower.phone:
+                new.phone = borrower.phone
+            edited[:] = [old, new]
+            return borrower_to_str(new)
+
+        cas_update(self.borrower_key, merge)
+        old, self.borrower = edited
+        if old.name != self.borrower.name:
+            update_set_reference(self.borrower_key, 'borrower:name-', old.name, self.borrower.name)
 
     def delete(self):
-        self.set_name(None)
-        self.set_phone(None)
         get_memcached().delete(self.borrower_key)
-
-    def set_name(self, name):
-        oldValue = self.borrower.name if self.borrower else None
-        self.borrower.name = name
-        update_set_reference(self.borrower_key, 'borrower:name-', oldValue, name)
-
-    def set_phone(self, phone):
-        self.borrower.phone = phone
+        update_set_reference(self.borrower_key, 'borrower:name-', self.borrower.name, None)
 
     def get_borrowed_book_num(self):
         return len(get_set('borrower:checkoutby-' + self.borrower_key))
@@ -228,15 +423,56 @@ class MemcachedLibrary(Library):
 
     def add_book(self, book):
         Library.add_book(self, book)
-        bookproxy = BookProxy(book.isbn)
-        if bookproxy.exists():
-            raise Exception('book_exist_already')
-        bookproxy.add()
-        bookproxy.edit(book, True)
+        BookProxy(book.isbn).add(book)
+
+    def add_books(self, books):
+        '''
+            Add books with batched get_multi and set_multi calls and one append per set bucket.
+            Meant for bulk loading: unlike add_book, a book added concurrently by someone else is overwritten.
+
+        :param books:
+        :return: the error raised for each book by add_book, None where it was added
+        '''
+        books = list(books)
+        errors = [None] * len(books)
+        new_books = {}
+        for index, book in enumerate(books):
+            try:
+                Library.add_book(self, book)
+                if book_key(book.isbn) in new_books:
+                    raise Exception('book_exist_already')
+                new_books[book_key(book.isbn)] = index
+            except Exception as e:
+                errors[index] = e
+        for key in get_multi(list(new_books)):
+            errors[new_books.pop(key)] = Exception('book_exist_already')
+        keys = list(new_books)
+        for start in range(0, len(keys), MULTI_GET_CHUNK_SIZE):
+            # set_multi returns the keys the servers did not store
+            for key in get_memcached().set_multi({key: book_to_str(books[new_books[key]])
+                                                  for key in keys[start:start + MULTI_GET_CHUNK_SIZE]}):
+                errors[new_books.pop(key)] = Exception('book_not_stored')
+        references = []
+        for key, index in new_books.items():
+            book = books[index]
+            references.append(('book:keys', key))
+            if book.title:
+                references.append(('book:title-' + book.title, key))
+            references.extend(('book:author-' + author, key) for author in book.author)
+        set_add_many(references)
+        return errors
 
     def get_book(self, isbn):
         return BookProxy(isbn).book
 
+    def get_books(self, isbns):
+        '''
+
+        :param isbns:
+        :return: the book of each isbn, None where it does not exist, fetched with batched get_multi
+        '''
+        return get_books([book_key(isbn) for isbn in isbns])
+
     def delete_book(self, isbn):
         proxy = BookProxy(isbn)
         if not proxy.exists():
@@ -261,12 +497,12 @@ class MemcachedLibrary(Library):
 
     def sort_by_title(self):  # return all books
         books = get_books(get_set('book:keys'))
-        books.sort(key=lambda b: b.title)
+        books.sort(key=lambda b: (sort_key(b.title), b.isbn))
         return books
 
     def sort_by_author(self):  # return all books
         books = get_books(get_set('book:keys'))
-        books.sort(key=lambda b: b.author)
+        books.sort(key=lambda b: (sort_key(b.author), b.isbn))
         return books
 
     def sort_by_isbn(self):  # return all books
@@ -276,15 +512,49 @@ class MemcachedLibrary(Library):
 
     def sort_by_page_num(self):  # return all books
         books = get_books(get_set('book:keys'))
-        books.sort(key=lambda b: b.page_num)
+        books.sort(key=lambda b: (sort_key(b.page_num), b.isbn))
         return books
 
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, page_size books per get_multi. Only the isbn order can be
+            read from the catalog key set, which is sorted in memory; other fields fall back to sort_by_<field>.
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        if field != 'isbn':
+            return Library.iter_sorted(self, field, page_size, after)
+        after_book(self, after)
+        return self._key_pages(get_set('book:keys'), page_size, after)
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books found by title or author, ordered by isbn, page_size books per get_multi
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        return self._key_pages(get_set('book:{}-{}'.format(field, value)), page_size, after)
+
+    def _key_pages(self, keys, page_size, after):
+        isbns = sorted(isbn for isbn in map(key_isbn, keys) if after is None or isbn > after)
+        for start in range(0, len(isbns), page_size):
+            for book in get_books([book_key(isbn) for isbn in isbns[start:start + page_size]]):
+                if book is not None:
+                    yield book
+
     def add_borrower(self, borrower):
         Library.add_borrower(self, borrower)
-        proxy = BorrowerProxy(borrower.username)
-        if proxy.exists():
-            raise Exception('borrower_already_exists')
-        proxy.edit(borrower)
+        BorrowerProxy(borrower.username).add(borrower)
 
     def get_borrower(self, username):
         return BorrowerProxy(username).borrower
@@ -313,11 +583,6 @@ class MemcachedLibrary(Library):
         proxy = BookProxy(isbn)
         if not proxy.exists():
             raise Exception('book_not_exists')
-        # verify availability
-        if proxy.is_borrower(borrowerProxy):
-            raise Exception('book_already_borrowed')
-        if proxy.get_borrower_num() >= proxy.get_quantity():
-            raise Exception('book_not_available')
         proxy.add_borrower(borrowerProxy)
 
     def return_book(self, username, isbn):
@@ -327,9 +592,6 @@ class MemcachedLibrary(Library):
         proxy = BookProxy(isbn)
         if not proxy.exists():
             raise Exception('book_not_exists')
-        # verify indeed borrowed
-        if not proxy.is_borrower(borrowerProxy):
-            raise Exception('book_not_borrowed')
         proxy.remove_borrower(borrowerProxy)
 
     def get_book_borrowers(self, isbn):
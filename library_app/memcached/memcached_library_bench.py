@@ -0,0 +1,123 @@
+import subprocess
+import threading
+import time
+
+from library_app import connections
+from library_app.config import Config
+from library_app.memcached import memcached_library
+from library_app.memcached.memcached_library import MemcachedLibrary, book_key, book_to_str, get_books, \
+    get_memcached, str_to_book
+from library_app.memcached.memcached_ring import remap_fraction
+from library_app.model import Book, Borrower
+
+
+def per_key_get_books(book_keys):
+    return [str_to_book(get_memcached().get(key)) for key in book_keys]
+
+
+def measure(fetch, book_keys):
+    start = time.perf_counter()
+    fetch(book_keys)
+    return time.perf_counter() - start
+
+
+def main(sizes=(1000, 10000, 100000)):
+    library = MemcachedLibrary()
+    library.drop_db()
+    added = 0
+    print('{:>8} {:>12} {:>12}'.format('books', 'per_key_s', 'multi_s'))
+    for size in sizes:
+        get_memcached().set_multi({book_key(i): book_to_str(
+            Book(title='title' + str(i), author=['author' + str(i % 100)], isbn=str(i), page_num=i % 1000 + 1,
+                 quantity=1)) for i in range(added, size)})
+        added = size
+        book_keys = [book_key(i) for i in range(size)]
+        print('{:>8} {:>12.4f} {:>12.4f}'.format(size, measure(per_key_get_books, book_keys),
+                                                 measure(get_books, book_keys)))
+    library.drop_db()
+
+
+def churn(library, username, isbn, rounds):
+    for _ in range(rounds):
+        try:
+            library.checkout_book(username, isbn)
+            library.return_book(username, isbn)
+        except Exception:
+            pass
+
+
+def contention(workers=(1, 4, 16, 64), rounds=200, quantity=5):
+    '''
+        Have workers check out and return one book concurrently and report the cas retry rate
+
+    '''
+    library = MemcachedLibrary()
+    print('{:>8} {:>10} {:>10} {:>10} {:>12}'.format('workers', 'updates', 'retries', 'conflicts', 'retry_rate'))
+    for worker_num in workers:
+        library.drop_db()
+        library.add_book(Book(isbn='hot', title='hot', author=['hot'], page_num=1, quantity=quantity))
+        for i in range(worker_num):
+            library.add_borrower(Borrower(username='worker' + str(i), name='worker'))
+        memcached_library.cas_stats.update(updates=0, retries=0, conflicts=0)
+        threads = [threading.Thread(target=churn, args=(library, 'worker' + str(i), 'hot', rounds))
+                   for i in range(worker_num)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = memcached_library.cas_stats
+        print('{:>8} {:>10} {:>10} {:>10} {:>12.4f}'.format(worker_num, stats['updates'], stats['retries'],
+                                                             stats['conflicts'],
+                                                             stats['retries'] / max(stats['updates'], 1)))
+    library.drop_db()
+
+
+def remapping(nodes=(1, 2, 4, 8, 16), key_num=100000):
+    '''
+        Report the fraction of keys remapped when a node joins a ring of each size
+
+    '''
+    keys = [book_key(i) for i in range(key_num)]
+    print('{:>8} {:>10} {:>10}'.format('nodes', 'remapped', 'ideal'))
+    for node_num in nodes:
+        servers = ['127.0.0.1:' + str(11311 + i) for i in range(node_num + 1)]
+        print('{:>8} {:>10.4f} {:>10.4f}'.format(node_num, remap_fraction(servers[:-1], servers, keys),
+                                                 1 / (node_num + 1)))
+
+
+def scaling(nodes=(1, 2, 4), workers=16, book_num=10000, rounds=5):
+    '''
+        Start local memcached instances and report get_books throughput as the ring grows
+
+    '''
+    print('{:>8} {:>14}'.format('nodes', 'books_per_s'))
+    for node_num in nodes:
+        ports = [11311 + i for i in range(node_num)]
+        instances = [subprocess.Popen(['memcached', '-p', str(port), '-U', '0']) for port in ports]
+        try:
+            time.sleep(0.5)
+            config = Config()
+            config.memcached_servers = ['127.0.0.1:' + str(port) for port in ports]
+            connections.configure(config)
+            get_memcached().set_multi({book_key(i): book_to_str(Book(isbn=str(i), page_num=1, quantity=1))
+                                       for i in range(book_num)})
+            book_keys = [book_key(i) for i in range(book_num)]
+            threads = [threading.Thread(target=lambda: [get_books(book_keys) for _ in range(rounds)])
+                       for _ in range(workers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            print('{:>8} {:>14.0f}'.format(node_num, workers * rounds * book_num / (time.perf_counter() - start)))
+        finally:
+            for instance in instances:
+                instance.terminate()
+    connections.configure(Config())
+
+
+if __name__ == '__main__':
+    main()
+    contention()
+    remapping()
+    scaling()
@@ -1,10 +1,62 @@
 import unittest
 
-from library_app.library_test import LibraryTest
-from .memcached_library import MemcachedLibrary
+from library_app.library_test import LibraryTest, book_toadd, book_toadd2
+from .memcached_library import MemcachedLibrary, book_key, bucket_key, bucket_keys, encode, replay
+from .memcached_ring import HashRing, remap_fraction
 
 
 class MemCachedLibraryTest(LibraryTest, unittest.TestCase):
 
     def setUpClient(self):
         self.client = MemcachedLibrary()
+
+    def test_get_books(self):
+        self.client.add_book(book_toadd2)
+
+        self.assertListEqual(self.client.get_books(['2', 'missing', '1']), [book_toadd2, None, book_toadd])
+
+class ChunkedSetTest(unittest.TestCase):
+
+    def test_replay_latest_entry_wins(self):
+        members, entries = replay(',+book:1,+book:2,-book:1,+book:3,-book:2,+book:1')
+
+        self.assertEqual(members, {'book:1', 'book:3'})
+        self.assertEqual(entries, 6)
+
+    def test_replay_empty(self):
+        self.assertEqual(replay(None), (set(), 0))
+        self.assertEqual(replay(''), (set(), 0))
+
+    def test_encode_round_trip(self):
+        members = {'book:1', 'book:2'}
+
+        self.assertEqual(replay(encode(members)), (members, 2))
+
+    def test_bucket_key_is_one_of_bucket_keys(self):
+        for set_key in ('book:keys', 'book:title-book_small', 'book:checkoutby-book:1'):
+            self.assertIn(bucket_key(set_key, 'book:42'), bucket_keys(set_key))
+        self.assertEqual(bucket_keys('book:checkoutby-book:1'), ['book:checkoutby-book:1#0'])
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_hash_tag_colocates_book_and_checkout_set(self):
+        ring = HashRing(['127.0.0.1:' + str(11211 + i) for i in range(8)])
+        for isbn in range(100):
+            self.assertEqual(ring.get_server(book_key(isbn)),
+                             ring.get_server(bucket_key('book:checkoutby-' + book_key(isbn), 'borrower:{x}')))
+
+    def test_adding_a_node_remaps_about_one_nth(self):
+        servers = ['127.0.0.1:' + str(11211 + i) for i in range(5)]
+        fraction = remap_fraction(servers[:4], servers, [book_key(i) for i in range(20000)])
+
+        self.assertGreater(fraction, 0.1)
+        self.assertLess(fraction, 0.3)
+
+    def test_removed_node_keys_only_move(self):
+        servers = ['127.0.0.1:' + str(11211 + i) for i in range(4)]
+        before = HashRing(servers)
+        after = HashRing(servers[1:])
+        for i in range(2000):
+            if before.get_server(book_key(i)) != servers[0]:
+                self.assertEqual(before.get_server(book_key(i)), after.get_server(book_key(i)))
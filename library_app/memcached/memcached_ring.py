@@ -0,0 +1,123 @@
+import bisect
+import hashlib
+
+# points each server owns on the ring; ketama uses 40 md5 digests of 4 points each
+POINTS_PER_SERVER = 160
+
+
+def hash_tag(key):
+    '''
+        The part of key that decides its server: the text inside the first {...} when present,
+        so keys sharing a tag, such as book:{1} and book:checkoutby-book:{1}#0, land together.
+
+    '''
+    start = key.find('{')
+    if start >= 0:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class HashRing:
+    '''
+        Ketama-style consistent hashing: a key belongs to the first server point clockwise
+        from its hash, so adding or removing one of N servers remaps only ~1/N of the keys.
+
+    '''
+
+    def __init__(self, servers, points_per_server=POINTS_PER_SERVER):
+        self.servers = list(servers)
+        ring = []
+        for server in self.servers:
+            for i in range(points_per_server // 4):
+                digest = hashlib.md5('{}-{}'.format(server, i).encode('utf-8')).digest()
+                for j in range(4):
+                    ring.append((int.from_bytes(digest[j * 4:j * 4 + 4], 'little'), server))
+        ring.sort()
+        self.points = [point for point, server in ring]
+        self.owners = [server for point, server in ring]
+
+    def get_server(self, key):
+        digest = hashlib.md5(hash_tag(key).encode('utf-8')).digest()
+        index = bisect.bisect(self.points, int.from_bytes(digest[0:4], 'little'))
+        return self.owners[index % len(self.owners)]
+
+
+def remap_fraction(servers, new_servers, keys):
+    '''
+
+    :return: the fraction of keys that move to another server when servers become new_servers
+    '''
+    before = HashRing(servers)
+    after = HashRing(new_servers)
+    return sum(1 for key in keys if before.get_server(key) != after.get_server(key)) / len(keys)
+
+
+class ShardedClient:
+    '''
+        A memcache.Client look-alike spreading keys over several servers with a HashRing.
+        Multi-key calls are split per server, one round trip each.
+
+    '''
+
+    def __init__(self, servers, **client_options):
+        import memcache
+        self.ring = HashRing(servers)
+        self.clients = {server: memcache.Client([server], **client_options) for server in self.ring.servers}
+
+    def client_for(self, key):
+        return self.clients[self.ring.get_server(key)]
+
+    def group_by_client(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring.get_server(key), []).append(key)
+        return [(self.clients[server], server_keys) for server, server_keys in groups.items()]
+
+    def get(self, key):
+        return self.client_for(key).get(key)
+
+    def gets(self, key):
+        return self.client_for(key).gets(key)
+
+    def set(self, key, val, time=0):
+        return self.client_for(key).set(key, val, time)
+
+    def add(self, key, val, time=0):
+        return self.client_for(key).add(key, val, time)
+
+    def append(self, key, val, time=0):
+        return self.client_for(key).append(key, val, time)
+
+    def cas(self, key, val, time=0):
+        return self.client_for(key).cas(key, val, time)
+
+    def delete(self, key):
+        return self.client_for(key).delete(key)
+
+    def incr(self, key, delta=1):
+        return self.client_for(key).incr(key, delta)
+
+    def decr(self, key, delta=1):
+        return self.client_for(key).decr(key, delta)
+
+    def get_multi(self, keys):
+        values = {}
+        for client, server_keys in self.group_by_client(keys):
+            values.update(client.get_multi(server_keys))
+        return values
+
+    def set_multi(self, mapping, time=0):
+        failed = []
+        for client, server_keys in self.group_by_client(mapping):
+            failed.extend(client.set_multi({key: mapping[key] for key in server_keys}, time))
+        return failed
+
+    def reset_cas(self):
+        for client in self.clients.values():
+            client.reset_cas()
+
+    def flush_all(self):
+        for client in self.clients.values():
+            client.flush_all()
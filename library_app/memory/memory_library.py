@@ -0,0 +1,506 @@
+import bisect
+import heapq
+import threading
+from collections import Counter
+
+from library_app.model import PAGE_SIZE, SEARCH_FIELDS, SORT_FIELDS, Book, Borrower, Library, after_book, check_field, \
+    sort_key
+
+
+def index_add(index, value, id):
+    index.setdefault(value, {})[id] = None
+
+
+def index_remove(index, value, id):
+    ids = index.get(value)
+    if ids is not None:
+        ids.pop(id, None)
+        if not ids:
+            del index[value]
+
+
+class SortedEntries(object):
+    '''
+        The (sort_key, id) entries of one sort field. Writes are buffered and merged into the sorted
+        list by the next read, so a batch of n adds costs one O(N + n log n) merge rather than n
+        O(N) list inserts.
+
+    '''
+
+    def __init__(self):
+        self.merged = []
+        self.added = set()
+        self.removed = set()
+
+    def add(self, value, id):
+        entry = (sort_key(value), id)
+        if entry in self.removed:
+            self.removed.discard(entry)
+        else:
+            self.added.add(entry)
+
+    def remove(self, value, id):
+        entry = (sort_key(value), id)
+        if entry in self.added:
+            self.added.discard(entry)
+        else:
+            self.removed.add(entry)
+
+    def entries(self):
+        '''
+            The sorted list, merging in the buffered writes first
+
+        '''
+        if self.added or self.removed:
+            kept = [entry for entry in self.merged if entry not in self.removed] if self.removed else self.merged
+            self.merged = list(heapq.merge(kept, sorted(self.added)))
+            self.added = set()
+            self.removed = set()
+        return self.merged
+
+
+def copy_book(book):
+    return Book(title=book.title, author=list(book.author) if book.author is not None else None,
+                isbn=book.isbn, page_num=book.page_num, quantity=book.quantity)
+
+
+def copy_borrower(borrower):
+    return Borrower(username=borrower.username, name=borrower.name, phone=borrower.phone)
+
+
+class InMemoryLibrary(Library):
+    '''
+        A Library kept in process memory: hash maps for the records, inverted indexes for the searches,
+        lazily merged sorted lists for the sorts and adjacency maps for the checkouts. Nothing is persisted.
+
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.drop_db()
+
+    def drop_db(self):
+        '''
+            Drop the whole database so we can start from scratch
+
+        '''
+        with self.lock:
+            self.books = {}
+            self.borrowers = {}
+            self.title_index = {}
+            self.author_index = {}
+            self.name_index = {}
+            self.sorted = {field: SortedEntries() for field in SORT_FIELDS}
+            # isbn -> {username: rating}, the rating is None until the borrower rates the book
+            self.book_borrowers = {}
+            # username -> {isbn: None}
+            self.borrowed_books = {}
+            # username -> Counter of the ratings shared with each other borrower, kept in both directions
+            self.similar = {}
+
+    def _index_book(self, book):
+        index_add(self.title_index, book.title, book.isbn)
+        for author in book.author or []:
+            index_add(self.author_index, author, book.isbn)
+        for field in SORT_FIELDS:
+            self.sorted[field].add(getattr(book, field), book.isbn)
+
+    def _unindex_book(self, book):
+        index_remove(self.title_index, book.title, book.isbn)
+        for author in book.author or []:
+            index_remove(self.author_index, author, book.isbn)
+        for field in SORT_FIELDS:
+            self.sorted[field].remove(getattr(book, field), book.isbn)
+
+    def add_book(self, book):
+        '''
+
+        :param book:
+        :raise: 'required_field_book.isbn', 'required_posivitive_field_book.page_num', 'posivitive_field_book.quantity', 'book_exist_already'
+        '''
+        Library.add_book(self, book)
+        with self.lock:
+            if book.isbn in self.books:
+                raise Exception('book_exist_already')
+            book = copy_book(book)
+            self.books[book.isbn] = book
+            self.book_borrowers[book.isbn] = {}
+            self._index_book(book)
+
+    def get_book(self, isbn):
+        '''
+
+        :param isbn:
+        :return: get the book by isbn
+        '''
+        book = self.books.get(isbn)
+        return copy_book(book) if book else None
+
+    def delete_book(self, isbn):
+        '''
+
+        :param isbn:
+        :raise: 'book_not_exists', 'book_borrowed'
+        '''
+        with self.lock:
+            book = self.books.get(isbn)
+            if book is None:
+                raise Exception('book_not_exists')
+            if self.book_borrowers[isbn]:
+                raise Exception('book_borrowed')
+            self._unindex_book(book)
+            del self.books[isbn]
+            del self.book_borrowers[isbn]
+
+    def edit_book(self, isbn, book, override=False):
+        '''
+
+        :param isbn:
+        :param book:
+        :raise: 'book_not_exists', 'book_borrowed'
+        '''
+        with self.lock:
+            old_book = self.books.get(isbn)
+            if old_book is None:
+                raise Exception('book_not_exists')
+            new_book = copy_book(old_book)
+            if override or book.title:
+                new_book.title = book.title
+            if override or book.author:
+                new_book.author = list(book.author) if book.author is not None else None
+            if override or book.page_num:
+                new_book.page_num = book.page_num
+            if book.quantity:
+                if len(self.book_borrowers[isbn]) > book.quantity:
+                    raise Exception('book_borrowed')
+                new_book.quantity = book.quantity
+            self._unindex_book(old_book)
+            self.books[isbn] = new_book
+            self._index_book(new_book)
+
+    def _books(self, isbns):
+        return [copy_book(self.books[isbn]) for isbn in isbns]
+
+    def search_by_title(self, title):
+        '''
+
+        :param title:
+        :return: all books with this title
+        '''
+        with self.lock:
+            return self._books(self.title_index.get(title, ()))
+
+    def search_by_author(self, author):
+        '''
+
+        :param author:
+        :return: all books by this author
+        '''
+        with self.lock:
+            return self._books(self.author_index.get(author, ()))
+
+    def _sort_by(self, field):
+        with self.lock:
+            return self._books(isbn for key, isbn in self.sorted[field].entries())
+
+    def sort_by_title(self):
+        '''
+
+        :return: all books sorted by title
+        '''
+        return self._sort_by('title')
+
+    def sort_by_author(self):
+        '''
+
+        :return: all books sorted by author
+        '''
+        return self._sort_by('author')
+
+    def sort_by_isbn(self):
+        '''
+
+        :return: all books sorted by isbn
+        '''
+        return self._sort_by('isbn')
+
+    def sort_by_page_num(self):
+        '''
+
+        :return: all books sorted by page number
+        '''
+        return self._sort_by('page_num')
+
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, ties ordered by isbn, bisecting the sorted list for each page
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        check_field(field, SORT_FIELDS)
+        book = after_book(self, after)
+        return self._sorted_pages(field, page_size, (sort_key(getattr(book, field)), book.isbn) if book else None)
+
+    def _sorted_pages(self, field, page_size, entry):
+        while True:
+            with self.lock:
+                entries = self.sorted[field].entries()
+                start = bisect.bisect_right(entries, entry) if entry is not None else 0
+                page = entries[start:start + page_size]
+                books = self._books(isbn for key, isbn in page)
+            for book in books:
+                yield book
+            if len(page) < page_size:
+                return
+            entry = page[-1]
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books found by title or author, ordered by isbn
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        return self._search_pages(self.title_index if field == 'title' else self.author_index, value, page_size, after)
+
+    def _search_pages(self, index, value, page_size, after):
+        while True:
+            with self.lock:
+                isbns = heapq.nsmallest(page_size, (isbn for isbn in index.get(value, ())
+                                                    if after is None or isbn > after))
+                books = self._books(isbns)
+            for book in books:
+                yield book
+            if len(isbns) < page_size:
+                return
+            after = isbns[-1]
+
+    def add_borrower(self, borrower):
+        '''
+
+        :param borrower:
+        :raise: 'required_field_borrower.username', 'borrower_already_exists'
+        '''
+        Library.add_borrower(self, borrower)
+        with self.lock:
+            if borrower.username in self.borrowers:
+                raise Exception('borrower_already_exists')
+            self.borrowers[borrower.username] = copy_borrower(borrower)
+            self.borrowed_books[borrower.username] = {}
+            self.similar[borrower.username] = Counter()
+            index_add(self.name_index, borrower.name, borrower.username)
+
+    def get_borrower(self, username):
+        '''
+
+        :param username:
+        :return: the borrower with this username
+        '''
+        borrower = self.borrowers.get(username)
+        return copy_borrower(borrower) if borrower else None
+
+    def delete_borrower(self, username):
+        '''
+
+        :param username:
+        :raise 'borrower_not_exists', 'book_borrowed'
+        '''
+        with self.lock:
+            borrower = self.borrowers.get(username)
+            if borrower is None:
+                raise Exception('borrower_not_exists')
+            if self.borrowed_books[username]:
+                raise Exception('book_borrowed')
+            index_remove(self.name_index, borrower.name, username)
+            del self.borrowers[username]
+            del self.borrowed_books[username]
+            del self.similar[username]
+
+    def edit_borrower(self, username, borrower, override=False):
+        '''
+
+        :param username:
+        :param borrower:
+        :raise 'borrower_not_exists
+        '''
+        with self.lock:
+            old_borrower = self.borrowers.get(username)
+            if old_borrower is None:
+                raise Exception('borrower_not_exists')
+            new_borrower = copy_borrower(old_borrower)
+            if override or borrower.name:
+                new_borrower.name = borrower.name
+            if override or borrower.phone:
+                new_borrower.phone = borrower.phone
+            index_remove(self.name_index, old_borrower.name, username)
+            self.borrowers[username] = new_borrower
+            index_add(self.name_index, new_borrower.name, username)
+
+    def search_by_name(self, name):
+        '''
+
+        :param name:
+        :return: borrowers with this name
+        '''
+        with self.lock:
+            return [copy_borrower(self.borrowers[username]) for username in self.name_index.get(name, ())]
+
+    def checkout_book(self, username, isbn):
+        '''
+
+        :param username:
+        :param isbn:
+        :raise 'book_not_exists', 'borrower_not_exists', 'book_already_borrowed', 'book_not_available'
+        '''
+        with self.lock:
+            if isbn not in self.books:
+                raise Exception('book_not_exists')
+            if username not in self.borrowers:
+                raise Exception('borrower_not_exists')
+            borrowers = self.book_borrowers[isbn]
+            if username in borrowers:
+                raise Exception('book_already_borrowed')
+            if len(borrowers) >= self.books[isbn].quantity:
+                raise Exception('book_not_available')
+            borrowers[username] = None
+            self.borrowed_books[username][isbn] = None
+
+    def return_book(self, username, isbn):
+        '''
+
+        :param username:
+        :param isbn:
+        :raise: `borrower_not_exists`, `book_not_exists`, `book_not_borrowed`
+        '''
+        with self.lock:
+            if username not in self.borrowers:
+                raise Exception('borrower_not_exists')
+            if isbn not in self.books:
+                raise Exception('book_not_exists')
+            borrowers = self.book_borrowers[isbn]
+            if username not in borrowers:
+                raise Exception('book_not_borrowed')
+            self._update_similar(username, isbn, borrowers.pop(username), -1)
+            del self.borrowed_books[username][isbn]
+
+    def get_book_borrowers(self, isbn):
+        '''
+
+        :param isbn:
+        :return: the borrowers that have borrowed this book
+        :raise: 'book_not_exists'
+        '''
+        with self.lock:
+            if isbn not in self.books:
+                raise Exception('book_not_exists')
+            return [copy_borrower(self.borrowers[username]) for username in self.book_borrowers[isbn]]
+
+    def get_borrowed_books(self, username):
+        '''
+
+        :param username:
+        :return:
+        :raise: 'borrower_not_exists'
+        '''
+        with self.lock:
+            if username not in self.borrowers:
+                raise Exception('borrower_not_exists')
+            return self._books(self.borrowed_books[username])
+
+    def _checkout_ratings(self, username, isbn):
+        '''
+
+        :return: the {username: rating} map of the book's checkouts, which include this borrower's
+        :raise: 'book_not_exists', 'borrower_not_exists', 'book_not_checked_out'
+        '''
+        if isbn not in self.books:
+            raise Exception('book_not_exists')
+        if username not in self.borrowers:
+            raise Exception('borrower_not_exists')
+        ratings = self.book_borrowers[isbn]
+        if username not in ratings:
+            raise Exception('book_not_checked_out')
+        return ratings
+
+    def _update_similar(self, username, isbn, rating, delta):
+        '''
+            Add delta to the similarity between this borrower and everyone else who rated the book rating
+
+        '''
+        if rating is None:
+            return
+        for other, other_rating in self.book_borrowers[isbn].items():
+            if other != username and other_rating == rating:
+                for x, y in ((username, other), (other, username)):
+                    self.similar[x][y] += delta
+                    if self.similar[x][y] <= 0:
+                        del self.similar[x][y]
+
+    def rate_book(self, username, isbn, rating):
+        '''
+
+        :param username:
+        :param isbn:
+        :param rating:
+        :return:
+        :raise: 'borrower_not_exists'
+        :raise: 'book_not_exists'
+        :raise: 'rating_between_1_and_5'
+        :raise: 'book_not_checked_out'
+        '''
+        if rating < 1 or rating > 5:
+            raise Exception('rating_between_1_and_5')
+        with self.lock:
+            ratings = self._checkout_ratings(username, isbn)
+            old_rating = ratings[username]
+            if old_rating == rating:
+                return
+            self._update_similar(username, isbn, old_rating, -1)
+            ratings[username] = rating
+            self._update_similar(username, isbn, rating, 1)
+
+    def get_rating(self, username, isbn):
+        '''
+
+        :param username:
+        :param isbn:
+        :return:
+        :raise: 'borrower_not_exists'
+        :raise: 'book_not_exists'
+        :raise: 'book_not_checked_out'
+        '''
+        with self.lock:
+            return self._checkout_ratings(username, isbn)[username]
+
+    def recommend(self, username, k=10):
+        '''
+            Rank the books rated above 3 by similar borrowers, weighted by how many
+            ratings each shares with this borrower, skipping books already borrowed
+
+        :param username:
+        :param k: the number of books to return
+        :raise: 'non_negative_field_k', 'borrower_not_exists'
+        :return: at most k books, best first
+        '''
+        Library.recommend(self, username, k)
+        with self.lock:
+            if username not in self.borrowers:
+                raise Exception('borrower_not_exists')
+            borrowed = self.borrowed_books[username]
+            scores = Counter()
+            for other, weight in self.similar[username].items():
+                for isbn in self.borrowed_books[other]:
+                    rating = self.book_borrowers[isbn][other]
+                    if rating is not None and rating > 3 and isbn not in borrowed:
+                        scores[isbn] += weight
+            best = heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+            return self._books(isbn for isbn, score in best)
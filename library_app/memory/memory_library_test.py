@@ -0,0 +1,58 @@
+import unittest
+from copy import copy
+
+from library_app.library_test import LibraryTest, RatingLibraryTest, book_toadd, book_toadd2, book_toadd3, \
+    borrower_toadd1
+from library_app.model import Book
+from library_app.memory.memory_library import InMemoryLibrary, SortedEntries
+
+
+class InMemoryLibraryTest(LibraryTest, RatingLibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        self.client = InMemoryLibrary()
+
+    def test_sort_by_author(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+
+        self.assertListEqual(self.client.sort_by_author(), [book_toadd2, book_toadd3, book_toadd])
+
+    def test_indexes_follow_edit(self):
+        self.client.add_book(book_toadd2)
+        self.client.edit_book('1', Book(title='a_book', author=['Qi'], page_num=400))
+        edited = copy(book_toadd)
+        edited.title = 'a_book'
+        edited.author = ['Qi']
+        edited.page_num = 400
+
+        self.assertListEqual(self.client.search_by_title(book_toadd.title), [])
+        self.assertListEqual(self.client.search_by_author('Sriram'), [])
+        self.assertListEqual(self.client.search_by_author('Qi'), [edited])
+        self.assertListEqual(self.client.sort_by_title(), [edited, book_toadd2])
+        self.assertListEqual(self.client.sort_by_page_num(), [book_toadd2, edited])
+
+    def test_returned_records_are_copies(self):
+        book = self.client.get_book('1')
+        book.author.append('Qi')
+        borrower = self.client.get_borrower('zhangq1')
+        borrower.name = 'Qi'
+
+        self.assertEqual(self.client.get_book('1'), book_toadd)
+        self.assertListEqual(self.client.search_by_name('Fred'), [borrower_toadd1])
+
+
+class SortedEntriesTest(unittest.TestCase):
+
+    def test_buffered_writes_merge_in_order(self):
+        entries = SortedEntries()
+        for id in ['c', 'a', 'b']:
+            entries.add(1, id)
+        self.assertListEqual([id for key, id in entries.entries()], ['a', 'b', 'c'])
+        entries.remove(1, 'b')
+        entries.add(0, 'b')
+        entries.add(None, 'd')
+        entries.remove(None, 'd')
+        entries.remove(1, 'c')
+        entries.add(1, 'c')
+        self.assertListEqual([id for key, id in entries.entries()], ['b', 'a', 'c'])
@@ -1,4 +1,7 @@
 class Book:
+    # no per-instance __dict__: backends build one Book per row of every sort and search
+    __slots__ = ('title', 'author', 'isbn', 'page_num', 'quantity')
+
     def __init__(self, title=None, author=[], isbn=None, page_num=None, quantity=None):
         if page_num is not None and type(page_num) != int:
             page_num = int(page_num)
@@ -16,19 +19,22 @@ class Book:
         return ('isbn: {} title: {} author: {} page_num: {} quantity: {}'.
                 format(self.isbn, self.title, self.author, self.page_num, self.quantity))
 
+    def _key(self):
+        return self.isbn, self.title, self.author, self.page_num, self.quantity
+
     def __eq__(self, other):
-        return (
-                self.isbn == other.isbn and
-                self.title == other.title and
-                self.author == other.author and
-                self.page_num == other.page_num and
-                self.quantity == other.quantity)
+        if not isinstance(other, Book):
+            return NotImplemented
+        return self._key() == other._key()
 
     def __hash__(self):
-        return hash(str(self))
+        author = tuple(self.author) if type(self.author) is list else self.author
+        return hash((self.isbn, self.title, author, self.page_num, self.quantity))
 
 
 class Borrower:
+    __slots__ = ('username', 'name', 'phone')
+
     def __init__(self, username=None, name=None, phone=None):
         self.username = username
         self.name = name
@@ -37,14 +43,92 @@ class Borrower:
     def __repr__(self):
         return 'username: {} name: {} phone: {}'.format(self.username, self.name, self.phone)
 
+    def _key(self):
+        return self.username, self.name, self.phone
+
     def __eq__(self, other):
-        return (
-                self.username == other.username and
-                self.name == other.name and
-                self.phone == other.phone)
+        if not isinstance(other, Borrower):
+            return NotImplemented
+        return self._key() == other._key()
 
     def __hash__(self):
-        return hash(str(self))
+        return hash(self._key())
+
+
+SORT_FIELDS = ('title', 'author', 'isbn', 'page_num')
+SEARCH_FIELDS = ('title', 'author')
+
+# books read per round trip by iter_sorted and iter_search
+PAGE_SIZE = 1000
+
+
+def each(action, calls):
+    '''
+        Call action with each argument tuple of calls, carrying on past failures
+
+    :return: the error raised by each call, None where it succeeded
+    '''
+    errors = []
+    for args in calls:
+        try:
+            action(*args)
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+
+def check_field(field, fields):
+    if field not in fields:
+        raise Exception('invalid_field_' + str(field))
+
+
+def sort_key(value):
+    '''
+        Order values of one sort field as iter_sorted does: a missing value or empty author list
+        first, then the values ascending, an author list ordering like its names in turn
+
+    '''
+    if type(value) in (list, tuple):
+        value = tuple(value) or None
+    return value is not None, value
+
+
+def after_book(library, after):
+    '''
+        Look up the book a paginated sort resumes after
+
+    :param after: an isbn, or None to start from the first book
+    :raise: 'book_not_exists'
+    '''
+    if after is None:
+        return None
+    book = library.get_book(after)
+    if book is None:
+        raise Exception('book_not_exists')
+    return book
+
+
+def listed_after(books, after):
+    '''
+
+    :return: the books listed after the book whose isbn is after, or all of them when after is None
+    :raise: 'book_not_exists'
+    '''
+    if after is None:
+        return books
+    isbns = [book.isbn for book in books]
+    if after not in isbns:
+        raise Exception('book_not_exists')
+    return books[isbns.index(after) + 1:]
+
+
+def isbns_after(books, after):
+    '''
+
+    :return: the books with an isbn above after, ordered by isbn
+    '''
+    return sorted((book for book in books if after is None or book.isbn > after), key=lambda book: book.isbn)
 
 
 class Library:
@@ -72,6 +156,15 @@ class Library:
         elif type(book.quantity) is not int or book.quantity <= 0:
             raise Exception('posivitive_field_book.quantity')
 
+    def add_books(self, books):
+        '''
+            Add many books. Backends with a batched write override this loop over add_book.
+
+        :param books:
+        :return: the error raised for each book by add_book, None where it was added
+        '''
+        return each(self.add_book, ((book,) for book in books))
+
     def get_book(self, isbn):
         '''
 
@@ -80,6 +173,14 @@ class Library:
         '''
         pass
 
+    def get_books(self, isbns):
+        '''
+
+        :param isbns:
+        :return: the book of each isbn, None where it does not exist
+        '''
+        return [self.get_book(isbn) for isbn in isbns]
+
     def delete_book(self, isbn):
         '''
 
@@ -97,6 +198,14 @@ class Library:
         '''
         raise NotImplementedError()
 
+    def edit_books(self, edits, override=False):
+        '''
+
+        :param edits: (isbn, book) pairs, applied as edit_book would
+        :return: the error raised for each edit by edit_book, None where it was applied
+        '''
+        return each(lambda isbn, book: self.edit_book(isbn, book, override=override), edits)
+
     def search_by_title(self, title):
         '''
 
@@ -141,6 +250,37 @@ class Library:
         '''
         raise NotImplementedError()
 
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, page_size books per round trip. Books without a value
+            for field, or with no authors, come first; ties are ordered by isbn.
+            This fallback slices the list sort_by_<field> returns; backends with a sorted index
+            override it with keyset pagination on (field, isbn), which holds one page in memory.
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        check_field(field, SORT_FIELDS)
+        return iter(listed_after(getattr(self, 'sort_by_' + field)(), after))
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books search_by_<field> finds for value, ordered by isbn, page_size books per round trip.
+            This fallback sorts the list the search returns.
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        return iter(isbns_after(getattr(self, 'search_by_' + field)(value), after))
+
     def add_borrower(self, borrower):
         '''
 
@@ -192,6 +332,14 @@ class Library:
         '''
         raise NotImplementedError()
 
+    def checkout_many(self, checkouts):
+        '''
+
+        :param checkouts: (username, isbn) pairs
+        :return: the error raised for each checkout by checkout_book, None where it succeeded
+        '''
+        return each(self.checkout_book, checkouts)
+
     def return_book(self, username, isbn):
         '''
 
@@ -201,6 +349,14 @@ class Library:
         '''
         raise NotImplementedError()
 
+    def return_many(self, returns):
+        '''
+
+        :param returns: (username, isbn) pairs
+        :return: the error raised for each return by return_book, None where it succeeded
+        '''
+        return each(self.return_book, returns)
+
     def get_book_borrowers(self, isbn):
         '''
 
@@ -245,11 +401,14 @@ class Library:
         '''
         return 0
 
-    def recommend(self, username):
+    def recommend(self, username, k=10):
         '''
 
         :param username:
-        :raise: 'borrower_not_exists'
-        :return:
+        :param k: the number of books to return
+        :raise: 'non_negative_field_k', 'borrower_not_exists'
+        :return: at most k recommended books, best first
         '''
+        if type(k) is not int or k < 0:
+            raise Exception('non_negative_field_k')
         return []
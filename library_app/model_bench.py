@@ -0,0 +1,87 @@
+import gc
+import json
+import timeit
+import tracemalloc
+
+from library_app.model import Book
+
+
+class UnslottedBook:
+    '''
+        A record keeping its fields in a per-instance __dict__, the layout of Book before __slots__
+
+    '''
+
+    def __init__(self, title=None, author=[], isbn=None, page_num=None, quantity=None):
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.page_num = page_num
+        self.quantity = quantity
+
+
+def book_args(i):
+    return dict(title='title' + str(i), author=['author' + str(i % 1000)], isbn=str(i),
+                page_num=i % 1000 + 1, quantity=3)
+
+
+def memory_per_book(record_type, count):
+    '''
+
+    :return: bytes allocated per record when building count records of record_type
+    '''
+    args = [book_args(i) for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    books = [record_type(**kwargs) for kwargs in args]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del books
+    return used / count
+
+
+def decoders():
+    '''
+        The row decoder of each backend with a sample row, skipping backends whose driver is not installed
+
+    '''
+    from library_app.memcached.memcached_library import str_to_book
+    from library_app.redis.redis_library import BookProxy
+    yield 'memcached.str_to_book', str_to_book, json.dumps(book_args(1))
+    yield 'redis.hash_to_Book', lambda row: BookProxy.hash_to_Book('book:1', row), \
+        {b'title': b'title1', b'author': b'author1;author2', b'page_num': b'2', b'quantity': b'3'}
+    try:
+        from library_app.mongo.mongo_library import dict_to_book
+        row = book_args(1)
+        row['_id'] = row.pop('isbn')
+        yield 'mongo.dict_to_book', dict_to_book, row
+    except ImportError:
+        print('mongo.dict_to_book skipped, pymongo is not installed')
+    try:
+        from library_app.neo4j.neo4j_library import dict_to_book
+        yield 'neo4j.dict_to_book', dict_to_book, book_args(1)
+    except ImportError:
+        print('neo4j.dict_to_book skipped, neo4j is not installed')
+
+
+def main(count=1000000, number=100000):
+    print('{:>24} {:>14} {:>14}'.format('record', 'bytes_per_book', 'mb_per_1m'))
+    for record_type in (UnslottedBook, Book):
+        per_book = memory_per_book(record_type, count)
+        print('{:>24} {:>14.1f} {:>14.1f}'.format(record_type.__name__, per_book, per_book * 1000000 / 2 ** 20))
+
+    book = Book(**book_args(1))
+    other = Book(**book_args(1))
+    print('{:>24} {:>14}'.format('operation', 'ns_per_call'))
+    # the old __hash__ formatted the repr on every call
+    for name, call in [('hash(str(book))', lambda: hash(str(book))),
+                       ('hash(Book)', lambda: hash(book)),
+                       ('Book == Book', lambda: book == other)]:
+        print('{:>24} {:>14.0f}'.format(name, timeit.timeit(call, number=number) / number * 1e9))
+    for name, decode, row in decoders():
+        print('{:>24} {:>14.0f}'.format(name, timeit.timeit(lambda: decode(row), number=number) / number * 1e9))
+
+
+if __name__ == '__main__':
+    main()
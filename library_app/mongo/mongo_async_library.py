@@ -0,0 +1,112 @@
+import pymongo
+from bson.dbref import DBRef
+
+from library_app import connections
+from library_app.async_library import AsyncLibrary, ExecutorLibrary
+from library_app.mongo import mongo_library
+from library_app.mongo.mongo_library import CURSOR_BATCH_SIZE, MongoLibrary, checkout_join, dict_to_book, \
+    dict_to_borrower
+
+
+class AsyncMongoLibrary(ExecutorLibrary):
+    '''
+        An AsyncLibrary on motor. Reads, searches, checkouts and returns are native, and the checkout
+        and return batches run concurrently; the catalog and borrower writes run MongoLibrary on the executor.
+
+    '''
+
+    def __init__(self, db=None, executor=None, batch_size=CURSOR_BATCH_SIZE):
+        '''
+
+        :param db: a motor database, the configured shared one when None
+        '''
+        super().__init__(MongoLibrary(batch_size), executor)
+        self.db = db if db is not None else connections.get_mongo_async_db()
+        self.batch_size = batch_size
+
+    async def _collection(self, name):
+        if not mongo_library.indexes_ensured:
+            await self.run(mongo_library.ensure_indexes)
+        return self.db[name]
+
+    async def _exists(self, collection, id):
+        return await (await self._collection(collection)).find_one(id, {'_id': 1}) is not None
+
+    async def _find(self, collection, query):
+        return [dict async for dict in (await self._collection(collection)).find(query, batch_size=self.batch_size)]
+
+    async def get_book(self, isbn):
+        return dict_to_book(await (await self._collection('book')).find_one(isbn))
+
+    async def get_books(self, isbns):
+        found = {dict['_id']: dict for dict in await self._find('book', {'_id': {'$in': list(isbns)}})}
+        return [dict_to_book(found.get(isbn)) for isbn in isbns]
+
+    async def search_by_title(self, title):
+        return [dict_to_book(dict) for dict in await self._find('book', {'title': title})]
+
+    async def search_by_author(self, author):
+        return [dict_to_book(dict) for dict in await self._find('book', {'author': author})]
+
+    async def get_borrower(self, username):
+        return dict_to_borrower(await (await self._collection('borrower')).find_one(username))
+
+    async def search_by_name(self, name):
+        return [dict_to_borrower(dict) for dict in await self._find('borrower', {'name': name})]
+
+    async def checkout_book(self, username, isbn):
+        if not await self._exists('borrower', username):
+            if not await self._exists('book', isbn):
+                raise Exception('book_not_exists')
+            raise Exception('borrower_not_exists')
+        books = await self._collection('book')
+        checkouts = await self._collection('checkout')
+        checkout = {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)}
+        # reserve a copy only while checked_out < quantity, so concurrent checkouts cannot oversubscribe
+        if not await books.find_one_and_update({'_id': isbn, '$expr': {'$lt': ['$checked_out', '$quantity']}},
+                                               {'$inc': {'checked_out': 1}}, {'_id': 1}):
+            if not await self._exists('book', isbn):
+                raise Exception('book_not_exists')
+            if await checkouts.find_one(checkout, {'_id': 1}):
+                raise Exception('book_already_borrowed')
+            raise Exception('book_not_available')
+        try:
+            await checkouts.insert_one(checkout)
+        except pymongo.errors.DuplicateKeyError as e:
+            await books.update_one({'_id': isbn}, {'$inc': {'checked_out': -1}})
+            raise Exception('book_already_borrowed')
+
+    async def checkout_many(self, checkouts):
+        return await AsyncLibrary.checkout_many(self, checkouts)
+
+    async def return_book(self, username, isbn):
+        result = await (await self._collection('checkout')).delete_one(
+            {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)})
+        if result.deleted_count == 0:
+            if not await self._exists('book', isbn):
+                raise Exception('book_not_exists')
+            if not await self._exists('borrower', username):
+                raise Exception('borrower_not_exists')
+            raise Exception('book_not_borrowed')
+        await (await self._collection('book')).update_one({'_id': isbn}, {'$inc': {'checked_out': -1}})
+
+    async def return_many(self, returns):
+        return await AsyncLibrary.return_many(self, returns)
+
+    async def _joined(self, match, collection):
+        checkouts = await self._collection('checkout')
+        return [dict async for dict in checkouts.aggregate(checkout_join(match, collection),
+                                                           batchSize=self.batch_size)]
+
+    async def get_book_borrowers(self, isbn):
+        borrowers = [dict_to_borrower(dict) for dict in await self._joined({'book': DBRef('book', isbn)}, 'borrower')]
+        # only an empty result needs the existence check
+        if not borrowers and not await self._exists('book', isbn):
+            raise Exception('book_not_exists')
+        return borrowers
+
+    async def get_borrowed_books(self, username):
+        books = [dict_to_book(dict) for dict in await self._joined({'borrower': DBRef('borrower', username)}, 'book')]
+        if not books and not await self._exists('borrower', username):
+            raise Exception('borrower_not_exists')
+        return books
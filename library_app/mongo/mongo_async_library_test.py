@@ -0,0 +1,35 @@
+import unittest
+
+from library_app import connections
+from library_app.async_library_test import BlockingLibrary
+from library_app.library_test import LibraryTest, book_toadd, book_toadd2, borrower_toadd1
+from library_app.model import Borrower
+from library_app.mongo.mongo_async_library import AsyncMongoLibrary
+
+
+class AsyncMongoLibraryTest(LibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        # a motor client is bound to the loop it first runs on, so each test gets its own
+        self.client = BlockingLibrary(AsyncMongoLibrary(db=connections.connect_mongo_async(connections.settings)))
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_checkout_many_concurrently(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_borrower(Borrower(username='zhangq5', name='Eve', phone='115'))
+        errors = self.client.checkout_many([('zhangq1', '2'), ('zhangq5', '2'), ('zhangq1', '1'), ('zhangq1', '4')])
+
+        self.assertEqual([None, None, None, 'book_not_exists'], [str(e) if e else None for e in errors])
+        self.assertEqual(self.client.get_book_borrowers('1'), [borrower_toadd1])
+        self.assertEqual(self.client.return_many([('zhangq1', '2'), ('zhangq1', '2')]).count(None), 1)
+
+    def test_get_books(self):
+        self.client.add_book(book_toadd2)
+
+        self.assertListEqual(self.client.get_books(['2', 'missing', '1']), [book_toadd2, None, book_toadd])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,14 +3,143 @@ from copy import copy
 import pymongo
 from bson.dbref import DBRef
 
-from library_app.model import Book, Borrower, Library
+from library_app import connections
+from library_app.model import PAGE_SIZE, SEARCH_FIELDS, SORT_FIELDS, Book, Borrower, Library, after_book, check_field
 
-client = pymongo.MongoClient()
-db = client['library_db']
+
+# documents fetched per cursor round trip when streaming joined results
+CURSOR_BATCH_SIZE = 100
+
+# the document field each sort orders by
+SORT_KEYS = {'title': 'title', 'author': 'author', 'isbn': '_id', 'page_num': 'page_num'}
+
+indexes_ensured = False
+
+
+def ensure_indexes():
+    '''
+        Create the indexes behind the searches, sorts and checkout lookups.
+        create_index is idempotent, so this is safe to run repeatedly.
+
+    '''
+    global indexes_ensured
+    db = connections.get_mongo_db()
+    # the _id suffix serves the keyset pages of iter_sorted and iter_search in index order
+    db['book'].create_index([('title', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+    db['book'].create_index([('author', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])  # multikey, author is a list
+    db['book'].create_index([('page_num', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)])
+    db['borrower'].create_index('name')
+    # the (book, borrower) prefix also serves lookups by book alone
+    db['checkout'].create_index([('book', pymongo.ASCENDING), ('borrower', pymongo.ASCENDING)], unique=True)
+    db['checkout'].create_index('borrower')
+    backfill_checked_out(db)
+    indexes_ensured = True
+
+
+def backfill_checked_out(db):
+    '''
+        Give the books written before the checked_out counter existed their count of checkouts.
+        Runs once per database, recorded in the meta collection; the delete, edit and checkout
+        guards compare against the counter and would treat those books as borrowed or unavailable.
+
+    '''
+    if db['meta'].find_one('checked_out_backfilled'):
+        return
+    counts = {x['_id'].id: x['count'] for x in
+              db['checkout'].aggregate([{'$group': {'_id': '$book', 'count': {'$sum': 1}}}])}
+    missing = {'checked_out': {'$exists': False}}
+    for isbn, count in counts.items():
+        db['book'].update_one(dict(missing, _id=isbn), {'$set': {'checked_out': count}})
+    db['book'].update_many(missing, {'$set': {'checked_out': 0}})
+    db['meta'].update_one({'_id': 'checked_out_backfilled'}, {'$set': {'done': True}}, upsert=True)
 
 
 def get_mongo_collection(collection):
-    return db[collection]
+    if not indexes_ensured:
+        ensure_indexes()
+    return connections.get_mongo_db()[collection]
+
+
+def exists(collection, id):
+    return get_mongo_collection(collection).find_one(id, {'_id': 1}) is not None
+
+
+def existing(collection, ids):
+    '''
+
+    :return: the subset of ids found in collection, with one query
+    '''
+    return set(dict['_id'] for dict in get_mongo_collection(collection).find({'_id': {'$in': list(ids)}}, {'_id': 1}))
+
+
+def bulk_errors(error, duplicate_error):
+    '''
+        Map the write errors of an unordered bulk write to the index of the operation that failed
+
+    '''
+    errors = {}
+    for write_error in error.details['writeErrors']:
+        if write_error['code'] != 11000:
+            raise error
+        errors[write_error['index']] = Exception(duplicate_error)
+    return errors
+
+
+def increments(isbns, delta):
+    '''
+
+    :return: one UpdateOne adding delta to checked_out per occurrence of each isbn
+    '''
+    counts = {}
+    for isbn in isbns:
+        counts[isbn] = counts.get(isbn, 0) + delta
+    return [pymongo.UpdateOne({'_id': isbn}, {'$inc': {'checked_out': count}}) for isbn, count in counts.items()]
+
+
+def checkout_join(match, collection):
+    '''
+
+    :return: the aggregation pipeline joining the checkouts matching match to the documents of collection they reference
+    '''
+    return [
+        {'$match': match},
+        # a DBRef is {$ref, $id}; $id cannot be addressed by a field path, so unpack it
+        {'$project': {'ref': {'$arrayElemAt': [{'$objectToArray': '$' + collection}, 1]}}},
+        {'$lookup': {'from': collection, 'localField': 'ref.v', 'foreignField': '_id', 'as': 'doc'}},
+        {'$unwind': '$doc'},
+        {'$replaceRoot': {'newRoot': '$doc'}},
+    ]
+
+
+def join_checkouts(match, collection, batch_size):
+    '''
+        Stream the documents of collection referenced by the checkouts matching match,
+        joined server-side with $lookup in a single aggregation.
+
+    '''
+    return get_mongo_collection('checkout').aggregate(checkout_join(match, collection), batchSize=batch_size)
+
+
+def edit_query(isbn, book, override):
+    '''
+
+    :return: the filter and update of an edit_book, the filter only matching when the new quantity covers the checkouts
+    '''
+    book = copy(book)
+    book.isbn = None
+    book_dict = book_to_dict(book)
+    update = {}
+    if book_dict:
+        update['$set'] = book_dict
+    if override:
+        # quantity is kept when not given, like the checked_out counter
+        unset = {field: '' for field in ('title', 'author', 'page_num') if field not in book_dict}
+        if unset:
+            update['$unset'] = unset
+    query = {'_id': isbn}
+    if book.quantity:
+        query['checked_out'] = {'$lte': book.quantity}
+    return query, update
 
 
 def book_to_dict(book):
@@ -57,47 +186,125 @@ def dict_to_borrower(dict):
 
 
 class MongoLibrary(Library):
+    def __init__(self, batch_size=CURSOR_BATCH_SIZE):
+        self.batch_size = batch_size
+
     def drop_db(self):
+        global indexes_ensured
+        db = connections.get_mongo_db()
         db.drop_collection('book')
         db.drop_collection('borrower')
         db.drop_collection('checkout')
+        db.drop_collection('meta')
+        indexes_ensured = False
+
+    def ensure_indexes(self):
+        ensure_indexes()
+
+    def index_stats(self):
+        '''
+
+        :return: the usage reported by $indexStats for each index, keyed by collection
+        '''
+        return {collection: [(stats['name'], stats['accesses']['ops'], stats['accesses']['since'])
+                             for stats in get_mongo_collection(collection).aggregate([{'$indexStats': {}}])]
+                for collection in ('book', 'borrower', 'checkout')}
 
     def add_book(self, book):
         Library.add_book(self, book)
+        book_dict = book_to_dict(book)
+        # number of copies currently checked out, maintained by checkout_book/return_book
+        book_dict['checked_out'] = 0
         try:
-            get_mongo_collection('book').insert_one(book_to_dict(book))
+            get_mongo_collection('book').insert_one(book_dict)
         except pymongo.errors.DuplicateKeyError as e:
             raise Exception('book_exist_already')
 
+    def add_books(self, books):
+        '''
+            Add books with one unordered insert_many
+
+        :param books:
+        :return: the error raised for each book by add_book, None where it was added
+        '''
+        books = list(books)
+        errors = [None] * len(books)
+        indexes = []
+        documents = []
+        for index, book in enumerate(books):
+            try:
+                Library.add_book(self, book)
+                documents.append(dict(book_to_dict(book), checked_out=0))
+                indexes.append(index)
+            except Exception as e:
+                errors[index] = e
+        if documents:
+            try:
+                get_mongo_collection('book').insert_many(documents, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                for position, error in bulk_errors(e, 'book_exist_already').items():
+                    errors[indexes[position]] = error
+        return errors
+
     def get_book(self, isbn):
         return dict_to_book(get_mongo_collection('book').find_one(isbn))
 
+    def get_books(self, isbns):
+        '''
+
+        :param isbns:
+        :return: the book of each isbn, None where it does not exist, fetched with one $in query
+        '''
+        found = {dict['_id']: dict for dict in get_mongo_collection('book').find({'_id': {'$in': list(isbns)}},
+                                                                               batch_size=self.batch_size)}
+        return [dict_to_book(found.get(isbn)) for isbn in isbns]
+
     def delete_book(self, isbn):
-        checkout = get_mongo_collection('checkout').find_one({'book': DBRef('book', isbn)})
-        if checkout:
-            raise Exception('book_borrowed')
-        result = get_mongo_collection('book').delete_one({'_id': isbn})
+        result = get_mongo_collection('book').delete_one({'_id': isbn, 'checked_out': 0})
         if result.deleted_count == 0:
+            if exists('book', isbn):
+                raise Exception('book_borrowed')
             raise Exception('book_not_exists')
 
     def edit_book(self, isbn, book, override=False):
-        if not get_mongo_collection('book').find_one(isbn):
-            raise Exception('book_not_exists')
-        if book.quantity:
-            cursor = get_mongo_collection('checkout').find({'book': DBRef('book', isbn)})
-            if cursor.count() > book.quantity:
+        query, update = edit_query(isbn, book, override)
+        if len(update) == 0:
+            if not exists('book', isbn):
+                raise Exception('book_not_exists')
+            return
+        if not get_mongo_collection('book').find_one_and_update(query, update, {'_id': 1}):
+            if exists('book', isbn):
                 raise Exception('book_borrowed')
-        book = copy(book)
-        book.isbn = None
-        book_dict = book_to_dict(book)
-        if override:
-            if 'quantity' not in book_dict:
-                book_dict['quantity'] = get_mongo_collection('book').find_one({'_id': isbn})['quantity']
-            get_mongo_collection('book').find_one_and_replace({'_id': isbn}, book_dict)
-        else:
-            if len(book_dict) == 0:
-                return
-            get_mongo_collection('book').find_one_and_update({'_id': isbn}, {'$set': book_dict})
+            raise Exception('book_not_exists')
+
+    def edit_books(self, edits, override=False):
+        '''
+            Apply edits with one unordered bulk_write
+
+        :param edits: (isbn, book) pairs, applied as edit_book would
+        :return: the error raised for each edit by edit_book, None where it was applied
+        '''
+        edits = list(edits)
+        errors = [None] * len(edits)
+        queries = [edit_query(isbn, book, override) for isbn, book in edits]
+        updates = [index for index, (query, update) in enumerate(queries) if update]
+        checks = [index for index, (query, update) in enumerate(queries) if not update]
+        if updates:
+            result = get_mongo_collection('book').bulk_write(
+                [pymongo.UpdateOne(*queries[index]) for index in updates], ordered=False)
+            # the result only counts matches, so once an edit missed every edit is checked
+            if result.matched_count < len(updates):
+                checks = list(range(len(edits)))
+        if checks:
+            found = {dict['_id']: dict for dict in get_mongo_collection('book').find(
+                {'_id': {'$in': [edits[index][0] for index in checks]}}, {'checked_out': 1})}
+            for index in checks:
+                isbn, book = edits[index]
+                if isbn not in found:
+                    errors[index] = Exception('book_not_exists')
+                elif queries[index][1] and book.quantity and found[isbn]['checked_out'] > book.quantity:
+                    errors[index] = Exception('book_borrowed')
+        return errors
 
     def search_by_title(self, title):
         return [dict_to_book(dict) for dict in get_mongo_collection('book').find({'title': title})]
@@ -117,6 +324,80 @@ class MongoLibrary(Library):
     def sort_by_page_num(self):
         return [dict_to_book(dict) for dict in get_mongo_collection('book').find().sort('page_num')]
 
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, ties ordered by isbn, one range query per page
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        check_field(field, SORT_FIELDS)
+        book = after_book(self, after)
+        if field == 'author':
+            # an author list sorts by its smallest name, which no range query can resume from,
+            # so the books come from one cursor read page_size at a time instead
+            return self._streamed(SORT_KEYS[field], page_size, book)
+        return self._sorted_pages(SORT_KEYS[field], page_size, book)
+
+    def _sorted_pages(self, key, page_size, book):
+        while True:
+            query = {}
+            if book is not None:
+                value = book_to_dict(book).get(key)
+                if key == '_id':
+                    query = {'_id': {'$gt': value}}
+                elif value is None:
+                    # missing values sort first, so every present value follows a missing cursor
+                    query = {'$or': [{key: None, '_id': {'$gt': book.isbn}}, {key: {'$ne': None}}]}
+                else:
+                    query = {'$or': [{key: {'$gt': value}}, {key: value, '_id': {'$gt': book.isbn}}]}
+            books = [dict_to_book(dict) for dict in get_mongo_collection('book').find(query)
+                     .sort([(key, pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]).limit(page_size)]
+            for book in books:
+                yield book
+            if len(books) < page_size:
+                return
+            book = books[-1]
+
+    def _streamed(self, key, page_size, book):
+        skipping = book is not None
+        cursor = get_mongo_collection('book').find(batch_size=page_size)
+        for dict in cursor.sort([(key, pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]):
+            if skipping:
+                skipping = dict['_id'] != book.isbn
+                continue
+            yield dict_to_book(dict)
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books found by title or author, ordered by isbn, one range query per page
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        return self._search_pages(field, value, page_size, after)
+
+    def _search_pages(self, field, value, page_size, after):
+        while True:
+            query = {field: value}
+            if after is not None:
+                query['_id'] = {'$gt': after}
+            books = [dict_to_book(dict) for dict in
+                     get_mongo_collection('book').find(query).sort('_id').limit(page_size)]
+            for book in books:
+                yield book
+            if len(books) < page_size:
+                return
+            after = books[-1].isbn
+
     def add_borrower(self, borrower):
         Library.add_borrower(self, borrower)
         try:
@@ -148,41 +429,140 @@ class MongoLibrary(Library):
         return [dict_to_borrower(dict) for dict in get_mongo_collection('borrower').find({'name': name})]
 
     def checkout_book(self, username, isbn):
-        book = get_mongo_collection('book').find_one(isbn)
-        if not book:
-            raise Exception('book_not_exists')
-        if not get_mongo_collection('borrower').find_one(username):
+        if not exists('borrower', username):
+            if not exists('book', isbn):
+                raise Exception('book_not_exists')
             raise Exception('borrower_not_exists')
-        if get_mongo_collection('checkout').find_one(
-                {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)}):
-            raise Exception('book_already_borrowed')
-        cursor = get_mongo_collection('checkout').find({'book': DBRef('book', isbn)})
-        if cursor.count() == book['quantity']:
+        checkout = {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)}
+        # reserve a copy only while checked_out < quantity, so concurrent checkouts cannot oversubscribe
+        if not get_mongo_collection('book').find_one_and_update(
+                {'_id': isbn, '$expr': {'$lt': ['$checked_out', '$quantity']}},
+                {'$inc': {'checked_out': 1}}, {'_id': 1}):
+            if not exists('book', isbn):
+                raise Exception('book_not_exists')
+            if get_mongo_collection('checkout').find_one(checkout, {'_id': 1}):
+                raise Exception('book_already_borrowed')
             raise Exception('book_not_available')
-        get_mongo_collection('checkout').insert_one(
-            {'borrower': DBRef('borrower', username), 'book': DBRef('book', isbn)})
+        try:
+            get_mongo_collection('checkout').insert_one(checkout)
+        except pymongo.errors.DuplicateKeyError as e:
+            get_mongo_collection('book').update_one({'_id': isbn}, {'$inc': {'checked_out': -1}})
+            raise Exception('book_already_borrowed')
+
+    def checkout_many(self, checkouts):
+        '''
+            Check out with one existence query per collection, one guarded reservation per checkout
+            and one insert_many of the checkout documents
+
+        :param checkouts: (username, isbn) pairs
+        :return: the error raised for each checkout by checkout_book, None where it succeeded
+        '''
+        checkouts = list(checkouts)
+        errors = [None] * len(checkouts)
+        books = existing('book', set(isbn for username, isbn in checkouts))
+        borrowers = existing('borrower', set(username for username, isbn in checkouts))
+        reserved = []
+        for index, (username, isbn) in enumerate(checkouts):
+            if isbn not in books:
+                errors[index] = Exception('book_not_exists')
+            elif username not in borrowers:
+                errors[index] = Exception('borrower_not_exists')
+            elif get_mongo_collection('book').find_one_and_update(
+                    {'_id': isbn, '$expr': {'$lt': ['$checked_out', '$quantity']}},
+                    {'$inc': {'checked_out': 1}}, {'_id': 1}):
+                reserved.append(index)
+            elif get_mongo_collection('checkout').find_one(
+                    {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)}, {'_id': 1}):
+                errors[index] = Exception('book_already_borrowed')
+            else:
+                errors[index] = Exception('book_not_available')
+        if reserved:
+            try:
+                get_mongo_collection('checkout').insert_many(
+                    [{'book': DBRef('book', checkouts[index][1]), 'borrower': DBRef('borrower', checkouts[index][0])}
+                     for index in reserved], ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                failed = bulk_errors(e, 'book_already_borrowed')
+                for position, error in failed.items():
+                    errors[reserved[position]] = error
+                get_mongo_collection('book').bulk_write(
+                    increments([checkouts[reserved[position]][1] for position in failed], -1), ordered=False)
+        return errors
 
     def return_book(self, username, isbn):
-        if not get_mongo_collection('book').find_one(isbn):
-            raise Exception('book_not_exists')
-        if not get_mongo_collection('borrower').find_one(username):
-            raise Exception('borrower_not_exists')
-        if not get_mongo_collection('checkout').find_one(
-                {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)}):
+        result = get_mongo_collection('checkout').delete_one(
+            {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)})
+        if result.deleted_count == 0:
+            if not exists('book', isbn):
+                raise Exception('book_not_exists')
+            if not exists('borrower', username):
+                raise Exception('borrower_not_exists')
             raise Exception('book_not_borrowed')
-        get_mongo_collection('checkout').delete_one(
-            {'borrower': DBRef('borrower', username), 'book': DBRef('book', isbn)})
+        get_mongo_collection('book').update_one({'_id': isbn}, {'$inc': {'checked_out': -1}})
+
+    def return_many(self, returns):
+        '''
+            Delete each checkout, then release all the copies with one bulk_write
+
+        :param returns: (username, isbn) pairs
+        :return: the error raised for each return by return_book, None where it succeeded
+        '''
+        returns = list(returns)
+        errors = [None] * len(returns)
+        returned = []
+        missing = []
+        for index, (username, isbn) in enumerate(returns):
+            if get_mongo_collection('checkout').delete_one(
+                    {'book': DBRef('book', isbn), 'borrower': DBRef('borrower', username)}).deleted_count:
+                returned.append(isbn)
+            else:
+                missing.append(index)
+        if returned:
+            get_mongo_collection('book').bulk_write(increments(returned, -1), ordered=False)
+        if missing:
+            books = existing('book', set(returns[index][1] for index in missing))
+            borrowers = existing('borrower', set(returns[index][0] for index in missing))
+            for index in missing:
+                username, isbn = returns[index]
+                if isbn not in books:
+                    errors[index] = Exception('book_not_exists')
+                elif username not in borrowers:
+                    errors[index] = Exception('borrower_not_exists')
+                else:
+                    errors[index] = Exception('book_not_borrowed')
+        return errors
 
     def get_book_borrowers(self, isbn):
-        if not get_mongo_collection('book').find_one(isbn):
+        return list(self.iter_book_borrowers(isbn))
+
+    def iter_book_borrowers(self, isbn):
+        '''
+
+        :param isbn:
+        :return: a generator of the borrowers of this book, fetched batch_size at a time
+        :raise: 'book_not_exists'
+        '''
+        found = False
+        for dict in join_checkouts({'book': DBRef('book', isbn)}, 'borrower', self.batch_size):
+            found = True
+            yield dict_to_borrower(dict)
+        # only an empty result needs the existence check
+        if not found and not exists('book', isbn):
             raise Exception('book_not_exists')
-        ls = [checkout['borrower'].id for checkout in
-              get_mongo_collection('checkout').find({'book': DBRef('book', isbn)})]
-        return [dict_to_borrower(dict) for dict in get_mongo_collection('borrower').find({'_id': {'$in': ls}})]
 
     def get_borrowed_books(self, username):
-        if not get_mongo_collection('borrower').find_one(username):
+        return list(self.iter_borrowed_books(username))
+
+    def iter_borrowed_books(self, username):
+        '''
+
+        :param username:
+        :return: a generator of the books this borrower has checked out, fetched batch_size at a time
+        :raise: 'borrower_not_exists'
+        '''
+        found = False
+        for dict in join_checkouts({'borrower': DBRef('borrower', username)}, 'book', self.batch_size):
+            found = True
+            yield dict_to_book(dict)
+        if not found and not exists('borrower', username):
             raise Exception('borrower_not_exists')
-        ls = [checkout['book'].id for checkout in
-              get_mongo_collection('checkout').find({'borrower': DBRef('borrower', username)})]
-        return [dict_to_book(dict) for dict in get_mongo_collection('book').find({'_id': {'$in': ls}})]
@@ -1,6 +1,9 @@
 import unittest
 
-from library_app.library_test import LibraryTest
+from library_app import connections
+from library_app.library_test import LibraryTest, book_toadd
+from library_app.model import Book, Borrower
+from library_app.mongo import mongo_library
 from .mongo_library import MongoLibrary
 
 
@@ -8,3 +11,34 @@ class MongoLibraryTest(LibraryTest, unittest.TestCase):
 
     def setUpClient(self):
         self.client = MongoLibrary()
+
+    def test_index_stats(self):
+        self.client.search_by_title(book_toadd.title)
+        stats = self.client.index_stats()
+
+        self.assertIn('title_1__id_1', [name for name, ops, since in stats['book']])
+        self.assertIn('author_1__id_1', [name for name, ops, since in stats['book']])
+        self.assertIn('name_1', [name for name, ops, since in stats['borrower']])
+        self.assertIn('book_1_borrower_1', [name for name, ops, since in stats['checkout']])
+
+    def test_backfill_checked_out(self):
+        self.client.checkout_book('zhangq1', '1')
+        db = connections.get_mongo_db()
+        db['book'].update_many({}, {'$unset': {'checked_out': ''}})
+        db['meta'].drop()
+        mongo_library.ensure_indexes()
+
+        self.assertEqual(db['book'].find_one('1')['checked_out'], 1)
+        self.client.return_book('zhangq1', '1')
+        self.client.delete_book('1')
+        self.assertIsNone(self.client.get_book('1'))
+
+    def test_iter_book_borrowers_batched(self):
+        client = MongoLibrary(batch_size=2)
+        client.edit_book('1', Book(quantity=5))
+        borrowers = [Borrower(username='batch' + str(i), name='batch') for i in range(5)]
+        for borrower in borrowers:
+            client.add_borrower(borrower)
+            client.checkout_book(borrower.username, '1')
+
+        self.assertCountEqual(list(client.iter_book_borrowers('1')), borrowers)
@@ -1,9 +1,182 @@
-from neo4j.v1 import GraphDatabase
-
-from library_app.model import Book, Borrower, Library
-
-neo4jDriver = GraphDatabase.driver("bolt://localhost:7687", auth=("neo4j", "12345678"))
-sess = neo4jDriver.session()
+import uuid
+
+from neo4j.exceptions import ConstraintError
+
+from library_app import connections
+from library_app.model import PAGE_SIZE, SEARCH_FIELDS, SORT_FIELDS, Book, Borrower, Library, after_book, check_field
+
+# creating an existing constraint or index is a no-op, so the bootstrap is idempotent
+SCHEMA = [
+    'CREATE CONSTRAINT ON (b:book) ASSERT b.isbn IS UNIQUE',
+    'CREATE CONSTRAINT ON (b:borrower) ASSERT b.username IS UNIQUE',
+    'CREATE CONSTRAINT ON (a:author) ASSERT a.name IS UNIQUE',
+    'CREATE INDEX ON :book(title)',
+    'CREATE INDEX ON :book(author_key)',
+    'CREATE INDEX ON :book(page_num)',
+    'CREATE INDEX ON :borrower(name)',
+]
+
+schema_ensured = False
+
+# joins the author list into book.author_key; sorts below any character, so the key orders like the list
+AUTHOR_KEY_SEPARATOR = '\x00'
+
+# links book b to an (:author) node for each name in the given list expression, creating missing authors
+LINK_AUTHORS = "FOREACH (name IN {} | MERGE (a:author {{name: name}}) MERGE (a)-[:wrote]->(b)) "
+
+# the book property each sort orders by
+SORT_KEYS = {'title': 'title', 'author': 'author_key', 'isbn': 'isbn', 'page_num': 'page_num'}
+
+# the books after a cursor in (key, isbn) order: a range seek on the key index, then a filter of the ties already read
+SEEK_AFTER = "WHERE b.{0} >= {{value}} AND (b.{0} <> {{value}} OR b.isbn > {{isbn}}) "
+
+# rows sent per UNWIND statement by the bulk APIs, and nodes removed per transaction by drop_db
+BULK_BATCH_SIZE = 5000
+DROP_BATCH_SIZE = 10000
+
+# matches a checkout c and sets status to the error string of a missing book, borrower or checkout
+CHECKOUT_STATUS = ("OPTIONAL MATCH (b:book {isbn: {isbn}}) "
+                   "OPTIONAL MATCH (u:borrower {username: {username}}) "
+                   "OPTIONAL MATCH (u)-[c:checkout]->(b) "
+                   "WITH c, CASE "
+                   "WHEN b IS NULL THEN 'book_not_exists' "
+                   "WHEN u IS NULL THEN 'borrower_not_exists' "
+                   "WHEN c IS NULL THEN 'book_not_checked_out' "
+                   "ELSE 'ok' END AS status ")
+
+# adds row.delta to the weight of the :similar relationship between borrower row.username and every
+# other borrower that rated book row.isbn row.rating, for each row of {rows}; the relationship runs
+# from the smaller username and is dropped when its weight falls to 0
+UPDATE_SIMILAR = ("UNWIND {rows} AS row "
+                  "MATCH (u:borrower {username: row.username}), "
+                  "(b:book {isbn: row.isbn})<-[:checkout {rating: row.rating}]-(y:borrower) "
+                  "WHERE y <> u "
+                  "WITH row, CASE WHEN u.username < y.username THEN [u, y] ELSE [y, u] END AS pair "
+                  "WITH pair[0] AS x, pair[1] AS y, sum(row.delta) AS delta "
+                  "MERGE (x)-[s:similar]->(y) "
+                  "ON CREATE SET s.weight = 0 "
+                  "SET s.weight = s.weight + delta "
+                  "WITH s WHERE s.weight <= 0 "
+                  "DELETE s")
+
+# checks out book row.isbn to borrower row.username for each row of {rows}; taking the write lock
+# on b first serializes concurrent checkouts of the book. A statement must not hold two rows of the
+# same book, as their availability would be counted before either checkout is created
+CHECKOUT = ("UNWIND {rows} AS row "
+            "OPTIONAL MATCH (b:book {isbn: row.isbn}) "
+            "OPTIONAL MATCH (u:borrower {username: row.username}) "
+            "SET b._lock = true "
+            "WITH row, b, u "
+            "OPTIONAL MATCH (b)<-[o:checkout]-(:borrower) "
+            "WITH row, b, u, count(o) AS taken "
+            "OPTIONAL MATCH (u)-[c:checkout]->(b) "
+            "WITH row, b, u, c, CASE "
+            "WHEN b IS NULL THEN 'book_not_exists' "
+            "WHEN u IS NULL THEN 'borrower_not_exists' "
+            "WHEN c IS NOT NULL THEN 'book_already_borrowed' "
+            "WHEN taken >= b.quantity THEN 'book_not_available' "
+            "ELSE 'ok' END AS status "
+            "FOREACH (_ IN CASE WHEN status = 'ok' THEN [1] ELSE [] END | "
+            "CREATE (u)-[:checkout]->(b)) "
+            "REMOVE b._lock "
+            "RETURN row.index AS index, status")
+
+# returns book row.isbn from borrower row.username for each row of {rows}, with the same restriction
+RETURN = ("UNWIND {rows} AS row "
+          "OPTIONAL MATCH (u:borrower {username: row.username}) "
+          "OPTIONAL MATCH (b:book {isbn: row.isbn}) "
+          "OPTIONAL MATCH (u)-[c:checkout]->(b) "
+          "WITH row, c, c.rating AS rating, CASE "
+          "WHEN u IS NULL THEN 'borrower_not_exists' "
+          "WHEN b IS NULL THEN 'book_not_exists' "
+          "WHEN c IS NULL THEN 'book_not_borrowed' "
+          "ELSE 'ok' END AS status "
+          "DELETE c "
+          "RETURN row.index AS index, status, rating")
+
+
+def ensure_schema():
+    '''
+        Create the unique constraints and indexes the queries rely on
+
+    '''
+    global schema_ensured
+    with connections.get_neo4j_driver().session() as session:
+        for statement in SCHEMA:
+            session.run(statement).consume()
+    schema_ensured = True
+
+
+def run(statement, parameters=None, **kwparameters):
+    '''
+        Run a statement on a session borrowed from the pooled driver and
+        return its records, so concurrent callers never share a session.
+
+    '''
+    if not schema_ensured:
+        ensure_schema()
+    with connections.get_neo4j_driver().session() as session:
+        return list(session.run(statement, parameters, **kwparameters))
+
+
+def write_transaction(work):
+    '''
+        Run work(tx) as a write transaction function, atomic and retried by the driver on transient errors
+
+    '''
+    if not schema_ensured:
+        ensure_schema()
+    with connections.get_neo4j_driver().session() as session:
+        return session.write_transaction(work)
+
+
+def write(statement, **parameters):
+    return write_transaction(lambda tx: list(tx.run(statement, parameters)))
+
+
+def read(statement, **parameters):
+    if not schema_ensured:
+        ensure_schema()
+    with connections.get_neo4j_driver().session() as session:
+        return session.read_transaction(lambda tx: list(tx.run(statement, parameters)))
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def rounds(pairs):
+    '''
+        Split indexed (username, isbn) pairs into UNWIND rows, so no round holds the same book twice
+
+    '''
+    result = []
+    seen = {}
+    for index, (username, isbn) in enumerate(pairs):
+        depth = seen.get(isbn, 0)
+        seen[isbn] = depth + 1
+        if depth == len(result):
+            result.append([])
+        result[depth].append({'index': index, 'username': username, 'isbn': isbn})
+    return result
+
+
+def check_status(records):
+    '''
+        Raise the error string returned as the status of a validated statement
+
+    '''
+    status = records[0]['status']
+    if status != 'ok':
+        raise Exception(status)
+    return records[0]
+
+
+def author_key(author):
+    if not author:
+        return None
+    return AUTHOR_KEY_SEPARATOR.join(author)
 
 
 def book_to_dict(book):
@@ -22,6 +195,7 @@ def book_to_dict(book):
         book_dict['author'] = book.author
     else:
         book_dict['author'] = None
+    book_dict['author_key'] = author_key(book.author)
     if book.page_num:
         book_dict['page_num'] = book.page_num
     else:
@@ -65,7 +239,14 @@ class Neo4jLibrary(Library):
             Drop the whole database so we can start from scratch
 
         '''
-        sess.run('MATCH (n) DETACH DELETE n')
+        # bounded transactions keep the server heap flat on large graphs
+        while run("MATCH (n) WITH n LIMIT {limit} "
+                  "DETACH DELETE n "
+                  "RETURN count(*) AS deleted", limit=DROP_BATCH_SIZE)[0]['deleted'] > 0:
+            pass
+
+    def ensure_schema(self):
+        ensure_schema()
 
     def add_book(self, book):
         '''
@@ -74,15 +255,57 @@ class Neo4jLibrary(Library):
         :raise: 'required_field_book.isbn', 'required_posivitive_field_book.page_num', 'posivitive_field_book.quantity', 'book_exist_already'
         '''
         Library.add_book(self, book)
-        if self.get_book(book.isbn) is not None:
+        # the unique constraint on :book(isbn) rejects duplicates without a pre-read
+        try:
+            write("CREATE (b:book {"
+                  "title: {title},"
+                  "isbn: {isbn},"
+                  "author: {author},"
+                  "author_key: {author_key},"
+                  "page_num: {page_num},"
+                  "quantity: {quantity}"
+                  "}) " +
+                  LINK_AUTHORS.format('coalesce({author}, [])'),
+                  **book_to_dict(book))
+        except ConstraintError:
             raise Exception('book_exist_already')
-        sess.run("CREATE (:book {"
-                 "title: {title},"
-                 "isbn: {isbn},"
-                 "author: {author},"
-                 "page_num: {page_num},"
-                 "quantity: {quantity}"
-                 "})", book_to_dict(book))
+
+    def add_books(self, books, batch_size=BULK_BATCH_SIZE):
+        '''
+            Add books with one UNWIND statement per batch_size books
+
+        :param books:
+        :return: the error raised for each book by add_book, None where it was added
+        '''
+        books = list(books)
+        errors = [None] * len(books)
+        rows = {}
+        for index, book in enumerate(books):
+            try:
+                Library.add_book(self, book)
+                if book.isbn in rows:
+                    raise Exception('book_exist_already')
+                rows[book.isbn] = dict(book_to_dict(book), index=index)
+            except Exception as e:
+                errors[index] = e
+        for batch in batches(list(rows.values()), batch_size):
+            # a node stamped with this batch's id was created by it, any other already existed
+            self._merge_batch(errors, 'book_exist_already',
+                              "UNWIND {rows} AS row "
+                              "MERGE (b:book {isbn: row.isbn}) "
+                              "ON CREATE SET b.title = row.title, b.author = row.author, "
+                              "b.author_key = row.author_key, b.page_num = row.page_num, "
+                              "b.quantity = row.quantity, b._batch = {batch} "
+                              "WITH row, b, b._batch = {batch} AS created " +
+                              LINK_AUTHORS.format('CASE WHEN created THEN coalesce(row.author, []) ELSE [] END') +
+                              "REMOVE b._batch "
+                              "RETURN row.index AS index, created", batch)
+        return errors
+
+    def _merge_batch(self, errors, duplicate_error, statement, rows):
+        for x in write(statement, rows=rows, batch=uuid.uuid4().hex):
+            if not x['created']:
+                errors[x['index']] = Exception(duplicate_error)
 
     def get_book(self, isbn):
         '''
@@ -90,12 +313,27 @@ class Neo4jLibrary(Library):
         :param isbn:
         :return: get the book by isbn
         '''
-        for x in sess.run("MATCH (b:book)"
-                          "WHERE b.isbn={isbn}"
-                          "RETURN b", isbn=isbn):
+        for x in run("MATCH (b:book)"
+                     "WHERE b.isbn={isbn}"
+                     "RETURN b", isbn=isbn):
             return dict_to_book(x['b'])
         return None
 
+    def get_books(self, isbns):
+        '''
+
+        :param isbns:
+        :return: the book of each isbn, None where it does not exist
+        '''
+        books = {}
+        for batch in batches(list(isbns), BULK_BATCH_SIZE):
+            for x in read("UNWIND {isbns} AS isbn "
+                          "MATCH (b:book {isbn: isbn}) "
+                          "RETURN b", isbns=batch):
+                book = dict_to_book(x['b'])
+                books[book.isbn] = book
+        return [books.get(isbn) for isbn in isbns]
+
     def delete_book(self, isbn):
         '''
 
@@ -106,9 +344,15 @@ class Neo4jLibrary(Library):
             raise Exception('book_not_exists')
         if self._get_checkout_count(isbn) > 0:
             raise Exception('book_borrowed')
-        sess.run("MATCH (b:book)"
-                 "WHERE b.isbn={isbn}"
-                 "DELETE b", isbn=isbn)
+        # authors left without books are removed with it
+        write("MATCH (b:book {isbn: {isbn}}) "
+              "OPTIONAL MATCH (a:author)-[:wrote]->(b) "
+              "WITH b, collect(a) AS authors "
+              "DETACH DELETE b "
+              "WITH authors "
+              "UNWIND authors AS a "
+              "WITH a WHERE NOT (a)-[:wrote]->() "
+              "DELETE a", isbn=isbn)
 
     def edit_book(self, isbn, book, override=False):
         '''
@@ -120,6 +364,7 @@ class Neo4jLibrary(Library):
         old_book = self.get_book(isbn)
         if old_book is None:
             raise Exception('book_not_exists')
+        old_author = old_book.author or []
         if override or book.title:
             old_book.title = book.title
         if override or book.author:
@@ -131,13 +376,24 @@ class Neo4jLibrary(Library):
             count = self._get_checkout_count(isbn)
             if count > book.quantity:
                 raise Exception('book_borrowed')
-        sess.run("MATCH (b:book)"
-                 "WHERE b.isbn={isbn}"
-                 "SET b.title={title},"
-                 "b.author={author},"
-                 "b.page_num={page_num},"
-                 "b.quantity={quantity}"
-                 , book_to_dict(old_book))
+        new_author = old_book.author or []
+        write("MATCH (b:book)"
+              "WHERE b.isbn={isbn}"
+              "SET b.title={title},"
+              "b.author={author},"
+              "b.author_key={author_key},"
+              "b.page_num={page_num},"
+              "b.quantity={quantity} " +
+              LINK_AUTHORS.format('{added}') +
+              "WITH b "
+              "UNWIND {removed} AS name "
+              "MATCH (a:author {name: name})-[w:wrote]->(b) "
+              "DELETE w "
+              "WITH a WHERE NOT (a)-[:wrote]->() "
+              "DELETE a",
+              added=[name for name in new_author if name not in old_author],
+              removed=[name for name in old_author if name not in new_author],
+              **book_to_dict(old_book))
 
     def search_by_title(self, title):
         '''
@@ -145,9 +401,9 @@ class Neo4jLibrary(Library):
         :param title:
         :return: all books with this title
         '''
-        return [dict_to_book(x['b']) for x in sess.run("MATCH (b:book)"
-                                                       "WHERE b.title={title}"
-                                                       "RETURN b", title=title)]
+        return [dict_to_book(x['b']) for x in run("MATCH (b:book)"
+                                                  "WHERE b.title={title}"
+                                                  "RETURN b", title=title)]
 
     def search_by_author(self, author):
         '''
@@ -156,9 +412,8 @@ class Neo4jLibrary(Library):
         :return: all books by this author
         '''
         return [dict_to_book(x['b']) for x in
-                sess.run("MATCH (b:book)"
-                         "WHERE {author} in b.author "
-                         "RETURN b", author=author)]
+                run("MATCH (:author {name: {author}})-[:wrote]->(b:book) "
+                    "RETURN b", author=author)]
 
     def sort_by_title(self):
         '''
@@ -166,9 +421,9 @@ class Neo4jLibrary(Library):
         :return: all books sorted by title
         '''
         return [dict_to_book(x['b']) for x in
-                sess.run("MATCH (b:book)"
-                         "RETURN b "
-                         "ORDER BY b.title")]
+                run("MATCH (b:book)"
+                    "RETURN b "
+                    "ORDER BY b.title")]
 
     def sort_by_author(self):
         '''
@@ -176,9 +431,30 @@ class Neo4jLibrary(Library):
         :return: all books sorted by author
         '''
         return [dict_to_book(x['b']) for x in
-                sess.run("MATCH (b:book)"
-                         "RETURN b "
-                         "ORDER BY b.author")]
+                run("MATCH (b:book)"
+                    "RETURN b "
+                    "ORDER BY b.author_key")]
+
+    def migrate_author_nodes(self, batch_size=BULK_BATCH_SIZE):
+        '''
+            Create the (:author)-[:wrote]->(:book) relationships and author_key
+            of books stored before authors were nodes, batch_size books per transaction
+
+        :return: the number of books migrated
+        '''
+        migrated = 0
+        while True:
+            count = write("MATCH (b:book) "
+                          "WHERE size(coalesce(b.author, [])) > 0 AND NOT (b)<-[:wrote]-(:author) "
+                          "WITH b LIMIT {limit} "
+                          "SET b.author_key = reduce(k = head(b.author), name IN tail(b.author) | "
+                          "k + {separator} + name) " +
+                          LINK_AUTHORS.format('b.author') +
+                          "RETURN count(b) AS migrated", limit=batch_size,
+                          separator=AUTHOR_KEY_SEPARATOR)[0]['migrated']
+            if count == 0:
+                return migrated
+            migrated += count
 
     def sort_by_isbn(self):
         '''
@@ -186,9 +462,9 @@ class Neo4jLibrary(Library):
         :return: all books sorted by isbn
         '''
         return [dict_to_book(x['b']) for x in
-                sess.run("MATCH (b:book)"
-                         "RETURN b "
-                         "ORDER BY b.isbn")]
+                run("MATCH (b:book)"
+                    "RETURN b "
+                    "ORDER BY b.isbn")]
 
     def sort_by_page_num(self):
         '''
@@ -196,9 +472,87 @@ class Neo4jLibrary(Library):
         :return: all books sorted by page number
         '''
         return [dict_to_book(x['b']) for x in
-                sess.run("MATCH (b:book)"
+                run("MATCH (b:book)"
+                    "RETURN b "
+                    "ORDER BY b.page_num")]
+
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, ties ordered by isbn, one indexed range query per page
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        check_field(field, SORT_FIELDS)
+        return self._sorted_pages(SORT_KEYS[field], page_size, after_book(self, after))
+
+    def _sorted_pages(self, key, page_size, book):
+        # nulls come first, as in the other backends, though Cypher orders them last:
+        # the books without the key are read by isbn before the range over the key index
+        nulls = key != 'isbn' and (book is None or book_to_dict(book)[key] is None)
+        while True:
+            parameters = {'limit': page_size}
+            if nulls:
+                where = "WHERE b.{} IS NULL ".format(key)
+                if book is not None:
+                    where += "AND b.isbn > {isbn} "
+                    parameters.update(isbn=book.isbn)
+            elif book is None:
+                where = "WHERE b.{} IS NOT NULL ".format(key)
+            elif key == 'isbn':
+                where = "WHERE b.isbn > {isbn} "
+                parameters.update(isbn=book.isbn)
+            else:
+                where = SEEK_AFTER.format(key)
+                parameters.update(value=book_to_dict(book)[key], isbn=book.isbn)
+            books = [dict_to_book(x['b']) for x in
+                     run("MATCH (b:book) " + where +
                          "RETURN b "
-                         "ORDER BY b.page_num")]
+                         "ORDER BY b.{}, b.isbn "
+                         "LIMIT {{limit}}".format(key), parameters)]
+            for found in books:
+                yield found
+            if len(books) < page_size:
+                if not nulls:
+                    return
+                book, nulls = None, False
+            else:
+                book = books[-1]
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books found by title or author, ordered by isbn, one query per page
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        if field == 'title':
+            match = "MATCH (b:book {title: {value}}) "
+        else:
+            match = "MATCH (:author {name: {value}})-[:wrote]->(b:book) "
+        return self._search_pages(match, value, page_size, after)
+
+    def _search_pages(self, match, value, page_size, after):
+        while True:
+            books = [dict_to_book(x['b']) for x in
+                     run(match +
+                         "WHERE {after} IS NULL OR b.isbn > {after} "
+                         "RETURN b "
+                         "ORDER BY b.isbn "
+                         "LIMIT {limit}", value=value, after=after, limit=page_size)]
+            for book in books:
+                yield book
+            if len(books) < page_size:
+                return
+            after = books[-1].isbn
 
     def add_borrower(self, borrower):
         '''
@@ -207,13 +561,42 @@ class Neo4jLibrary(Library):
         :raise: 'required_field_borrower.username', 'borrower_already_exists'
         '''
         Library.add_borrower(self, borrower)
-        if self.get_borrower(borrower.username):
+        try:
+            run("CREATE (:borrower {"
+                "username: {username},"
+                "name: {name},"
+                "phone: {phone}"
+                "})", borrower_to_dict(borrower))
+        except ConstraintError:
             raise Exception('borrower_already_exists')
-        sess.run("CREATE (:borrower {"
-                 "username: {username},"
-                 "name: {name},"
-                 "phone: {phone}"
-                 "})", borrower_to_dict(borrower))
+
+    def add_borrowers(self, borrowers, batch_size=BULK_BATCH_SIZE):
+        '''
+            Add borrowers with one UNWIND statement per batch_size borrowers
+
+        :param borrowers:
+        :return: the error raised for each borrower by add_borrower, None where it was added
+        '''
+        borrowers = list(borrowers)
+        errors = [None] * len(borrowers)
+        rows = {}
+        for index, borrower in enumerate(borrowers):
+            try:
+                Library.add_borrower(self, borrower)
+                if borrower.username in rows:
+                    raise Exception('borrower_already_exists')
+                rows[borrower.username] = dict(borrower_to_dict(borrower), index=index)
+            except Exception as e:
+                errors[index] = e
+        for batch in batches(list(rows.values()), batch_size):
+            self._merge_batch(errors, 'borrower_already_exists',
+                              "UNWIND {rows} AS row "
+                              "MERGE (u:borrower {username: row.username}) "
+                              "ON CREATE SET u.name = row.name, u.phone = row.phone, u._batch = {batch} "
+                              "WITH row, u, u._batch = {batch} AS created "
+                              "REMOVE u._batch "
+                              "RETURN row.index AS index, created", batch)
+        return errors
 
     def get_borrower(self, username):
         '''
@@ -221,9 +604,9 @@ class Neo4jLibrary(Library):
         :param username:
         :return: the borrower with this username
         '''
-        for x in sess.run("MATCH (b:borrower)"
-                          "WHERE b.username={username}"
-                          "RETURN b", username=username):
+        for x in run("MATCH (b:borrower)"
+                     "WHERE b.username={username}"
+                     "RETURN b", username=username):
             return dict_to_borrower(x['b'])
 
     def delete_borrower(self, username):
@@ -236,9 +619,9 @@ class Neo4jLibrary(Library):
             raise Exception('borrower_not_exists')
         if self._get_borrowed_count(username) > 0:
             raise Exception('book_borrowed')
-        sess.run("MATCH (b:borrower)"
-                 "WHERE b.username={username}"
-                 "DELETE b", username=username)
+        run("MATCH (b:borrower)"
+            "WHERE b.username={username}"
+            "DETACH DELETE b", username=username)
 
     def edit_borrower(self, username, borrower, override=False):
         '''
@@ -254,10 +637,10 @@ class Neo4jLibrary(Library):
             old_borrower.name = borrower.name
         if override or borrower.phone:
             old_borrower.phone = borrower.phone
-        sess.run("MATCH (b:borrower)"
-                 "WHERE b.username={username}"
-                 "SET b.name={name},"
-                 "b.phone={phone}", borrower_to_dict(old_borrower))
+        run("MATCH (b:borrower)"
+            "WHERE b.username={username}"
+            "SET b.name={name},"
+            "b.phone={phone}", borrower_to_dict(old_borrower))
 
     def search_by_name(self, name):
         '''
@@ -266,9 +649,9 @@ class Neo4jLibrary(Library):
         :return: borrowers with this name
         '''
         return [dict_to_borrower(x['b']) for x in
-                sess.run("MATCH (b:borrower)"
-                         "WHERE b.name={name} "
-                         "RETURN b", name=name)]
+                run("MATCH (b:borrower)"
+                    "WHERE b.name={name} "
+                    "RETURN b", name=name)]
 
     def checkout_book(self, username, isbn):
         '''
@@ -277,38 +660,84 @@ class Neo4jLibrary(Library):
         :param isbn:
         :raise 'book_not_exists', 'borrower_not_exists', 'book_already_borrowed', 'book_not_available'
         '''
-        book = self.get_book(isbn)
-        if not book:
-            raise Exception('book_not_exists')
-        if not self.get_borrower(username):
-            raise Exception('borrower_not_exists')
-        if self._has_borrowed_book(isbn, username):
-            raise Exception('book_already_borrowed')
-        count = self._get_checkout_count(isbn)
-        if count == book.quantity:
-            raise Exception('book_not_available')
-        sess.run("MATCH (u:borrower), (b:book)"
-                 "WHERE u.username={username} and b.isbn={isbn}"
-                 "CREATE (u)-[:checkout]->(b)", username=username, isbn=isbn)
-
-    def _has_borrowed_book(self, isbn, username):
-        for x in sess.run("MATCH (u:borrower)-[c:checkout]->(b:book)"
-                          "WHERE u.username={username} and b.isbn={isbn}"
-                          "RETURN c", username=username, isbn=isbn):
-            return True
-        return False
+        check_status(write(CHECKOUT, rows=[{'index': 0, 'username': username, 'isbn': isbn}]))
+
+    def checkout_many(self, checkouts):
+        '''
+            Check out many books in one transaction, with one UNWIND statement per round of distinct books
+
+        :param checkouts: (username, isbn) pairs
+        :return: the error raised for each checkout by checkout_book, None where it succeeded
+        '''
+        checkouts = list(checkouts)
+
+        def work(tx):
+            # created per attempt, so a retried transaction does not keep the errors of the one rolled back
+            errors = [None] * len(checkouts)
+            for rows in rounds(checkouts):
+                for x in tx.run(CHECKOUT, rows=rows):
+                    if x['status'] != 'ok':
+                        errors[x['index']] = Exception(x['status'])
+            return errors
+
+        return write_transaction(work)
+
+    def import_checkouts(self, checkouts, batch_size=BULK_BATCH_SIZE):
+        '''
+            Load existing checkouts with one UNWIND statement per batch_size checkouts.
+            Meant for bulk loading: availability is checked once per batch,
+            not against checkouts made concurrently.
+
+        :param checkouts: (username, isbn) pairs
+        :return: the error raised for each checkout by checkout_book, None where it was created
+        '''
+        checkouts = list(checkouts)
+        errors = [None] * len(checkouts)
+        for batch in batches(list(enumerate(checkouts)), batch_size):
+            available = {x['isbn']: x['available'] for x in
+                         read("UNWIND {isbns} AS isbn "
+                              "MATCH (b:book {isbn: isbn}) "
+                              "RETURN isbn, b.quantity - size((b)<-[:checkout]-()) AS available",
+                              isbns=list(set(isbn for index, (username, isbn) in batch)))}
+            rows = []
+            seen = set()
+            for index, (username, isbn) in batch:
+                if isbn not in available:
+                    errors[index] = Exception('book_not_exists')
+                elif (username, isbn) in seen:
+                    errors[index] = Exception('book_already_borrowed')
+                elif available[isbn] <= 0:
+                    errors[index] = Exception('book_not_available')
+                else:
+                    available[isbn] -= 1
+                    seen.add((username, isbn))
+                    rows.append({'index': index, 'username': username, 'isbn': isbn})
+            for x in write("UNWIND {rows} AS row "
+                           "MATCH (b:book {isbn: row.isbn}) "
+                           "OPTIONAL MATCH (u:borrower {username: row.username}) "
+                           "OPTIONAL MATCH (u)-[c:checkout]->(b) "
+                           "WITH row, u, b, CASE "
+                           "WHEN u IS NULL THEN 'borrower_not_exists' "
+                           "WHEN c IS NOT NULL THEN 'book_already_borrowed' "
+                           "ELSE 'ok' END AS status "
+                           "FOREACH (_ IN CASE WHEN status = 'ok' THEN [1] ELSE [] END | "
+                           "CREATE (u)-[:checkout]->(b)) "
+                           "RETURN row.index AS index, status", rows=rows):
+                if x['status'] != 'ok':
+                    errors[x['index']] = Exception(x['status'])
+        return errors
 
     def _get_checkout_count(self, isbn):
-        num_checkout_itr = iter(sess.run("MATCH (u:borrower)-[c:checkout]->(b:book)"
-                                         "WHERE b.isbn={isbn}"
-                                         "RETURN count(*)", isbn=isbn))
+        num_checkout_itr = iter(run("MATCH (u:borrower)-[c:checkout]->(b:book)"
+                                    "WHERE b.isbn={isbn}"
+                                    "RETURN count(*)", isbn=isbn))
         count = next(num_checkout_itr)
         return count.value()
 
     def _get_borrowed_count(self, username):
-        num_checkout_itr = iter(sess.run("MATCH (u:borrower)-[c:checkout]->(b:book)"
-                                         "WHERE u.username={username}"
-                                         "RETURN count(*)", username=username))
+        num_checkout_itr = iter(run("MATCH (u:borrower)-[c:checkout]->(b:book)"
+                                    "WHERE u.username={username}"
+                                    "RETURN count(*)", username=username))
         count = next(num_checkout_itr)
         return count.value()
 
@@ -319,18 +748,37 @@ class Neo4jLibrary(Library):
         :param isbn:
         :raise: `borrower_not_exists`, `book_not_exists`, `book_not_borrowed`
         '''
-        borrower = self.get_borrower(username)
-        if not borrower:
-            raise Exception('borrower_not_exists')
-        book = self.get_book(isbn)
-        if not book:
-            raise Exception('book_not_exists')
-        # verify indeed borrowed
-        if not self._has_borrowed_book(isbn, username):
-            raise Exception('book_not_borrowed')
-        sess.run("MATCH (u:borrower)-[c:checkout]->(b:book)"
-                 "WHERE u.username={username} and b.isbn={isbn}"
-                 "DELETE c", username=username, isbn=isbn)
+        error = self.return_many([(username, isbn)])[0]
+        if error is not None:
+            raise error
+
+    def return_many(self, returns):
+        '''
+            Return many books in one transaction, with one UNWIND statement per round of distinct books
+
+        :param returns: (username, isbn) pairs
+        :return: the error raised for each return by return_book, None where it succeeded
+        '''
+        returns = list(returns)
+
+        def work(tx):
+            # created per attempt, as in checkout_many
+            errors = [None] * len(returns)
+            for rows in rounds(returns):
+                rated = []
+                for x in tx.run(RETURN, rows=rows):
+                    if x['status'] != 'ok':
+                        errors[x['index']] = Exception(x['status'])
+                    elif x['rating'] is not None:
+                        username, isbn = returns[x['index']]
+                        rated.append({'username': username, 'isbn': isbn, 'rating': x['rating'], 'delta': -1})
+                # the returned ratings no longer count towards similarity; this round's returns must be
+                # accounted before the next round removes the checkouts they are compared against
+                if rated:
+                    tx.run(UPDATE_SIMILAR, rows=rated).consume()
+            return errors
+
+        return write_transaction(work)
 
     def get_book_borrowers(self, isbn):
         '''
@@ -342,9 +790,9 @@ class Neo4jLibrary(Library):
         if self.get_book(isbn) is None:
             raise Exception('book_not_exists')
         return [dict_to_borrower(x['u']) for x in
-                sess.run("MATCH (u:borrower)-[:checkout]->(b:book)"
-                         "WHERE b.isbn={isbn} "
-                         "RETURN u", isbn=isbn)]
+                run("MATCH (u:borrower)-[:checkout]->(b:book)"
+                    "WHERE b.isbn={isbn} "
+                    "RETURN u", isbn=isbn)]
 
     def get_borrowed_books(self, username):
         '''
@@ -356,9 +804,9 @@ class Neo4jLibrary(Library):
         if self.get_borrower(username) is None:
             raise Exception('borrower_not_exists')
         return [dict_to_book(x['b']) for x in
-                sess.run("MATCH (u:borrower)-[:checkout]->(b:book)"
-                         "WHERE u.username={username} "
-                         "RETURN b", username=username)]
+                run("MATCH (u:borrower)-[:checkout]->(b:book)"
+                    "WHERE u.username={username} "
+                    "RETURN b", username=username)]
 
     def rate_book(self, username, isbn, rating):
         '''
@@ -374,15 +822,21 @@ class Neo4jLibrary(Library):
         '''
         if rating < 1 or rating > 5:
             raise Exception('rating_between_1_and_5')
-        if not self.get_book(isbn):
-            raise Exception('book_not_exists')
-        if not self.get_borrower(username):
-            raise Exception('borrower_not_exists')
-        if not self._has_borrowed_book(isbn, username):
-            raise Exception('book_not_checked_out')
-        sess.run("MATCH (u:borrower)-[c:checkout]->(b:book)"
-                 "WHERE u.username={username} and b.isbn={isbn}"
-                 "SET c.rating={rating}", username=username, isbn=isbn, rating=rating)
+
+        def work(tx):
+            old_rating = check_status(list(tx.run(CHECKOUT_STATUS +
+                                                  "WITH c, status, c.rating AS old_rating "
+                                                  "SET c.rating = {rating} "
+                                                  "RETURN status, old_rating",
+                                                  username=username, isbn=isbn, rating=rating)))['old_rating']
+            # move this borrower's similarity from those who agreed with the old rating to the new one
+            if old_rating != rating:
+                rows = [{'username': username, 'isbn': isbn, 'rating': rating, 'delta': 1}]
+                if old_rating is not None:
+                    rows.append({'username': username, 'isbn': isbn, 'rating': old_rating, 'delta': -1})
+                tx.run(UPDATE_SIMILAR, rows=rows).consume()
+
+        write_transaction(work)
 
     def get_rating(self, username, isbn):
         '''
@@ -394,35 +848,54 @@ class Neo4jLibrary(Library):
         :raise: 'book_not_exists'
         :raise: 'book_not_checked_out'
         '''
-        if not self.get_book(isbn):
-            raise Exception('book_not_exists')
-        if not self.get_borrower(username):
-            raise Exception('borrower_not_exists')
-        if not self._has_borrowed_book(isbn, username):
-            raise Exception('book_not_checked_out')
-        for x in sess.run("MATCH (u:borrower)-[c:checkout]->(b:book)"
-                          "WHERE u.username={username} and b.isbn={isbn}"
-                          "return c.rating", username=username, isbn=isbn):
-            return x['c.rating']
-        return 0
+        return check_status(read(CHECKOUT_STATUS +
+                                 "RETURN status, c.rating AS rating", username=username, isbn=isbn))['rating']
 
-    def recommend(self, username):
+    def recommend(self, username, k=10):
         '''
+            Rank the books rated above 3 by similar borrowers, weighted by how many
+            ratings each shares with this borrower, skipping books already borrowed
 
         :param username:
-        :raise: 'borrower_not_exists'
-        :return:
-        '''
-        if not self.get_borrower(username):
+        :param k: the number of books to return
+        :raise: 'non_negative_field_k', 'borrower_not_exists'
+        :return: at most k books, best first
+        '''
+        Library.recommend(self, username, k)
+        # the books are collected into the one row that reports a missing borrower, then cut to k
+        record = read("OPTIONAL MATCH (x:borrower {username: {username}}) "
+                      "OPTIONAL MATCH (x)-[s:similar]-(:borrower)-[c:checkout]->(r:book) "
+                      "WHERE c.rating > 3 AND NOT (x)-[:checkout]->(r) "
+                      "WITH x, r, sum(s.weight) AS score "
+                      "ORDER BY score DESC, r.isbn "
+                      "WITH x, collect(r) AS books "
+                      "RETURN x IS NULL AS missing, books[..{k}] AS books", username=username, k=k)[0]
+        if record['missing']:
             raise Exception('borrower_not_exists')
-        already_borrowed = [b.isbn for b in self.get_borrowed_books(username)]
-        ls = []
-        for x in sess.run(
-                "MATCH (x:borrower)-[c1:checkout]->(b:book)<-[c2:checkout]-(y:borrower)-[c3:checkout]->(r:book) "
-                "WHERE x.username = {username} and c1.rating=c2.rating and c3.rating>3 "
-                "RETURN r", username=username):
-            book = dict_to_book(x['r'])
-            if book.isbn not in already_borrowed:
-                ls.append(book)
-                already_borrowed.append(book.isbn)
-        return ls
+        return [dict_to_book(book) for book in record['books']]
+
+    def rebuild_similarity(self, batch_size=BULK_BATCH_SIZE):
+        '''
+            Recompute every :similar relationship from the current ratings,
+            for graphs rated before they were maintained by rate_book
+
+        :param batch_size: the number of borrowers whose pairs are created per transaction
+        '''
+        while write("MATCH ()-[s:similar]->() WITH s LIMIT {limit} "
+                    "DELETE s "
+                    "RETURN count(*) AS deleted", limit=DROP_BATCH_SIZE)[0]['deleted'] > 0:
+            pass
+        after = ''
+        while True:
+            usernames = [x['username'] for x in read("MATCH (x:borrower) WHERE x.username > {after} "
+                                                     "RETURN x.username AS username "
+                                                     "ORDER BY x.username LIMIT {limit}",
+                                                     after=after, limit=batch_size)]
+            if not usernames:
+                break
+            write("UNWIND {usernames} AS username "
+                  "MATCH (x:borrower {username: username})-[c1:checkout]->(:book)<-[c2:checkout]-(y:borrower) "
+                  "WHERE x.username < y.username AND c1.rating = c2.rating "
+                  "WITH x, y, count(*) AS weight "
+                  "CREATE (x)-[:similar {weight: weight}]->(y)", usernames=usernames)
+            after = usernames[-1]
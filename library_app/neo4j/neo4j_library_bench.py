@@ -0,0 +1,75 @@
+import random
+import time
+
+from library_app.model import Book, Borrower
+from library_app.neo4j import neo4j_library
+from library_app.neo4j.neo4j_library import Neo4jLibrary
+
+
+def timed(action):
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def bulk_load(book_num=900000, borrower_num=100000, checkout_num=200000, batch_size=5000):
+    '''
+        Load a 1M node catalog through the UNWIND bulk APIs and report rows per second
+
+    '''
+    library = Neo4jLibrary()
+    library.drop_db()
+    books = [Book(isbn=str(i), title='title' + str(i % 50000), author=['author' + str(i % 20000)],
+                  page_num=i % 1000 + 1, quantity=3) for i in range(book_num)]
+    borrowers = [Borrower(username='user' + str(i), name='name' + str(i % 5000), phone=str(i))
+                 for i in range(borrower_num)]
+    checkouts = [('user' + str(i % borrower_num), str(i * 7 % book_num)) for i in range(checkout_num)]
+    print('{:>16} {:>10} {:>10} {:>12}'.format('operation', 'rows', 'seconds', 'rows_per_s'))
+    for name, rows, action in [
+        ('add_books', book_num, lambda: library.add_books(books, batch_size)),
+        ('add_borrowers', borrower_num, lambda: library.add_borrowers(borrowers, batch_size)),
+        ('import_checkouts', checkout_num, lambda: library.import_checkouts(checkouts, batch_size)),
+        ('drop_db', book_num + borrower_num, library.drop_db),
+    ]:
+        seconds = timed(action)
+        print('{:>16} {:>10} {:>10.2f} {:>12.0f}'.format(name, rows, seconds, rows / seconds))
+
+
+def percentile(samples, fraction):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def recommend_latency(borrower_num=10000, book_num=2000, ratings_per_borrower=20, sample_num=200, seed=42):
+    '''
+        Time recommend and the incremental similarity upkeep of rate_book on a synthetic ratings graph
+
+    '''
+    rand = random.Random(seed)
+    library = Neo4jLibrary()
+    library.drop_db()
+    library.add_books([Book(isbn=str(i), title='title' + str(i), author=['author' + str(i % 500)],
+                            page_num=100, quantity=borrower_num) for i in range(book_num)])
+    usernames = ['user' + str(i) for i in range(borrower_num)]
+    library.add_borrowers([Borrower(username=username, name=username, phone='0') for username in usernames])
+    checkouts = [(username, isbn) for username in usernames
+                 for isbn in set(str(rand.randrange(book_num)) for _ in range(ratings_per_borrower))]
+    library.import_checkouts(checkouts)
+    neo4j_library.write("UNWIND {rows} AS row "
+                        "MATCH (:borrower {username: row.username})-[c:checkout]->(:book {isbn: row.isbn}) "
+                        "SET c.rating = row.rating",
+                        rows=[{'username': username, 'isbn': isbn, 'rating': rand.randint(1, 5)}
+                              for username, isbn in checkouts])
+    print('rebuild_similarity {:.2f}s'.format(timed(library.rebuild_similarity)))
+    sample = rand.sample(checkouts, sample_num)
+    rate = [timed(lambda: library.rate_book(username, isbn, rand.randint(1, 5))) for username, isbn in sample]
+    recommend = [timed(lambda: library.recommend(username)) for username, isbn in sample]
+    print('{:>10} {:>10} {:>10}'.format('operation', 'p50_ms', 'p99_ms'))
+    for name, samples in [('rate_book', rate), ('recommend', recommend)]:
+        print('{:>10} {:>10.2f} {:>10.2f}'.format(name, percentile(samples, 0.5) * 1000,
+                                                  percentile(samples, 0.99) * 1000))
+    library.drop_db()
+
+
+if __name__ == '__main__':
+    bulk_load()
+    recommend_latency()
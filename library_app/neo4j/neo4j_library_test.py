@@ -1,177 +1,98 @@
 import unittest
 
-from library_app.library_test import LibraryTest, book_toadd, book_toadd2, book_toadd3, borrower_toadd1,  borrower_toadd2,  borrower_toadd3,  borrowor_toadd4
+from library_app import connections
+from library_app.library_test import LibraryTest, RatingLibraryTest, book_toadd, book_toadd2, book_toadd3, borrower_toadd1,  borrower_toadd2,  borrower_toadd3,  borrowor_toadd4
 from library_app.model import Book
+from . import neo4j_library
 from .neo4j_library import Neo4jLibrary
 
 
-class Neo4jLibraryTest(LibraryTest, unittest.TestCase):
+class Neo4jLibraryTest(LibraryTest, RatingLibraryTest, unittest.TestCase):
 
     def setUpClient(self):
         self.client = Neo4jLibrary()
 
-    def test_rate1(self):
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 1)
-
-        self.assertEqual(1, self.client.get_rating('zhangq1', '1'))
-
-    def test_rate2(self):
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 5)
-
-        self.assertEqual(5, self.client.get_rating('zhangq1', '1'))
-
-    def test_rate_out_of_range1(self):
-        self.client.checkout_book('zhangq1', '1')
-        with self.assertRaises(Exception) as context:
-            self.client.rate_book('zhangq1', '1', 0)
-        self.assertEqual('rating_between_1_and_5', str(context.exception))
-
-    def test_rate_out_of_range2(self):
-        self.client.checkout_book('zhangq1', '1')
-        with self.assertRaises(Exception) as context:
-            self.client.rate_book('zhangq1', '1', 6)
-        self.assertEqual('rating_between_1_and_5', str(context.exception))
-
-    def test_rate_out_of_range3(self):
-        self.client.checkout_book('zhangq1', '1')
-        with self.assertRaises(Exception) as context:
-            self.client.rate_book('zhangq1', '1', -1)
-        self.assertEqual('rating_between_1_and_5', str(context.exception))
-
-    def test_rate_not_checked_out(self):
-        with self.assertRaises(Exception) as context:
-            self.client.rate_book('zhangq1', '1', 1)
-        self.assertEqual('book_not_checked_out', str(context.exception))
-
-    def test_rate_twice(self):
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 1)
-        self.client.rate_book('zhangq1', '1', 2)
-        self.assertEqual(2, self.client.get_rating('zhangq1', '1'))
-
-    def test_rate_borrower_not_exists(self):
-        with self.assertRaises(Exception) as context:
-            self.client.rate_book('xx', '1', 1)
-        self.assertEqual('borrower_not_exists', str(context.exception))
-
-    def test_rate_book_not_exists(self):
-        with self.assertRaises(Exception) as context:
-            self.client.rate_book('zhangq2', 'xxx', 1)
-        self.assertEqual('book_not_exists', str(context.exception))
-
-    def test_recommend1(self):
-        self.client.add_book(book_toadd2)
-        self.client.add_borrower(borrower_toadd2)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 3)
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 5)
+    def test_add_books(self):
+        errors = self.client.add_books([book_toadd2, book_toadd, Book(isbn='10'), book_toadd3, book_toadd2],
+                                       batch_size=2)
 
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([book_toadd2], recommends)
+        self.assertEqual([str(e) if e else None for e in errors],
+                         [None, 'book_exist_already', 'required_posivitive_field_book.page_num', None,
+                          'book_exist_already'])
+        self.assertListEqual(self.client.sort_by_isbn(), [book_toadd, book_toadd2, book_toadd3])
 
-    def test_recommend_different_rating(self):
-        self.client.add_book(book_toadd2)
-        self.client.add_borrower(borrower_toadd2)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 4)
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 5)
+    def test_add_borrowers(self):
+        errors = self.client.add_borrowers([borrower_toadd2, borrower_toadd1, borrower_toadd3])
 
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([], recommends)
+        self.assertEqual([str(e) if e else None for e in errors], [None, 'borrower_already_exists', None])
+        self.assertEqual(self.client.get_borrower('zhangq3'), borrower_toadd3)
 
-    def test_recommend_below_4(self):
-        self.client.add_book(book_toadd2)
+    def test_import_checkouts(self):
+        self.client.add_book(book_toadd3)
         self.client.add_borrower(borrower_toadd2)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 3)
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 3)
+        errors = self.client.import_checkouts([('zhangq1', '3'), ('zhangq2', '3'), ('zhangq1', '1'),
+                                               ('xxx', '1'), ('zhangq1', '4')])
 
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([], recommends)
+        self.assertEqual([str(e) if e else None for e in errors],
+                         [None, 'book_not_available', None, 'borrower_not_exists', 'book_not_exists'])
+        self.assertCountEqual(self.client.get_borrowed_books('zhangq1'), [book_toadd, book_toadd3])
 
-    def test_recommend_already_checkout(self):
-        self.client.add_book(book_toadd2)
-        self.client.add_borrower(borrower_toadd2)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 3)
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 5)
-        self.client.checkout_book('zhangq1', '2')
-
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([], recommends)
-
-    def test_recommend_multiple_book(self):
-        self.client.add_book(book_toadd2)
+    def test_drop_db_in_batches(self):
+        self.client.add_books([Book(isbn='bulk' + str(i), page_num=1) for i in range(50)])
+        neo4j_library.DROP_BATCH_SIZE = 7
+        try:
+            self.client.drop_db()
+        finally:
+            neo4j_library.DROP_BATCH_SIZE = 10000
+
+        self.assertListEqual(self.client.sort_by_isbn(), [])
+
+    def test_search_by_author_after_edit(self):
         self.client.add_book(book_toadd3)
-        self.client.add_borrower(borrower_toadd2)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 3)
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 5)
-        self.client.checkout_book('zhangq2', '3')
-        self.client.rate_book('zhangq2', '3', 4)
-
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([book_toadd2, book_toadd3], recommends)
-
-    def test_recommend_multiple_recomender(self):
-        self.client.add_book(book_toadd2)
-        self.client.add_borrower(borrower_toadd2)
-        self.client.add_borrower(borrower_toadd3)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 3)
-        self.client.checkout_book('zhangq3', '1')
-        self.client.rate_book('zhangq3', '1', 3)
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 5)
-        self.client.checkout_book('zhangq3', '2')
-        self.client.rate_book('zhangq3', '2', 4)
-
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([book_toadd2], recommends)
-
-    def test_recommend_multiple_recomenders_recommend_multiple_book(self):
-        self.client.edit_book("1", Book(quantity=10))
+        self.client.edit_book('3', Book(author=['Chandan', 'Qi']))
+
+        self.assertListEqual(self.client.search_by_author('Sriram'), [book_toadd])
+        self.assertListEqual(self.client.search_by_author('Qi'), [self.client.get_book('3')])
+
+    def test_delete_book_removes_orphan_authors(self):
+        self.client.add_book(book_toadd3)
+        self.client.delete_book('1')
+        self.client.delete_book('3')
+
+        self.assertEqual(neo4j_library.run("MATCH (a:author) RETURN count(a)")[0].value(), 0)
+
+    def test_migrate_author_nodes(self):
+        neo4j_library.run("CREATE (:book {isbn: '5', title: 'legacy', author: ['Qi', 'Fred'], "
+                          "page_num: 10, quantity: 1})")
+
+        self.assertEqual(self.client.migrate_author_nodes(batch_size=1), 1)
+        self.assertListEqual([b.isbn for b in self.client.search_by_author('Fred')], ['5'])
+        self.assertListEqual([b.isbn for b in self.client.sort_by_author()], ['5', '1'])
+
+    def test_sorted_pages_seek_indexes(self):
+        for key in ('title', 'author_key', 'page_num'):
+            with connections.get_neo4j_driver().session() as session:
+                plan = session.run("EXPLAIN MATCH (b:book) " + neo4j_library.SEEK_AFTER.format(key) +
+                                   "RETURN b ORDER BY b.{}, b.isbn LIMIT 10".format(key),
+                                   value='x', isbn='1').summary().plan
+            self.assertTrue(any(operator.startswith('NodeIndexSeekByRange') for operator in operator_types(plan)))
+
+    def test_iter_sorted_past_nulls(self):
         self.client.add_book(book_toadd2)
         self.client.add_book(book_toadd3)
-        self.client.add_borrower(borrower_toadd2)
-        self.client.add_borrower(borrower_toadd3)
-        self.client.add_borrower(borrowor_toadd4)
-        self.client.checkout_book('zhangq1', '1')
-        self.client.rate_book('zhangq1', '1', 3)
-        self.client.checkout_book('zhangq2', '1')
-        self.client.rate_book('zhangq2', '1', 3)
-        self.client.checkout_book('zhangq3', '1')
-        self.client.rate_book('zhangq3', '1', 3)
-
-        self.client.checkout_book('zhangq2', '2')
-        self.client.rate_book('zhangq2', '2', 5)
-        self.client.checkout_book('zhangq4', '1')
-        self.client.rate_book('zhangq4', '1', 3)
-
-        self.client.checkout_book('zhangq3', '2')
-        self.client.rate_book('zhangq3', '2', 4)
-        self.client.checkout_book('zhangq3', '3')
-        self.client.rate_book('zhangq3', '3', 5)
-
-        recommends = self.client.recommend('zhangq1')
-        self.assertCountEqual([book_toadd2, book_toadd3], recommends)
+        neo4j_library.run("MATCH (b:book) WHERE b.isbn IN ['1', '3'] REMOVE b.title")
+
+        self.assertListEqual([b.isbn for b in self.client.iter_sorted('title', page_size=1)], ['1', '3', '2'])
+        self.assertListEqual([b.isbn for b in self.client.iter_sorted('title', after='1')], ['3', '2'])
+        self.assertListEqual([b.isbn for b in self.client.iter_sorted('title', after='2')], [])
+
+    def test_rebuild_similarity(self):
+        self._rate_shared_book()
+        neo4j_library.run("MATCH ()-[s:similar]->() DELETE s")
+        self.client.rebuild_similarity()
+
+        self.assertListEqual(self.client.recommend('zhangq1'), [book_toadd2, book_toadd3])
+
 
+def operator_types(plan):
+    return [plan.operator_type] + [operator for child in plan.children for operator in operator_types(child)]
@@ -0,0 +1,139 @@
+import asyncio
+
+from library_app import connections
+from library_app.async_library import ExecutorLibrary
+from library_app.redis.redis_library import CHECKOUT_SCRIPT, HYDRATE_CHUNK_SIZE, RETURN_SCRIPT, BookProxy, \
+    BorrowerProxy, RedisLibrary
+
+
+def script_error(error):
+    return Exception(str(error, 'utf-8')) if error else None
+
+
+class AsyncRedisLibrary(ExecutorLibrary):
+    '''
+        An AsyncLibrary on redis.asyncio. Reads, searches and checkouts are native; the catalog
+        and borrower writes, which take several dependent round trips, run RedisLibrary on the executor.
+        Both share the same keys and guard scripts.
+
+    '''
+
+    def __init__(self, client=None, executor=None, chunk_size=HYDRATE_CHUNK_SIZE):
+        '''
+
+        :param client: a redis.asyncio.Redis, the configured shared one when None
+        '''
+        super().__init__(RedisLibrary(chunk_size), executor)
+        self.redis = client or connections.get_redis_async()
+        self.chunk_size = chunk_size
+        self.scripts = {}
+
+    def _script(self, source):
+        if source not in self.scripts:
+            self.scripts[source] = self.redis.register_script(source)
+        return self.scripts[source]
+
+    def _chunks(self, items):
+        return [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)]
+
+    async def _hgetall_many(self, keys):
+        '''
+            Fetch hashes with one pipeline per chunk_size keys, the pipelines' round trips running concurrently
+
+        '''
+        async def fetch(chunk):
+            pipe = self.redis.pipeline(transaction=False)
+            for key in chunk:
+                pipe.hgetall(key)
+            return await pipe.execute()
+
+        results = await asyncio.gather(*(fetch(chunk) for chunk in self._chunks(keys)))
+        return [hash for result in results for hash in result]
+
+    async def _books(self, book_keys):
+        book_keys = list(book_keys)
+        hashes = await self._hgetall_many(book_keys)
+        return [BookProxy.hash_to_Book(key, dict) for key, dict in zip(book_keys, hashes)]
+
+    async def _borrowers(self, borrower_keys):
+        borrower_keys = list(borrower_keys)
+        hashes = await self._hgetall_many(borrower_keys)
+        return [BorrowerProxy.hash_to_borrower(key, dict) for key, dict in zip(borrower_keys, hashes)]
+
+    async def _run_script(self, source, keys):
+        error = script_error(await self._script(source)(keys=keys))
+        if error:
+            raise error
+
+    async def _run_script_many(self, source, key_lists):
+        '''
+            Run a guard script once per key list, one pipeline per chunk_size calls, the pipelines running
+            concurrently; calls in different pipelines may interleave, so of two conflicting calls either may fail
+
+        :return: the error string returned by each call as an Exception, None where it succeeded
+        '''
+        script = self._script(source)
+
+        async def run(chunk):
+            pipe = self.redis.pipeline(transaction=False)
+            for keys in chunk:
+                await script(keys=keys, client=pipe)
+            return await pipe.execute()
+
+        results = await asyncio.gather(*(run(chunk) for chunk in self._chunks(key_lists)))
+        return [script_error(error) for result in results for error in result]
+
+    async def get_book(self, isbn):
+        key = BookProxy(isbn).book_key
+        return BookProxy.hash_to_Book(key, await self.redis.hgetall(key))
+
+    async def get_books(self, isbns):
+        return await self._books([BookProxy(isbn).book_key for isbn in isbns])
+
+    async def search_by_title(self, title):
+        return await self._books(await self.redis.smembers('book:title-' + title))
+
+    async def search_by_author(self, author):
+        return await self._books(await self.redis.smembers('book:author-' + author))
+
+    async def get_borrower(self, username):
+        key = BorrowerProxy(username).borrower_key
+        return BorrowerProxy.hash_to_borrower(key, await self.redis.hgetall(key))
+
+    async def search_by_name(self, name):
+        return await self._borrowers(await self.redis.smembers('borrower:name-' + name))
+
+    async def checkout_book(self, username, isbn):
+        await self._run_script(CHECKOUT_SCRIPT, BookProxy(isbn).checkout_keys(BorrowerProxy(username)))
+
+    async def checkout_many(self, checkouts):
+        return await self._run_script_many(CHECKOUT_SCRIPT, [BookProxy(isbn).checkout_keys(BorrowerProxy(username))
+                                                             for username, isbn in checkouts])
+
+    async def return_book(self, username, isbn):
+        await self._run_script(RETURN_SCRIPT, BookProxy(isbn).checkout_keys(BorrowerProxy(username)))
+
+    async def return_many(self, returns):
+        return await self._run_script_many(RETURN_SCRIPT, [BookProxy(isbn).checkout_keys(BorrowerProxy(username))
+                                                           for username, isbn in returns])
+
+    async def get_book_borrowers(self, isbn):
+        key = BookProxy(isbn).book_key
+        # the existence check and the checkout set share one round trip
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.smembers('book:checkoutby-' + key)
+        exists, borrower_keys = await pipe.execute()
+        if not exists:
+            raise Exception('book_not_exists')
+        return await self._borrowers(borrower_keys)
+
+    async def get_borrowed_books(self, username):
+        key = BorrowerProxy(username).borrower_key
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.smembers('borrower:checkoutby-' + key)
+        exists, book_keys = await pipe.execute()
+        if not exists:
+            raise Exception('borrower_not_exists')
+        return await self._books(book_keys)
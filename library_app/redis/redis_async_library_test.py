@@ -0,0 +1,36 @@
+import unittest
+
+from library_app import connections
+from library_app.async_library_test import BlockingLibrary
+from library_app.library_test import LibraryTest, book_toadd, book_toadd2, book_toadd3, borrower_toadd1
+from library_app.redis.redis_async_library import AsyncRedisLibrary
+
+
+class AsyncRedisLibraryTest(LibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        # an asyncio client is bound to the loop it first runs on, so each test gets its own
+        self.client = BlockingLibrary(AsyncRedisLibrary(client=connections.connect_redis_async(connections.settings),
+                                                        chunk_size=2))
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_get_books_chunks_concurrently(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+
+        self.assertListEqual(self.client.get_books(['3', 'missing', '1', '2']),
+                             [book_toadd3, None, book_toadd, book_toadd2])
+
+    def test_checkout_many_chunks(self):
+        self.client.add_book(book_toadd3)
+        errors = self.client.checkout_many([('zhangq1', '1'), ('zhangq1', '3'), ('zhangq1', '4'), ('no_one', '1')])
+
+        self.assertEqual([None, None, 'book_not_exists', 'borrower_not_exists'],
+                         [str(e) if e else None for e in errors])
+        self.assertCountEqual(self.client.get_book_borrowers('3'), [borrower_toadd1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,113 @@
-import redis
+from library_app import connections
+from library_app.model import PAGE_SIZE, SEARCH_FIELDS, SORT_FIELDS, Book, Borrower, Library, after_book, check_field
+
+# number of hashes fetched per pipelined round trip when hydrating lists
+HYDRATE_CHUNK_SIZE = 500
+
+
+# server-side guards: each validates and mutates atomically in a single EVALSHA round trip,
+# returning nil on success or the error string to raise
+CHECKOUT_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then return 'borrower_not_exists' end
+if redis.call('EXISTS', KEYS[2]) == 0 then return 'book_not_exists' end
+if redis.call('SISMEMBER', KEYS[3], KEYS[1]) == 1 then return 'book_already_borrowed' end
+if redis.call('SCARD', KEYS[3]) >= tonumber(redis.call('HGET', KEYS[2], 'quantity') or 0) then
+    return 'book_not_available'
+end
+redis.call('SADD', KEYS[3], KEYS[1])
+redis.call('SADD', KEYS[4], KEYS[2])
+return false
+'''
+
+RETURN_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then return 'borrower_not_exists' end
+if redis.call('EXISTS', KEYS[2]) == 0 then return 'book_not_exists' end
+if redis.call('SREM', KEYS[3], KEYS[1]) == 0 then return 'book_not_borrowed' end
+redis.call('SREM', KEYS[4], KEYS[2])
+return false
+'''
+
+# KEYS: the book, its checkout set, book:keys, the four sort indexes, then its title and author sets;
+# ARGV: the title and author those sets were read for. The sets are named after fields of the book,
+# so the caller reads them first; if an edit changed them since, the script touches nothing and
+# returns 'book_changed' for the caller to read them again.
+DELETE_BOOK_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then return 'book_not_exists' end
+if redis.call('SCARD', KEYS[2]) > 0 then return 'book_borrowed' end
+local title = redis.call('HGET', KEYS[1], 'title') or ''
+local authors = redis.call('HGET', KEYS[1], 'author') or ''
+if title ~= ARGV[1] or authors ~= ARGV[2] then return 'book_changed' end
+for i = 8, #KEYS do redis.call('SREM', KEYS[i], KEYS[1]) end
+redis.call('ZREM', KEYS[4], title .. '\0' .. KEYS[1])
+redis.call('ZREM', KEYS[5], authors .. '\0' .. KEYS[1])
+redis.call('ZREM', KEYS[6], KEYS[1])
+redis.call('ZREM', KEYS[7], KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[3], KEYS[1])
+return false
+'''
+
+# KEYS: the borrower, its checkout set and its name set; ARGV: the name the set was read for
+DELETE_BORROWER_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then return 'borrower_not_exists' end
+if redis.call('SCARD', KEYS[2]) > 0 then return 'book_borrowed' end
+local name = redis.call('HGET', KEYS[1], 'name') or ''
+if name ~= ARGV[1] then return 'borrower_changed' end
+if #KEYS > 2 then redis.call('SREM', KEYS[3], KEYS[1]) end
+redis.call('DEL', KEYS[1])
+return false
+'''
+
+# the sorted set index of each sort field
+SORT_INDEXES = ['book:index-' + field for field in ('title', 'author', 'page_num', 'isbn')]
+
+indexes_ensured = False
+
+scripts = {}
 
-from library_app.model import Book, Borrower, Library
 
-conn = redis.Redis()
+def get_redis():
+    return connections.get_redis()
 
 
-def get_redis():
-    return conn
+def get_script(source):
+    '''
+        The Script of source, cached by source only: a Script holds the client it was registered on,
+        which connections.configure and connections.instrument replace, so callers always run it on
+        the current client
+
+    '''
+    if source not in scripts:
+        scripts[source] = get_redis().register_script(source)
+    return scripts[source]
+
+
+def run_script(source, keys, args=()):
+    '''
+        Run a guard script through EVALSHA, registering it on first use,
+        and raise the error string it returns.
+
+    '''
+    error = get_script(source)(keys=keys, args=args, client=get_redis())
+    if error:
+        raise Exception(str(error, 'utf-8'))
+
+
+def run_script_many(source, key_lists, chunk_size=None):
+    '''
+        Run a guard script once per key list, pipelining chunk_size EVALSHA calls per round trip
+
+    :return: the error string returned by each call as an Exception, None where it succeeded
+    '''
+    chunk_size = chunk_size or HYDRATE_CHUNK_SIZE
+    script = get_script(source)
+    errors = []
+    for start in range(0, len(key_lists), chunk_size):
+        pipe = get_redis().pipeline(transaction=False)
+        for keys in key_lists[start:start + chunk_size]:
+            script(keys=keys, client=pipe)
+        errors.extend(Exception(str(error, 'utf-8')) if error else None for error in pipe.execute())
+    return errors
 
 
 def parse_dict(dict, key):
@@ -14,11 +115,32 @@ def parse_dict(dict, key):
         return str(dict.get(key), 'utf-8')
     return None
 
+
+def parse_bytes(value):
+    return str(value, 'utf-8') if value is not None else None
+
+
 def parse_dict_int(dict, key):
     v = parse_dict(dict, key)
     return int(v) if v else None
 
 
+def hgetall_many(keys, chunk_size=None):
+    '''
+        Fetch the hashes stored at keys with pipelined HGETALL calls,
+        one round trip per chunk_size keys instead of one per key.
+
+    '''
+    chunk_size = chunk_size or HYDRATE_CHUNK_SIZE
+    hashes = []
+    for start in range(0, len(keys), chunk_size):
+        pipe = get_redis().pipeline(transaction=False)
+        for key in keys[start:start + chunk_size]:
+            pipe.hgetall(key)
+        hashes.extend(pipe.execute())
+    return hashes
+
+
 def set_hash(hash_key, entity, value):
     oldValue = get_redis().hget(hash_key, entity)
     if oldValue:
@@ -42,6 +164,103 @@ def update_set_reference(refer_key, set_prefix, oldValue, newValue):
 def set_hash_and_update_set_reference(hash_key, entity, set_prefix, value):
     oldValue = set_hash(hash_key, entity, value)
     update_set_reference(hash_key, set_prefix, oldValue, value)
+    return oldValue
+
+
+def lex_member(value, refer_key):
+    return (value or '') + '\x00' + refer_key
+
+
+def update_lex_index(index_key, refer_key, oldValue, newValue):
+    '''
+        Keep refer_key in the lexicographic sorted set index_key, where every
+        member scores 0 and is ordered by "<value>\\x00<refer_key>".
+
+    '''
+    get_redis().zrem(index_key, lex_member(oldValue, refer_key))
+    get_redis().zadd(index_key, {lex_member(newValue, refer_key): 0})
+
+
+def rebuild_indexes(chunk_size=None):
+    '''
+        Rebuild the sort indexes from the books listed in book:keys, reading and writing
+        chunk_size books per pipelined round trip, for books stored before the indexes existed
+
+    '''
+    chunk_size = chunk_size or HYDRATE_CHUNK_SIZE
+    keys = [str(key, 'utf-8') for key in get_redis().sscan_iter('book:keys', count=chunk_size)]
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        pipe = get_redis().pipeline(transaction=False)
+        for key in chunk:
+            pipe.hmget(key, 'title', 'author', 'page_num')
+        fields = pipe.execute()
+        pipe = get_redis().pipeline(transaction=False)
+        for key, (title, author, page_num) in zip(chunk, fields):
+            pipe.zadd('book:index-isbn', {key: 0})
+            pipe.zadd('book:index-title', {lex_member(parse_bytes(title), key): 0})
+            pipe.zadd('book:index-author', {lex_member(parse_bytes(author), key): 0})
+            pipe.zadd('book:index-page_num', {key: int(page_num or 0)})
+        pipe.execute()
+
+
+def ensure_indexes():
+    '''
+        Rebuild the sort indexes once per process if they hold fewer books than book:keys,
+        as they do on a database written before they were maintained
+
+    '''
+    global indexes_ensured
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.zcard('book:index-isbn')
+    pipe.scard('book:keys')
+    indexed, stored = pipe.execute()
+    if indexed < stored:
+        rebuild_indexes()
+    indexes_ensured = True
+
+
+def index_range(index_key, offset=0, limit=None):
+    '''
+        Read the keys referenced by a sorted set index in order with ZRANGE,
+        starting at offset and returning at most limit keys.
+
+    '''
+    if limit is not None and limit <= 0:
+        return []
+    stop = -1 if limit is None else offset + limit - 1
+    return [member.split(b'\x00')[-1] for member in get_redis().zrange(index_key, offset, stop)]
+
+
+def lex_page(index_key, page_size, min, max=b'+'):
+    '''
+        Read at most page_size members of a lexicographic index between min and max with ZRANGEBYLEX
+
+    '''
+    return get_redis().zrangebylex(index_key, min, max, start=0, num=page_size)
+
+
+def scored_page(index_key, page_size, member, score):
+    '''
+        Read at most page_size (member, score) pairs of a scored index, after member when given.
+        The position is found with ZRANK, or by counting the members ordered before member when it
+        was removed from the index since it was read.
+
+    '''
+    start = 0
+    if member is not None:
+        rank = get_redis().zrank(index_key, member)
+        if rank is not None:
+            start = rank + 1
+        else:
+            # members with equal scores are ordered bytewise
+            ties = get_redis().zrangebyscore(index_key, score, score)
+            start = get_redis().zcount(index_key, '-inf', '(' + str(score)) + sum(1 for tie in ties if tie < member)
+    return get_redis().zrange(index_key, start, start + page_size - 1, withscores=True)
+
+
+def to_bytes(value):
+    return value.encode('utf-8') if type(value) is str else value
 
 
 class BookProxy:
@@ -50,7 +269,10 @@ class BookProxy:
 
     @staticmethod
     def key_to_Book(key):
-        dict = get_redis().hgetall(key)
+        return BookProxy.hash_to_Book(key, get_redis().hgetall(key))
+
+    @staticmethod
+    def hash_to_Book(key, dict):
         if type(key) != str:
             key = str(key, 'utf-8')
         if len(dict) == 0:
@@ -63,11 +285,32 @@ class BookProxy:
                     quantity=parse_dict_int(dict, b'quantity'))
 
     @staticmethod
-    def get_books(book_keys):
-        return [BookProxy.key_to_Book(key) for key in book_keys]
+    def get_books(book_keys, chunk_size=None):
+        book_keys = list(book_keys)
+        hashes = hgetall_many(book_keys, chunk_size)
+        return [BookProxy.hash_to_Book(key, dict) for key, dict in zip(book_keys, hashes)]
 
     def add(self):
         get_redis().sadd('book:keys', self.book_key)
+        get_redis().zadd('book:index-isbn', {self.book_key: 0})
+
+    def queue_add(self, pipe, book):
+        '''
+            Queue on pipe the writes add and edit(book, True) make for a new book
+
+        '''
+        author = ';'.join(book.author)
+        fields = {'title': book.title, 'author': author, 'page_num': book.page_num, 'quantity': book.quantity}
+        pipe.hset(self.book_key, mapping={field: value for field, value in fields.items() if value})
+        pipe.sadd('book:keys', self.book_key)
+        if book.title:
+            pipe.sadd('book:title-' + book.title, self.book_key)
+        for nAuthor in book.author:
+            pipe.sadd('book:author-' + nAuthor, self.book_key)
+        pipe.zadd('book:index-isbn', {self.book_key: 0})
+        pipe.zadd('book:index-title', {lex_member(book.title, self.book_key): 0})
+        pipe.zadd('book:index-author', {lex_member(author, self.book_key): 0})
+        pipe.zadd('book:index-page_num', {self.book_key: book.page_num})
 
     def fetch(self):
         return BookProxy.key_to_Book(self.book_key)
@@ -86,22 +329,28 @@ class BookProxy:
             self.set_quantity(book.quantity)
 
     def delete(self):
-        get_redis().delete(self.book_key)
-        get_redis().srem('book:keys', self.book_key)
-        self.set_title(None)
-        self.set_author(None)
-        self.set_page_num(None)
-        get_redis().delete(self.book_key)
-        return False
+        while True:
+            title, author = (parse_bytes(value) or '' for value in get_redis().hmget(self.book_key, 'title', 'author'))
+            keys = [self.book_key, 'book:checkoutby-' + self.book_key, 'book:keys'] + SORT_INDEXES
+            if title:
+                keys.append('book:title-' + title)
+            keys.extend('book:author-' + author for author in author.split(';') if author)
+            try:
+                return run_script(DELETE_BOOK_SCRIPT, keys, [title, author])
+            except Exception as e:
+                if str(e) != 'book_changed':
+                    raise
 
     def set_title(self, title):
-        set_hash_and_update_set_reference(self.book_key, 'title', 'book:title-', title)
+        oldValue = set_hash_and_update_set_reference(self.book_key, 'title', 'book:title-', title)
+        update_lex_index('book:index-title', self.book_key, oldValue, title)
 
     def set_author(self, author):
         if not author:
             author = []
 
         oldValue = set_hash(self.book_key, 'author', ';'.join(author))
+        update_lex_index('book:index-author', self.book_key, oldValue, ';'.join(author))
         if oldValue:
             oldAuthors = oldValue.split(';')
             for oAuthor in oldAuthors:
@@ -119,6 +368,7 @@ class BookProxy:
 
     def set_page_num(self, page_num):
         set_hash(self.book_key, 'page_num', page_num)
+        get_redis().zadd('book:index-page_num', {self.book_key: page_num or 0})
 
     def get_borrower_num(self):
         return get_redis().scard('book:checkoutby-' + self.book_key)
@@ -126,13 +376,15 @@ class BookProxy:
     def is_borrower(self, borrowerProxy):
         return get_redis().sismember('book:checkoutby-' + self.book_key, borrowerProxy.borrower_key)
 
+    def checkout_keys(self, borrowerProxy):
+        return [borrowerProxy.borrower_key, self.book_key,
+                'book:checkoutby-' + self.book_key, 'borrower:checkoutby-' + borrowerProxy.borrower_key]
+
     def add_borrower(self, borrowerProxy):
-        get_redis().sadd('book:checkoutby-' + self.book_key, borrowerProxy.borrower_key)
-        get_redis().sadd('borrower:checkoutby-' + borrowerProxy.borrower_key, self.book_key)
+        run_script(CHECKOUT_SCRIPT, self.checkout_keys(borrowerProxy))
 
     def remove_borrower(self, borrowerProxy):
-        get_redis().srem('book:checkoutby-' + self.book_key, borrowerProxy.borrower_key)
-        get_redis().srem('borrower:checkoutby-' + borrowerProxy.borrower_key, self.book_key)
+        run_script(RETURN_SCRIPT, self.checkout_keys(borrowerProxy))
 
 
 class BorrowerProxy:
@@ -142,7 +394,10 @@ class BorrowerProxy:
 
     @staticmethod
     def key_to_borrower(key):
-        dict = get_redis().hgetall(key)
+        return BorrowerProxy.hash_to_borrower(key, get_redis().hgetall(key))
+
+    @staticmethod
+    def hash_to_borrower(key, dict):
         if len(dict) == 0:
             return None
         if type(key) != str:
@@ -152,8 +407,10 @@ class BorrowerProxy:
                         phone=parse_dict(dict, b'phone'))
 
     @staticmethod
-    def get_borrowers(borrower_keys):
-        return [BorrowerProxy.key_to_borrower(key) for key in borrower_keys]
+    def get_borrowers(borrower_keys, chunk_size=None):
+        borrower_keys = list(borrower_keys)
+        hashes = hgetall_many(borrower_keys, chunk_size)
+        return [BorrowerProxy.hash_to_borrower(key, dict) for key, dict in zip(borrower_keys, hashes)]
 
     def exists(self):
         return self.borrower_key in get_redis()
@@ -168,9 +425,16 @@ class BorrowerProxy:
             self.set_phone(borrower.phone)
 
     def delete(self):
-        self.set_name(None)
-        self.set_phone(None)
-        get_redis().delete(self.borrower_key)
+        while True:
+            name = parse_bytes(get_redis().hget(self.borrower_key, 'name')) or ''
+            keys = [self.borrower_key, 'borrower:checkoutby-' + self.borrower_key]
+            if name:
+                keys.append('borrower:name-' + name)
+            try:
+                return run_script(DELETE_BORROWER_SCRIPT, keys, [name])
+            except Exception as e:
+                if str(e) != 'borrower_changed':
+                    raise
 
     def set_name(self, name):
         set_hash_and_update_set_reference(self.borrower_key, 'name', 'borrower:name-', name)
@@ -184,8 +448,21 @@ class BorrowerProxy:
 
 
 class RedisLibrary(Library):
+    def __init__(self, chunk_size=HYDRATE_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
     def drop_db(self):
+        global indexes_ensured
         get_redis().flushall()
+        indexes_ensured = False
+
+    def rebuild_indexes(self):
+        rebuild_indexes(self.chunk_size)
+
+    def _sorted(self, index_key, offset, limit):
+        if not indexes_ensured:
+            ensure_indexes()
+        return BookProxy.get_books(index_range(index_key, offset, limit), self.chunk_size)
 
     def add_book(self, book):
         Library.add_book(self, book)
@@ -195,16 +472,53 @@ class RedisLibrary(Library):
         bookproxy.add()
         bookproxy.edit(book, True)
 
+    def add_books(self, books):
+        '''
+            Add books with two pipelined round trips per chunk: one checking which exist, one writing the rest
+
+        :param books:
+        :return: the error raised for each book by add_book, None where it was added
+        '''
+        books = list(books)
+        errors = [None] * len(books)
+        new_books = {}
+        for index, book in enumerate(books):
+            try:
+                Library.add_book(self, book)
+                if book.isbn in new_books:
+                    raise Exception('book_exist_already')
+                new_books[book.isbn] = index
+            except Exception as e:
+                errors[index] = e
+        indexes = list(new_books.values())
+        for start in range(0, len(indexes), self.chunk_size):
+            chunk = indexes[start:start + self.chunk_size]
+            pipe = get_redis().pipeline(transaction=False)
+            for index in chunk:
+                pipe.exists(BookProxy(books[index].isbn).book_key)
+            exists = pipe.execute()
+            pipe = get_redis().pipeline(transaction=False)
+            for index, found in zip(chunk, exists):
+                if found:
+                    errors[index] = Exception('book_exist_already')
+                else:
+                    BookProxy(books[index].isbn).queue_add(pipe, books[index])
+            pipe.execute()
+        return errors
+
     def get_book(self, isbn):
         return BookProxy(isbn).fetch()
 
+    def get_books(self, isbns):
+        '''
+
+        :param isbns:
+        :return: the book of each isbn, None where it does not exist, fetched with pipelined HGETALL calls
+        '''
+        return BookProxy.get_books([BookProxy(isbn).book_key for isbn in isbns], self.chunk_size)
+
     def delete_book(self, isbn):
-        proxy = BookProxy(isbn)
-        if not proxy.exists():
-            raise Exception('book_not_exists')
-        if proxy.get_borrower_num() > 0:
-            raise Exception('book_borrowed')
-        proxy.delete()
+        BookProxy(isbn).delete()
 
     def edit_book(self, isbn, book, override=False):
         proxy = BookProxy(isbn)
@@ -215,22 +529,102 @@ class RedisLibrary(Library):
         proxy.edit(book, override)
 
     def search_by_title(self, title):
-        return BookProxy.get_books(get_redis().smembers('book:title-' + title))
+        return BookProxy.get_books(get_redis().smembers('book:title-' + title), self.chunk_size)
 
     def search_by_author(self, author):
-        return BookProxy.get_books(get_redis().smembers('book:author-' + author))
-
-    def sort_by_title(self):  # return all books
-        return BookProxy.get_books(get_redis().sort('book:keys', by='*->title', alpha=True))
-
-    def sort_by_author(self):  # return all books
-        return BookProxy.get_books(get_redis().sort('book:keys', by='*->author', alpha=True))
-
-    def sort_by_isbn(self):  # return all books
-        return BookProxy.get_books(get_redis().sort('book:keys', alpha=True))
-
-    def sort_by_page_num(self):  # return all books
-        return BookProxy.get_books(get_redis().sort('book:keys', by='*->page_num', alpha=True))
+        return BookProxy.get_books(get_redis().smembers('book:author-' + author), self.chunk_size)
+
+    def sort_by_title(self, offset=0, limit=None):  # return all books
+        return self._sorted('book:index-title', offset, limit)
+
+    def sort_by_author(self, offset=0, limit=None):  # return all books
+        return self._sorted('book:index-author', offset, limit)
+
+    def sort_by_isbn(self, offset=0, limit=None):  # return all books
+        return self._sorted('book:index-isbn', offset, limit)
+
+    def sort_by_page_num(self, offset=0, limit=None):  # return all books
+        return self._sorted('book:index-page_num', offset, limit)
+
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, ties ordered by isbn, reading one window of the
+            field's sorted set index and then its hashes per page
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        check_field(field, SORT_FIELDS)
+        if not indexes_ensured:
+            ensure_indexes()
+        book = after_book(self, after)
+        index_key = 'book:index-' + field
+        if field == 'page_num':
+            return self._scored_pages(index_key, page_size, book)
+        member = None
+        if book is not None:
+            book_key = BookProxy(book.isbn).book_key
+            if field == 'isbn':
+                member = book_key
+            else:
+                member = lex_member(book.title if field == 'title' else ';'.join(book.author or []), book_key)
+        return self._lex_pages(index_key, page_size, to_bytes(member))
+
+    def _lex_pages(self, index_key, page_size, member, max=b'+'):
+        while True:
+            members = lex_page(index_key, page_size, b'(' + member if member is not None else b'-', max)
+            # a book deleted after its index entry was read is skipped
+            for book in BookProxy.get_books([entry.split(b'\x00')[-1] for entry in members], self.chunk_size):
+                if book is not None:
+                    yield book
+            if len(members) < page_size:
+                return
+            member = members[-1]
+
+    def _scored_pages(self, index_key, page_size, book):
+        member = to_bytes(BookProxy(book.isbn).book_key) if book is not None else None
+        score = (book.page_num or 0) if book is not None else None
+        while True:
+            entries = scored_page(index_key, page_size, member, score)
+            for book in BookProxy.get_books([key for key, page_num in entries], self.chunk_size):
+                if book is not None:
+                    yield book
+            if len(entries) < page_size:
+                return
+            member, score = entries[-1]
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books found by title or author, ordered by isbn. A title search reads windows
+            of the title index; the author sets are unordered, so an author search sorts the set's
+            keys and fetches the books a page at a time.
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        after_key = to_bytes(BookProxy(after).book_key) if after is not None else b''
+        if field == 'title':
+            if not indexes_ensured:
+                ensure_indexes()
+            prefix = to_bytes(lex_member(value, ''))
+            # the title's members run from "<title>\x00" up to, but excluding, "<title>\x01"
+            return self._lex_pages('book:index-title', page_size, prefix + after_key, b'(' + prefix[:-1] + b'\x01')
+        keys = sorted(key for key in get_redis().smembers('book:author-' + value) if key > after_key)
+        return self._key_pages(keys, page_size)
+
+    def _key_pages(self, keys, page_size):
+        for start in range(0, len(keys), page_size):
+            for book in BookProxy.get_books(keys[start:start + page_size], self.chunk_size):
+                if book is not None:
+                    yield book
 
     def add_borrower(self, borrower):
         Library.add_borrower(self, borrower)
@@ -243,12 +637,7 @@ class RedisLibrary(Library):
         return BorrowerProxy(username).fetch()
 
     def delete_borrower(self, username):
-        proxy = BorrowerProxy(username)
-        if not proxy.exists():
-            raise Exception('borrower_not_exists')
-        if proxy.get_borrowed_book_num() > 0:
-            raise Exception('book_borrowed')
-        proxy.delete()
+        BorrowerProxy(username).delete()
 
     def edit_borrower(self, username, borrower):
         proxy = BorrowerProxy(username)
@@ -257,42 +646,43 @@ class RedisLibrary(Library):
         proxy.edit(borrower)
 
     def search_by_name(self, name):
-        return BorrowerProxy.get_borrowers(get_redis().smembers('borrower:name-' + name))
+        return BorrowerProxy.get_borrowers(get_redis().smembers('borrower:name-' + name), self.chunk_size)
 
     def checkout_book(self, username, isbn):
-        borrowerProxy = BorrowerProxy(username)
-        if not borrowerProxy.exists():
-            raise Exception('borrower_not_exists')
-        proxy = BookProxy(isbn)
-        if not proxy.exists():
-            raise Exception('book_not_exists')
-        # verify availability
-        if proxy.is_borrower(borrowerProxy):
-            raise Exception('book_already_borrowed')
-        if proxy.get_borrower_num() >= proxy.get_quantity():
-            raise Exception('book_not_available')
-        proxy.add_borrower(borrowerProxy)
+        # existence and availability are verified atomically by the script
+        BookProxy(isbn).add_borrower(BorrowerProxy(username))
+
+    def checkout_many(self, checkouts):
+        '''
+
+        :param checkouts: (username, isbn) pairs
+        :return: the error raised for each checkout by checkout_book, None where it succeeded,
+            running the checkout script for chunk_size checkouts per pipelined round trip
+        '''
+        return run_script_many(CHECKOUT_SCRIPT, [BookProxy(isbn).checkout_keys(BorrowerProxy(username))
+                                                 for username, isbn in checkouts], self.chunk_size)
 
     def return_book(self, username, isbn):
-        borrowerProxy = BorrowerProxy(username)
-        if not borrowerProxy.exists():
-            raise Exception('borrower_not_exists')
-        proxy = BookProxy(isbn)
-        if not proxy.exists():
-            raise Exception('book_not_exists')
-        # verify indeed borrowed
-        if not proxy.is_borrower(borrowerProxy):
-            raise Exception('book_not_borrowed')
-        proxy.remove_borrower(borrowerProxy)
+        BookProxy(isbn).remove_borrower(BorrowerProxy(username))
+
+    def return_many(self, returns):
+        '''
+
+        :param returns: (username, isbn) pairs
+        :return: the error raised for each return by return_book, None where it succeeded,
+            running the return script for chunk_size returns per pipelined round trip
+        '''
+        return run_script_many(RETURN_SCRIPT, [BookProxy(isbn).checkout_keys(BorrowerProxy(username))
+                                               for username, isbn in returns], self.chunk_size)
 
     def get_book_borrowers(self, isbn):
         proxy = BookProxy(isbn)
         if not proxy.exists():
             raise Exception('book_not_exists')
-        return BorrowerProxy.get_borrowers(get_redis().smembers('book:checkoutby-' + proxy.book_key))
+        return BorrowerProxy.get_borrowers(get_redis().smembers('book:checkoutby-' + proxy.book_key), self.chunk_size)
 
     def get_borrowed_books(self, username):
         proxy = BorrowerProxy(username)
         if not proxy.exists():
             raise Exception('borrower_not_exists')
-        return BookProxy.get_books(get_redis().smembers('borrower:checkoutby-' + proxy.borrower_key))
+        return BookProxy.get_books(get_redis().smembers('borrower:checkoutby-' + proxy.borrower_key), self.chunk_size)
@@ -0,0 +1,61 @@
+import time
+
+import redis
+
+from library_app.redis.redis_library import BookProxy, RedisLibrary, get_redis
+
+round_trips = 0
+
+
+def _count(method):
+    def counted(*args, **kwargs):
+        global round_trips
+        round_trips += 1
+        return method(*args, **kwargs)
+
+    return counted
+
+
+# a plain command is one round trip, a pipeline is one round trip for the whole batch
+redis.Redis.execute_command = _count(redis.Redis.execute_command)
+redis.client.Pipeline.execute = _count(redis.client.Pipeline.execute)
+
+
+def per_key_get_books(book_keys):
+    return [BookProxy.key_to_Book(key) for key in book_keys]
+
+
+def measure(fetch, book_keys):
+    global round_trips
+    round_trips = 0
+    start = time.perf_counter()
+    fetch(book_keys)
+    return round_trips, time.perf_counter() - start
+
+
+def main(sizes=(10, 100, 1000, 10000, 100000), chunk_size=500):
+    library = RedisLibrary()
+    library.drop_db()
+    added = 0
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format('books', 'per_key_rtt', 'per_key_s', 'pipe_rtt', 'pipe_s'))
+    for size in sizes:
+        pipe = get_redis().pipeline(transaction=False)
+        for i in range(added, size):
+            key = 'book:' + str(i)
+            pipe.hset(key, 'title', 'title' + str(i))
+            pipe.hset(key, 'author', 'author' + str(i % 100))
+            pipe.hset(key, 'page_num', i % 1000 + 1)
+            pipe.hset(key, 'quantity', 1)
+            pipe.sadd('book:keys', key)
+        pipe.execute()
+        added = size
+        book_keys = ['book:' + str(i) for i in range(size)]
+        per_key = measure(per_key_get_books, book_keys)
+        pipelined = measure(lambda keys: BookProxy.get_books(keys, chunk_size), book_keys)
+        print('{:>8} {:>12} {:>12.4f} {:>12} {:>12.4f}'.format(size, per_key[0], per_key[1],
+                                                               pipelined[0], pipelined[1]))
+    library.drop_db()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,56 @@
 import unittest
+from copy import copy
 
-from library_app.library_test import LibraryTest
-from library_app.redis.redis_library import RedisLibrary
+from library_app.library_test import LibraryTest, book_toadd, book_toadd2, book_toadd3
+from library_app.model import Book
+from library_app.redis import redis_library
+from library_app.redis.redis_library import BookProxy, RedisLibrary
 
 
 class RedisLibraryTest(LibraryTest, unittest.TestCase):
 
     def setUpClient(self):
         self.client = RedisLibrary()
+
+    def test_get_books_chunked(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        books = BookProxy.get_books(['book:3', 'book:missing', 'book:1', 'book:2'], chunk_size=2)
+
+        self.assertListEqual(books, [book_toadd3, None, book_toadd, book_toadd2])
+
+    def test_delete_book_clears_search_sets(self):
+        self.client.delete_book('1')
+
+        self.assertListEqual(self.client.search_by_title(book_toadd.title), [])
+        self.assertListEqual(self.client.search_by_author(book_toadd.author[0]), [])
+
+    def test_sort_by_page_num_paginated(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+
+        self.assertListEqual(self.client.sort_by_page_num(offset=1, limit=1), [book_toadd2])
+        self.assertListEqual(self.client.sort_by_page_num(offset=2), [book_toadd3])
+
+    def test_sort_by_title_after_edit(self):
+        self.client.add_book(book_toadd2)
+        self.client.edit_book('1', Book(title='a_book'))
+        edited = copy(book_toadd)
+        edited.title = 'a_book'
+
+        self.assertListEqual(self.client.sort_by_title(), [edited, book_toadd2])
+
+    def test_sort_rebuilds_missing_indexes(self):
+        self.client.add_book(book_toadd2)
+        redis_library.get_redis().delete(*redis_library.SORT_INDEXES)
+        redis_library.indexes_ensured = False
+
+        self.assertListEqual(self.client.sort_by_isbn(), [book_toadd, book_toadd2])
+        self.assertListEqual(self.client.sort_by_page_num(offset=1), [book_toadd2])
+
+    def test_delete_book_after_title_edit(self):
+        self.client.edit_book('1', Book(title='a_book'))
+        self.client.delete_book('1')
+
+        self.assertListEqual(self.client.search_by_title('a_book'), [])
+        self.assertListEqual(self.client.sort_by_title(), [])
@@ -0,0 +1,655 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from library_app import connections
+from library_app.model import PAGE_SIZE, SEARCH_FIELDS, SORT_FIELDS, Book, Borrower, Library, after_book, check_field, \
+    each
+
+# joins the author list into book.author_key, which both sorts and hydrates the list
+AUTHOR_KEY_SEPARATOR = '\x00'
+
+# rows per IN (...) lookup, under SQLite's default limit of 999 bound parameters
+LOOKUP_CHUNK_SIZE = 500
+
+# sqlite3 keeps this many prepared statements per connection and reuses them by SQL text
+STATEMENT_CACHE_SIZE = 256
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS book ('
+    'isbn TEXT PRIMARY KEY, title TEXT, author_key TEXT, page_num INTEGER, quantity INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS book_author ('
+    'isbn TEXT NOT NULL REFERENCES book(isbn) ON DELETE CASCADE, position INTEGER NOT NULL, name TEXT NOT NULL, '
+    'PRIMARY KEY (isbn, position))',
+    'CREATE TABLE IF NOT EXISTS borrower (username TEXT PRIMARY KEY, name TEXT, phone TEXT)',
+    'CREATE TABLE IF NOT EXISTS checkout ('
+    'isbn TEXT NOT NULL REFERENCES book(isbn), username TEXT NOT NULL REFERENCES borrower(username), '
+    'rating INTEGER, PRIMARY KEY (isbn, username))',
+    # the isbn suffix lets keyset pages read each index in (value, isbn) order
+    'CREATE INDEX IF NOT EXISTS book_title_isbn ON book(title, isbn)',
+    'CREATE INDEX IF NOT EXISTS book_author_key_isbn ON book(author_key, isbn)',
+    'CREATE INDEX IF NOT EXISTS book_page_num_isbn ON book(page_num, isbn)',
+    'CREATE INDEX IF NOT EXISTS book_author_name_isbn ON book_author(name, isbn)',
+    'CREATE INDEX IF NOT EXISTS borrower_name ON borrower(name)',
+    'CREATE INDEX IF NOT EXISTS checkout_username ON checkout(username)',
+]
+
+BOOK_COLUMNS = 'b.isbn, b.title, b.author_key, b.page_num, b.quantity'
+
+# the book column each sort orders by
+SORT_COLUMNS = {'title': 'title', 'author': 'author_key', 'isbn': 'isbn', 'page_num': 'page_num'}
+BORROWER_COLUMNS = 'u.username, u.name, u.phone'
+
+# inserts the checkout only while the borrower exists and a copy is left, in one statement
+CHECKOUT = ('INSERT OR IGNORE INTO checkout (isbn, username) '
+            'SELECT b.isbn, ? FROM book b '
+            'WHERE b.isbn = ? '
+            'AND EXISTS (SELECT 1 FROM borrower WHERE username = ?) '
+            'AND (SELECT count(*) FROM checkout WHERE isbn = b.isbn) < b.quantity')
+
+# books rated above 3 by borrowers who share ratings with ?, scored by the number of shared ratings
+RECOMMEND = ('WITH similar AS ('
+             'SELECT o.username AS username, count(*) AS weight '
+             'FROM checkout m JOIN checkout o ON o.isbn = m.isbn AND o.rating = m.rating AND o.username <> m.username '
+             'WHERE m.username = ? '
+             'GROUP BY o.username) '
+             'SELECT ' + BOOK_COLUMNS + ', sum(s.weight) AS score '
+             'FROM similar s '
+             'JOIN checkout c ON c.username = s.username AND c.rating > 3 '
+             'JOIN book b ON b.isbn = c.isbn '
+             'WHERE c.isbn NOT IN (SELECT isbn FROM checkout WHERE username = ?) '
+             'GROUP BY b.isbn '
+             'ORDER BY score DESC, b.isbn '
+             'LIMIT ?')
+
+
+class Connection(sqlite3.Connection):
+    '''
+        A connection shared between threads, used under its lock
+
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+
+
+def connect(path):
+    '''
+        Open the database at path in WAL mode and create the schema when missing
+
+    '''
+    conn = sqlite3.connect(path, factory=Connection, check_same_thread=False, isolation_level=None,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    # readers no longer block the writer, and a commit only syncs the log
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    '''
+        Run the enclosed statements as one transaction holding the write lock from the start
+
+    '''
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def exists(conn, table, column, value):
+    return conn.execute('SELECT 1 FROM {} WHERE {} = ?'.format(table, column), (value,)).fetchone() is not None
+
+
+def chunks(items, size=LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def author_key(author):
+    if not author:
+        return None
+    return AUTHOR_KEY_SEPARATOR.join(author)
+
+
+def book_to_row(book):
+    return book.isbn, book.title, author_key(book.author), book.page_num, book.quantity
+
+
+def author_rows(book):
+    return [(book.isbn, position, name) for position, name in enumerate(book.author or [])]
+
+
+def keyset_where(column, value, isbn):
+    '''
+        The WHERE clause reading books after (value, isbn) in (column, isbn) order,
+        as a row value comparison SQLite seeks in the (column, isbn) index
+
+    :param column:
+    :param value: the column value of the last book read
+    :param isbn: the isbn of the last book read
+    :return: the clause and its parameters
+    '''
+    if column == 'isbn':
+        return 'WHERE b.isbn > ? ', (isbn,)
+    if value is None:
+        # NULLs sort first, the non-NULL values are read once these run out
+        return 'WHERE b.{} IS NULL AND b.isbn > ? '.format(column), (isbn,)
+    return 'WHERE (b.{}, b.isbn) > (?, ?) '.format(column), (value, isbn)
+
+
+def row_to_book(row):
+    if row is None:
+        return None
+    return Book(isbn=row[0], title=row[1], author=row[2].split(AUTHOR_KEY_SEPARATOR) if row[2] else [],
+                page_num=row[3], quantity=row[4])
+
+
+def row_to_borrower(row):
+    if row is None:
+        return None
+    return Borrower(username=row[0], name=row[1], phone=row[2])
+
+
+class SqliteLibrary(Library):
+    def __init__(self, path=None):
+        '''
+
+        :param path: the database file, or ':memory:'; the configured shared database when None
+        '''
+        self.conn = connect(path) if path else connections.get_sqlite()
+
+    def _query(self, statement, parameters=()):
+        with self.conn.lock:
+            return self.conn.execute(statement, parameters).fetchall()
+
+    def _books(self, statement, parameters=()):
+        return [row_to_book(row) for row in self._query(statement, parameters)]
+
+    def _borrowers(self, statement, parameters=()):
+        return [row_to_borrower(row) for row in self._query(statement, parameters)]
+
+    def drop_db(self):
+        '''
+            Drop the whole database so we can start from scratch
+
+        '''
+        with self.conn.lock, transaction(self.conn):
+            for table in ('checkout', 'book_author', 'book', 'borrower'):
+                self.conn.execute('DELETE FROM ' + table)
+
+    def add_book(self, book):
+        '''
+
+        :param book:
+        :raise: 'required_field_book.isbn', 'required_posivitive_field_book.page_num', 'posivitive_field_book.quantity', 'book_exist_already'
+        '''
+        Library.add_book(self, book)
+        with self.conn.lock, transaction(self.conn):
+            try:
+                self.conn.execute('INSERT INTO book VALUES (?, ?, ?, ?, ?)', book_to_row(book))
+            except sqlite3.IntegrityError:
+                raise Exception('book_exist_already')
+            self.conn.executemany('INSERT INTO book_author VALUES (?, ?, ?)', author_rows(book))
+
+    def add_books(self, books):
+        '''
+            Add books in one transaction with executemany
+
+        :param books:
+        :return: the error raised for each book by add_book, None where it was added
+        '''
+        books = list(books)
+        errors = [None] * len(books)
+        new_books = {}
+        for index, book in enumerate(books):
+            try:
+                Library.add_book(self, book)
+                if book.isbn in new_books:
+                    raise Exception('book_exist_already')
+                new_books[book.isbn] = index
+            except Exception as e:
+                errors[index] = e
+        with self.conn.lock, transaction(self.conn):
+            for isbns in chunks(list(new_books)):
+                for row in self.conn.execute('SELECT isbn FROM book WHERE isbn IN ({})'.format(
+                        ', '.join('?' * len(isbns))), isbns):
+                    errors[new_books.pop(row[0])] = Exception('book_exist_already')
+            self.conn.executemany('INSERT INTO book VALUES (?, ?, ?, ?, ?)',
+                                  (book_to_row(books[index]) for index in new_books.values()))
+            self.conn.executemany('INSERT INTO book_author VALUES (?, ?, ?)',
+                                  (row for index in new_books.values() for row in author_rows(books[index])))
+        return errors
+
+    def get_book(self, isbn):
+        '''
+
+        :param isbn:
+        :return: get the book by isbn
+        '''
+        for book in self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b WHERE b.isbn = ?', (isbn,)):
+            return book
+        return None
+
+    def get_books(self, isbns):
+        '''
+
+        :param isbns:
+        :return: the book of each isbn, None where it does not exist
+        '''
+        books = {}
+        for chunk in chunks(list(set(isbns))):
+            for book in self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b WHERE b.isbn IN ({})'.format(
+                    ', '.join('?' * len(chunk))), chunk):
+                books[book.isbn] = book
+        return [books.get(isbn) for isbn in isbns]
+
+    def delete_book(self, isbn):
+        '''
+
+        :param isbn:
+        :raise: 'book_not_exists', 'book_borrowed'
+        '''
+        with self.conn.lock:
+            # book_author rows go with the book through ON DELETE CASCADE
+            if self.conn.execute('DELETE FROM book WHERE isbn = ? '
+                                 'AND NOT EXISTS (SELECT 1 FROM checkout WHERE isbn = ?)',
+                                 (isbn, isbn)).rowcount == 0:
+                if exists(self.conn, 'book', 'isbn', isbn):
+                    raise Exception('book_borrowed')
+                raise Exception('book_not_exists')
+
+    def edit_book(self, isbn, book, override=False):
+        '''
+
+        :param isbn:
+        :param book:
+        :raise: 'book_not_exists', 'book_borrowed'
+        '''
+        with self.conn.lock, transaction(self.conn):
+            self._edit_book(isbn, book, override)
+
+    def edit_books(self, edits, override=False):
+        '''
+            Apply many edits in one transaction
+
+        :param edits: (isbn, book) pairs, applied as edit_book would
+        :return: the error raised for each edit by edit_book, None where it was applied
+        '''
+        with self.conn.lock, transaction(self.conn):
+            return each(lambda isbn, book: self._edit_book(isbn, book, override), edits)
+
+    def _edit_book(self, isbn, book, override):
+        old_book = row_to_book(self.conn.execute('SELECT ' + BOOK_COLUMNS + ' FROM book b WHERE b.isbn = ?',
+                                                 (isbn,)).fetchone())
+        if old_book is None:
+            raise Exception('book_not_exists')
+        author = old_book.author
+        if override or book.title:
+            old_book.title = book.title
+        if override or book.author:
+            old_book.author = book.author
+        if override or book.page_num:
+            old_book.page_num = book.page_num
+        if book.quantity:
+            count = self.conn.execute('SELECT count(*) FROM checkout WHERE isbn = ?', (isbn,)).fetchone()[0]
+            if count > book.quantity:
+                raise Exception('book_borrowed')
+            old_book.quantity = book.quantity
+        self.conn.execute('UPDATE book SET title = ?, author_key = ?, page_num = ?, quantity = ? WHERE isbn = ?',
+                          book_to_row(old_book)[1:] + (isbn,))
+        if (old_book.author or []) != author:
+            self.conn.execute('DELETE FROM book_author WHERE isbn = ?', (isbn,))
+            self.conn.executemany('INSERT INTO book_author VALUES (?, ?, ?)', author_rows(old_book))
+
+    def search_by_title(self, title):
+        '''
+
+        :param title:
+        :return: all books with this title
+        '''
+        return self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b WHERE b.title = ?', (title,))
+
+    def search_by_author(self, author):
+        '''
+
+        :param author:
+        :return: all books by this author
+        '''
+        return self._books('SELECT ' + BOOK_COLUMNS + ' FROM book_author a JOIN book b ON b.isbn = a.isbn '
+                           'WHERE a.name = ?', (author,))
+
+    def sort_by_title(self):
+        '''
+
+        :return: all books sorted by title
+        '''
+        return self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b ORDER BY b.title')
+
+    def sort_by_author(self):
+        '''
+
+        :return: all books sorted by author
+        '''
+        return self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b ORDER BY b.author_key')
+
+    def sort_by_isbn(self):
+        '''
+
+        :return: all books sorted by isbn
+        '''
+        return self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b ORDER BY b.isbn')
+
+    def sort_by_page_num(self):
+        '''
+
+        :return: all books sorted by page number
+        '''
+        return self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b ORDER BY b.page_num')
+
+    def iter_sorted(self, field, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream all books sorted by field, ties ordered by isbn, one indexed range query per page
+
+        :param field: 'title', 'author', 'isbn' or 'page_num'
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>', 'book_not_exists'
+        '''
+        check_field(field, SORT_FIELDS)
+        return self._sorted_pages(field, page_size, after_book(self, after))
+
+    def _sorted_pages(self, field, page_size, book):
+        column = SORT_COLUMNS[field]
+        nulls_read = False
+        while True:
+            if book is None:
+                where, parameters = ('WHERE b.{} IS NOT NULL '.format(column) if nulls_read else ''), ()
+            else:
+                value = author_key(book.author) if field == 'author' else getattr(book, field)
+                where, parameters = keyset_where(column, value, book.isbn)
+            books = self._books('SELECT ' + BOOK_COLUMNS + ' FROM book b ' + where +
+                                'ORDER BY b.{}, b.isbn LIMIT ?'.format(column), parameters + (page_size,))
+            for found in books:
+                yield found
+            if len(books) < page_size:
+                if book is None or column == 'isbn' or value is not None:
+                    return
+                # the NULLs ran out before the page did, go on with the first value
+                book, nulls_read = None, True
+            else:
+                book = books[-1]
+
+    def iter_search(self, field, value, page_size=PAGE_SIZE, after=None):
+        '''
+            Stream the books found by title or author, ordered by isbn, one indexed range query per page
+
+        :param field: 'title' or 'author'
+        :param value:
+        :param page_size:
+        :param after: the isbn of the last book already read
+        :return: an iterator of books
+        :raise: 'invalid_field_<field>'
+        '''
+        check_field(field, SEARCH_FIELDS)
+        if field == 'title':
+            statement = 'SELECT ' + BOOK_COLUMNS + ' FROM book b WHERE b.title = ? AND b.isbn > ? '
+        else:
+            statement = ('SELECT ' + BOOK_COLUMNS + ' FROM book_author a JOIN book b ON b.isbn = a.isbn '
+                         'WHERE a.name = ? AND a.isbn > ? ')
+        return self._search_pages(statement + 'ORDER BY b.isbn LIMIT ?', value, page_size, after)
+
+    def _search_pages(self, statement, value, page_size, after):
+        while True:
+            # every isbn sorts after the empty string
+            books = self._books(statement, (value, after if after is not None else '', page_size))
+            for book in books:
+                yield book
+            if len(books) < page_size:
+                return
+            after = books[-1].isbn
+
+    def add_borrower(self, borrower):
+        '''
+
+        :param borrower:
+        :raise: 'required_field_borrower.username', 'borrower_already_exists'
+        '''
+        Library.add_borrower(self, borrower)
+        with self.conn.lock:
+            try:
+                self.conn.execute('INSERT INTO borrower VALUES (?, ?, ?)',
+                                  (borrower.username, borrower.name, borrower.phone))
+            except sqlite3.IntegrityError:
+                raise Exception('borrower_already_exists')
+
+    def add_borrowers(self, borrowers):
+        '''
+            Add borrowers in one transaction with executemany
+
+        :param borrowers:
+        :return: the error raised for each borrower by add_borrower, None where it was added
+        '''
+        borrowers = list(borrowers)
+        errors = [None] * len(borrowers)
+        new_borrowers = {}
+        for index, borrower in enumerate(borrowers):
+            try:
+                Library.add_borrower(self, borrower)
+                if borrower.username in new_borrowers:
+                    raise Exception('borrower_already_exists')
+                new_borrowers[borrower.username] = index
+            except Exception as e:
+                errors[index] = e
+        with self.conn.lock, transaction(self.conn):
+            for usernames in chunks(list(new_borrowers)):
+                for row in self.conn.execute('SELECT username FROM borrower WHERE username IN ({})'.format(
+                        ', '.join('?' * len(usernames))), usernames):
+                    errors[new_borrowers.pop(row[0])] = Exception('borrower_already_exists')
+            self.conn.executemany('INSERT INTO borrower VALUES (?, ?, ?)',
+                                  ((b.username, b.name, b.phone) for b in
+                                   (borrowers[index] for index in new_borrowers.values())))
+        return errors
+
+    def get_borrower(self, username):
+        '''
+
+        :param username:
+        :return: the borrower with this username
+        '''
+        for borrower in self._borrowers('SELECT ' + BORROWER_COLUMNS + ' FROM borrower u WHERE u.username = ?',
+                                        (username,)):
+            return borrower
+        return None
+
+    def delete_borrower(self, username):
+        '''
+
+        :param username:
+        :raise 'borrower_not_exists', 'book_borrowed'
+        '''
+        with self.conn.lock:
+            if self.conn.execute('DELETE FROM borrower WHERE username = ? '
+                                 'AND NOT EXISTS (SELECT 1 FROM checkout WHERE username = ?)',
+                                 (username, username)).rowcount == 0:
+                if exists(self.conn, 'borrower', 'username', username):
+                    raise Exception('book_borrowed')
+                raise Exception('borrower_not_exists')
+
+    def edit_borrower(self, username, borrower, override=False):
+        '''
+
+        :param username:
+        :param borrower:
+        :raise 'borrower_not_exists
+        '''
+        with self.conn.lock, transaction(self.conn):
+            old_borrower = row_to_borrower(self.conn.execute('SELECT ' + BORROWER_COLUMNS + ' FROM borrower u '
+                                                             'WHERE u.username = ?', (username,)).fetchone())
+            if old_borrower is None:
+                raise Exception('borrower_not_exists')
+            if override or borrower.name:
+                old_borrower.name = borrower.name
+            if override or borrower.phone:
+                old_borrower.phone = borrower.phone
+            self.conn.execute('UPDATE borrower SET name = ?, phone = ? WHERE username = ?',
+                              (old_borrower.name, old_borrower.phone, username))
+
+    def search_by_name(self, name):
+        '''
+
+        :param name:
+        :return: borrowers with this name
+        '''
+        return self._borrowers('SELECT ' + BORROWER_COLUMNS + ' FROM borrower u WHERE u.name = ?', (name,))
+
+    def checkout_book(self, username, isbn):
+        '''
+
+        :param username:
+        :param isbn:
+        :raise 'book_not_exists', 'borrower_not_exists', 'book_already_borrowed', 'book_not_available'
+        '''
+        with self.conn.lock:
+            if self.conn.execute(CHECKOUT, (username, isbn, username)).rowcount == 0:
+                if not exists(self.conn, 'book', 'isbn', isbn):
+                    raise Exception('book_not_exists')
+                if not exists(self.conn, 'borrower', 'username', username):
+                    raise Exception('borrower_not_exists')
+                if self.conn.execute('SELECT 1 FROM checkout WHERE isbn = ? AND username = ?',
+                                     (isbn, username)).fetchone():
+                    raise Exception('book_already_borrowed')
+                raise Exception('book_not_available')
+
+    def checkout_many(self, checkouts):
+        '''
+            Check out many books in one transaction, so they share a single commit
+
+        :param checkouts: (username, isbn) pairs
+        :return: the error raised for each checkout by checkout_book, None where it succeeded
+        '''
+        with self.conn.lock, transaction(self.conn):
+            return each(self.checkout_book, checkouts)
+
+    def return_book(self, username, isbn):
+        '''
+
+        :param username:
+        :param isbn:
+        :raise: `borrower_not_exists`, `book_not_exists`, `book_not_borrowed`
+        '''
+        with self.conn.lock:
+            if self.conn.execute('DELETE FROM checkout WHERE isbn = ? AND username = ?',
+                                 (isbn, username)).rowcount == 0:
+                if not exists(self.conn, 'borrower', 'username', username):
+                    raise Exception('borrower_not_exists')
+                if not exists(self.conn, 'book', 'isbn', isbn):
+                    raise Exception('book_not_exists')
+                raise Exception('book_not_borrowed')
+
+    def return_many(self, returns):
+        '''
+            Return many books in one transaction, so they share a single commit
+
+        :param returns: (username, isbn) pairs
+        :return: the error raised for each return by return_book, None where it succeeded
+        '''
+        with self.conn.lock, transaction(self.conn):
+            return each(self.return_book, returns)
+
+    def get_book_borrowers(self, isbn):
+        '''
+
+        :param isbn:
+        :return: the borrowers that have borrowed this book
+        :raise: 'book_not_exists'
+        '''
+        with self.conn.lock:
+            borrowers = self._borrowers('SELECT ' + BORROWER_COLUMNS + ' FROM checkout c '
+                                        'JOIN borrower u ON u.username = c.username WHERE c.isbn = ?', (isbn,))
+            if not borrowers and not exists(self.conn, 'book', 'isbn', isbn):
+                raise Exception('book_not_exists')
+            return borrowers
+
+    def get_borrowed_books(self, username):
+        '''
+
+        :param username:
+        :return:
+        :raise: 'borrower_not_exists'
+        '''
+        with self.conn.lock:
+            books = self._books('SELECT ' + BOOK_COLUMNS + ' FROM checkout c '
+                                'JOIN book b ON b.isbn = c.isbn WHERE c.username = ?', (username,))
+            if not books and not exists(self.conn, 'borrower', 'username', username):
+                raise Exception('borrower_not_exists')
+            return books
+
+    def _checkout_error(self, username, isbn):
+        if not exists(self.conn, 'book', 'isbn', isbn):
+            return Exception('book_not_exists')
+        if not exists(self.conn, 'borrower', 'username', username):
+            return Exception('borrower_not_exists')
+        return Exception('book_not_checked_out')
+
+    def rate_book(self, username, isbn, rating):
+        '''
+
+        :param username:
+        :param isbn:
+        :param rating:
+        :return:
+        :raise: 'borrower_not_exists'
+        :raise: 'book_not_exists'
+        :raise: 'rating_between_1_and_5'
+        :raise: 'book_not_checked_out'
+        '''
+        if rating < 1 or rating > 5:
+            raise Exception('rating_between_1_and_5')
+        with self.conn.lock:
+            if self.conn.execute('UPDATE checkout SET rating = ? WHERE isbn = ? AND username = ?',
+                                 (rating, isbn, username)).rowcount == 0:
+                raise self._checkout_error(username, isbn)
+
+    def get_rating(self, username, isbn):
+        '''
+
+        :param username:
+        :param isbn:
+        :return:
+        :raise: 'borrower_not_exists'
+        :raise: 'book_not_exists'
+        :raise: 'book_not_checked_out'
+        '''
+        with self.conn.lock:
+            row = self.conn.execute('SELECT rating FROM checkout WHERE isbn = ? AND username = ?',
+                                    (isbn, username)).fetchone()
+            if row is None:
+                raise self._checkout_error(username, isbn)
+            return row[0]
+
+    def recommend(self, username, k=10):
+        '''
+            Rank the books rated above 3 by similar borrowers, weighted by how many
+            ratings each shares with this borrower, skipping books already borrowed
+
+        :param username:
+        :param k: the number of books to return
+        :raise: 'non_negative_field_k', 'borrower_not_exists'
+        :return: at most k books, best first
+        '''
+        Library.recommend(self, username, k)
+        with self.conn.lock:
+            books = self._books(RECOMMEND, (username, username, k))
+            if not books and not exists(self.conn, 'borrower', 'username', username):
+                raise Exception('borrower_not_exists')
+            return books
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from library_app.library_test import LibraryTest, RatingLibraryTest, book_toadd, book_toadd2, book_toadd3, \
+    borrower_toadd1, borrower_toadd2
+from library_app.model import Book
+from library_app.sqlite.sqlite_library import SqliteLibrary, keyset_where
+
+
+class SqliteLibraryTest(LibraryTest, RatingLibraryTest, unittest.TestCase):
+
+    def setUpClient(self):
+        self.client = SqliteLibrary(':memory:')
+
+    def test_add_books(self):
+        errors = self.client.add_books([book_toadd2, book_toadd, Book(isbn='10'), book_toadd3, book_toadd2])
+
+        self.assertEqual([str(e) if e else None for e in errors],
+                         [None, 'book_exist_already', 'required_posivitive_field_book.page_num', None,
+                          'book_exist_already'])
+        self.assertListEqual(self.client.sort_by_isbn(), [book_toadd, book_toadd2, book_toadd3])
+        self.assertCountEqual(self.client.search_by_author('Chandan'), [book_toadd2, book_toadd3])
+
+    def test_add_borrowers(self):
+        errors = self.client.add_borrowers([borrower_toadd2, borrower_toadd1])
+
+        self.assertEqual([str(e) if e else None for e in errors], [None, 'borrower_already_exists'])
+        self.assertEqual(self.client.get_borrower('zhangq2'), borrower_toadd2)
+
+    def test_search_by_author_after_edit(self):
+        self.client.add_book(book_toadd3)
+        self.client.edit_book('3', Book(author=['Qi']))
+
+        self.assertListEqual(self.client.search_by_author('Sriram'), [book_toadd])
+        self.assertListEqual([b.isbn for b in self.client.search_by_author('Qi')], ['3'])
+
+    def test_queries_use_indexes(self):
+        for statement in ('SELECT * FROM book WHERE title = ?', 'SELECT * FROM book_author WHERE name = ?',
+                          'SELECT * FROM borrower WHERE name = ?', 'SELECT * FROM checkout WHERE username = ?'):
+            plan = ' '.join(row[-1] for row in self.client.conn.execute('EXPLAIN QUERY PLAN ' + statement, ('x',)))
+            self.assertIn('USING INDEX', plan)
+        for column in ('title', 'author_key', 'page_num'):
+            plan = ' '.join(row[-1] for row in
+                            self.client.conn.execute('EXPLAIN QUERY PLAN SELECT * FROM book ORDER BY ' + column))
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_sorted_pages_seek_indexes(self):
+        for column in ('title', 'author_key', 'page_num'):
+            where, parameters = keyset_where(column, 'x', '1')
+            plan = ' '.join(row[-1] for row in self.client.conn.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM book b ' + where + 'ORDER BY b.{}, b.isbn LIMIT 10'.format(column),
+                parameters))
+            self.assertIn('SEARCH b USING INDEX book_{}_isbn'.format(column), plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_iter_sorted_past_nulls(self):
+        self.client.add_book(book_toadd2)
+        self.client.add_book(book_toadd3)
+        self.client.conn.execute("UPDATE book SET title = NULL WHERE isbn IN ('1', '3')")
+
+        self.assertListEqual([b.isbn for b in self.client.iter_sorted('title', page_size=1)], ['1', '3', '2'])
+        self.assertListEqual([b.isbn for b in self.client.iter_sorted('title', page_size=2)], ['1', '3', '2'])
+        self.assertListEqual([b.isbn for b in self.client.iter_sorted('title', after='1')], ['3', '2'])
+
+    def test_file_database_uses_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            client = SqliteLibrary(os.path.join(directory, 'library.db'))
+            client.add_book(book_toadd)
+
+            self.assertEqual(client.conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(SqliteLibrary(os.path.join(directory, 'library.db')).get_book('1'), book_toadd)
+            client.conn.close()
@@ -1,6 +1,13 @@
 from library_app.redis.redis_library_test import RedisLibraryTest
 from library_app.mongo.mongo_library_test import MongoLibraryTest
 from library_app.neo4j.neo4j_library_test import Neo4jLibraryTest
+from library_app.memory.memory_library_test import InMemoryLibraryTest
+from library_app.sqlite.sqlite_library_test import SqliteLibraryTest
+from library_app.cached_library_test import CachedLibraryTest
+from library_app.instrumented_library_test import InstrumentedLibraryTest, HistogramTest
+from library_app.async_library_test import ExecutorLibraryTest
+from library_app.redis.redis_async_library_test import AsyncRedisLibraryTest
+from library_app.mongo.mongo_async_library_test import AsyncMongoLibraryTest
 import unittest
 
 if __name__ == '__main__':
@@ -8,9 +8,11 @@ setup(
    author_email='zhangq2@rose-hulman.com',
    packages=[''],  #same as name
    install_requires=['redis', 'pymongo', 'neo4j-driver', 'python-memcached', 'click'], #external packages as dependencies
+   extras_require={'async': ['redis>=4.2', 'motor']},  # the asyncio redis and mongo clients
    py_modules=['library_cli'],
    entry_points='''
        [console_scripts]
        library_cli=library_app.library_app_cli:safe_cli
+       library_bench=library_app.library_bench:main
    ''',
 )
\ No newline at end of file